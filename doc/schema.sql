@@ -67,6 +67,24 @@ CREATE TABLE jobalarm (
 CREATE INDEX jobalarm_jobid ON jobalarm (jobid);
 CREATE INDEX jobalarm_datetime ON jobalarm (datetime);
 
+CREATE TABLE jobevent (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jobid INTEGER NOT NULL,
+    type INTEGER NOT NULL,
+    eventid INTEGER NOT NULL,
+    datetime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    status INTEGER DEFAULT NULL,
+    command VARCHAR(255) DEFAULT NULL,
+
+    FOREIGN KEY (jobid) REFERENCES job(id)
+        ON DELETE RESTRICT ON UPDATE RESTRICT
+)
+-- MySQL: ENGINE=InnoDB
+;
+
+CREATE INDEX jobevent_jobid ON jobevent (jobid, id);
+CREATE INDEX jobevent_datetime ON jobevent (datetime);
+
 CREATE TABLE joboutput (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     finishid INTEGER NOT NULL,
@@ -121,11 +139,46 @@ CREATE TABLE jobnotify (
 CREATE INDEX jobnotify_host ON jobnotify (host);
 CREATE INDEX jobnotify_user ON jobnotify (user);
 
+CREATE TABLE notifyqueue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    method VARCHAR(255) NOT NULL,
+    address TEXT NOT NULL,
+    message TEXT NOT NULL,
+    datetime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    error TEXT DEFAULT NULL,
+    dead BOOLEAN NOT NULL DEFAULT 0
+)
+-- MySQL: ENGINE=InnoDB
+;
+
+CREATE INDEX notifyqueue_next_attempt ON notifyqueue (dead, next_attempt);
+
+CREATE TABLE lease (
+    name VARCHAR(255) NOT NULL PRIMARY KEY,
+    holder VARCHAR(255) NOT NULL,
+    expires TIMESTAMP NOT NULL
+)
+-- MySQL: ENGINE=InnoDB
+;
+
+CREATE TABLE monitorstatus (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jobid INTEGER NOT NULL,
+    status TEXT DEFAULT NULL
+)
+-- MySQL: ENGINE=InnoDB
+;
+
+CREATE INDEX monitorstatus_jobid ON monitorstatus (jobid);
+
 CREATE TABLE rawcrontab (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     host VARCHAR(255) NOT NULL,
     user VARCHAR(255) NOT NULL,
     crontab TEXT NOT NULL,
+    hash VARCHAR(64) DEFAULT NULL,
 
     UNIQUE (host, user)
 )
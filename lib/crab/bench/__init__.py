@@ -0,0 +1,150 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+import os
+import platform
+from time import perf_counter, process_time
+
+from crab import CrabError
+from crab.store.sqlite import CrabStoreSQLite
+from crab.version import version
+
+CrabBenchJob = namedtuple('CrabBenchJob', ('host', 'user', 'crabid', 'time'))
+
+
+class CrabBenchResults():
+    """Class collecting the results of a benchmark run."""
+
+    def __init__(self, **parameters):
+        self.parameters = parameters
+        self.results = {}
+
+    def time(self, name, func, count=1):
+        """Calls the given function, recording the time taken.
+
+        The "count" indicates the number of operations which the function
+        performs, for the purpose of calculating the rate and mean time
+        per operation.  The function's return value is returned."""
+
+        start = perf_counter()
+        value = func()
+        seconds = perf_counter() - start
+
+        self.record(name, seconds, count)
+
+        return value
+
+    def record(self, name, seconds, count=1):
+        """Records the time taken for the given number of operations."""
+
+        if name in self.results:
+            raise CrabError('benchmark result {} already recorded'.format(
+                name))
+
+        self.results[name] = {
+            'count': count,
+            'seconds': seconds,
+            'mean': (seconds / count) if count else None,
+            'rate': (count / seconds) if seconds else None,
+        }
+
+    def as_dict(self):
+        """Returns the results, and information about the environment,
+        as a dictionary suitable for writing as JSON."""
+
+        return {
+            'crab': version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': self.parameters,
+            'results': self.results,
+        }
+
+
+class CrabBenchTimer():
+    """Wrapper for a function which accumulates the processor time
+    taken by calls to it."""
+
+    def __init__(self, func):
+        self.func = func
+        self.seconds = 0.0
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        start = process_time()
+
+        try:
+            return self.func(*args, **kwargs)
+
+        finally:
+            self.seconds += process_time() - start
+            self.count += 1
+
+
+def make_store(schema, filename=':memory:', event_log=False):
+    """Creates an SQLite store with the given schema file.
+
+    If a filename other than ":memory:" is given, the database file
+    must not already exist."""
+
+    if filename != ':memory:':
+        if os.path.exists(filename):
+            raise CrabError('database file {} already exists'.format(
+                filename))
+
+        open(filename, 'w').close()
+
+    with open(schema) as file:
+        store = CrabStoreSQLite(filename, event_log=event_log)
+        store.lock.conn.executescript(file.read())
+
+    return store
+
+
+def make_fleet(hosts, users, jobs):
+    """Generates a synthetic fleet of cron jobs.
+
+    Returns a dictionary of lists of CrabBenchJob tuples by
+    (host, user) pair.  Jobs are given schedules spread through the
+    day so that they do not all run in the same minute."""
+
+    fleet = {}
+    n = 0
+    total = hosts * users * jobs
+
+    for i in range(hosts):
+        host = 'host{:04d}'.format(i)
+
+        for j in range(users):
+            user = 'user{:02d}'.format(j)
+            entries = fleet[(host, user)] = []
+
+            for k in range(jobs):
+                minute = (n * 1440) // total
+                entries.append(CrabBenchJob(
+                    host, user, 'job{:03d}'.format(k),
+                    '{} {} * * *'.format(minute % 60, minute // 60)))
+                n += 1
+
+    return fleet
+
+
+def fleet_crontab(entries):
+    """Returns crontab lines for the given list of CrabBenchJob tuples."""
+
+    return [
+        '{} CRABID={} bench_command {}'.format(job.time, job.crabid, i)
+        for (i, job) in enumerate(entries)]
@@ -0,0 +1,127 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from optparse import OptionParser
+import sys
+
+from crab.bench import CrabBenchResults, make_fleet, make_store
+from crab.bench.monitor import run_monitor_benchmark
+from crab.bench.store import run_store_benchmark
+
+BENCHMARKS = ('store', 'monitor')
+
+
+def main():
+    parser = OptionParser(
+        usage='python -m crab.bench [options] [benchmark ...]',
+        description='Available benchmarks: ' + ', '.join(BENCHMARKS))
+    parser.add_option(
+        '--schema',
+        type='string', dest='schema', default='doc/schema.sql',
+        help='database schema file (default: %default)', metavar='FILE')
+    parser.add_option(
+        '--database',
+        type='string', dest='database', default=':memory:',
+        help='new SQLite database file for the store benchmark '
+             '(default: %default)', metavar='FILE')
+    parser.add_option(
+        '--event-log',
+        action='store_true', dest='event_log',
+        help='record events in the combined event log table')
+    parser.add_option(
+        '--hosts',
+        type='int', dest='hosts', default=10,
+        help='number of hosts (default: %default)', metavar='N')
+    parser.add_option(
+        '--users',
+        type='int', dest='users', default=2,
+        help='number of users per host (default: %default)', metavar='N')
+    parser.add_option(
+        '--jobs',
+        type='int', dest='jobs', default=10,
+        help='number of jobs per user (default: %default)', metavar='N')
+    parser.add_option(
+        '--rounds',
+        type='int', dest='rounds', default=5,
+        help='number of times each job runs (default: %default)',
+        metavar='N')
+    parser.add_option(
+        '--repeat',
+        type='int', dest='repeat', default=10,
+        help='number of times to repeat queries (default: %default)',
+        metavar='N')
+    parser.add_option(
+        '--minutes',
+        type='int', dest='minutes', default=1440,
+        help='number of minutes to simulate (default: %default)',
+        metavar='N')
+    parser.add_option(
+        '--threads',
+        type='int', dest='threads', default=1,
+        help='number of client threads (default: %default)', metavar='N')
+    parser.add_option(
+        '--seed',
+        type='int', dest='seed', default=0,
+        help='random number seed (default: %default)', metavar='N')
+    parser.add_option(
+        '--output',
+        type='string', dest='output',
+        help='write JSON results to FILE', metavar='FILE')
+
+    (options, args) = parser.parse_args()
+
+    benchmarks = args if args else BENCHMARKS
+
+    for benchmark in benchmarks:
+        if benchmark not in BENCHMARKS:
+            parser.error('unknown benchmark: {}'.format(benchmark))
+
+    results = CrabBenchResults(
+        benchmarks=list(benchmarks),
+        hosts=options.hosts, users=options.users, jobs=options.jobs,
+        rounds=options.rounds, repeat=options.repeat,
+        minutes=options.minutes, event_log=options.event_log,
+        threads=options.threads, seed=options.seed)
+
+    fleet = make_fleet(options.hosts, options.users, options.jobs)
+
+    if 'store' in benchmarks:
+        store = make_store(
+            options.schema, options.database, event_log=options.event_log)
+
+        run_store_benchmark(
+            results, store, fleet, rounds=options.rounds,
+            repeat=options.repeat, threads=options.threads,
+            seed=options.seed)
+
+    if 'monitor' in benchmarks:
+        store = make_store(options.schema, event_log=options.event_log)
+
+        run_monitor_benchmark(
+            results, store, fleet, minutes=options.minutes,
+            seed=options.seed)
+
+    if options.output is None:
+        json.dump(results.as_dict(), sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write('\n')
+
+    else:
+        with open(options.output, 'w') as file:
+            json.dump(results.as_dict(), file, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+from random import Random
+
+import pytz
+
+from crab.bench import CrabBenchTimer, fleet_crontab
+from crab.bench.store import FINISH_STATUSES
+from crab.service import CrabSimulatedClock
+from crab.service.monitor import CrabMonitor
+
+EVENT_TABLES = ('jobstart', 'jobalarm', 'jobfinish', 'jobevent')
+
+
+def run_monitor_benchmark(
+        results, store, fleet, minutes=1440, miss=0.01, seed=0):
+    """Measures the processor time used by the monitor.
+
+    The monitor is run with a simulated clock for the given number of
+    minutes.  Each job in the fleet starts when scheduled, except for a
+    fraction "miss" of them, and finishes a few seconds later.
+
+    The time taken by run_interval and by timeout processing is recorded
+    with the number of minutes as the count, so that the mean gives
+    the cost per minute."""
+
+    random = Random(seed)
+
+    for ((host, user), entries) in sorted(fleet.items()):
+        store.save_crontab(host, user, fleet_crontab(entries))
+
+    scheduled = {}
+    for entries in fleet.values():
+        for job in entries:
+            (minute, hour) = (int(x) for x in job.time.split()[:2])
+            scheduled.setdefault((hour, minute), []).append(job)
+
+    clock = CrabSimulatedClock(
+        datetime.now(pytz.UTC).replace(second=0, microsecond=0))
+    monitor = CrabMonitor(store, clock=clock)
+
+    results.time('monitor_initialize', monitor._initialize)
+
+    # Replace the monitor's methods with timing wrappers.  The monitor
+    # calls these via its instance, so will find the wrappers.
+    tick = monitor._tick = CrabBenchTimer(monitor._tick)
+    run_interval = monitor.run_interval = CrabBenchTimer(monitor.run_interval)
+    timeouts = monitor._check_timeouts = CrabBenchTimer(
+        monitor._check_timeouts)
+    process_event = monitor._process_event = CrabBenchTimer(
+        monitor._process_event)
+
+    last_ids = dict((table, 0) for table in EVENT_TABLES)
+    running = []
+
+    for i in range(minutes * 12):
+        clock.sleep(5)
+        monitor._tick()
+        datetime_ = clock.now()
+
+        for job in running:
+            store.log_finish(
+                job.host, job.user, job.crabid, 'bench_command',
+                random.choice(FINISH_STATUSES))
+
+        running = []
+
+        if datetime_.second == 0:
+            for job in scheduled.get((datetime_.hour, datetime_.minute), ()):
+                if random.random() >= miss:
+                    store.log_start(
+                        job.host, job.user, job.crabid, 'bench_command')
+                    running.append(job)
+
+        _set_event_times(store, last_ids, datetime_)
+
+    results.record('monitor_tick', tick.seconds, tick.count)
+    results.record('monitor_run_interval', run_interval.seconds, minutes)
+    results.record('monitor_timeouts', timeouts.seconds, minutes)
+    results.record(
+        'monitor_process_event', process_event.seconds, process_event.count)
+
+
+def _set_event_times(store, last_ids, datetime_):
+    """Sets the time of new events to the simulated time.
+
+    Events are otherwise recorded with the real time, which would
+    confuse the monitor."""
+
+    datetime_ = datetime_.replace(tzinfo=None)
+
+    with store.lock as c:
+        for table in EVENT_TABLES:
+            c.execute(
+                'UPDATE ' + table + ' SET datetime=? WHERE id>?',
+                [datetime_, last_ids[table]])
+
+            c.execute('SELECT MAX(id) FROM ' + table)
+            last_ids[table] = c.fetchone()[0] or 0
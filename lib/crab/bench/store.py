@@ -0,0 +1,142 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from random import Random
+from time import perf_counter
+
+import pytz
+
+from crab import CrabStatus
+from crab.bench import fleet_crontab
+
+# Statuses with which jobs finish, weighted towards success.
+FINISH_STATUSES = (
+    [CrabStatus.SUCCESS] * 17 + [CrabStatus.FAIL, CrabStatus.WARNING,
+                                 CrabStatus.UNKNOWN])
+
+
+def run_store_benchmark(
+        results, store, fleet, rounds=5, repeat=10, threads=1, seed=0):
+    """Measures the performance of the store.
+
+    The crontabs of the given fleet are saved, and then each job
+    logs "rounds" start and finish events, using the given number of
+    threads.  Queries are then timed, performing each "repeat" times.
+    Finally half of the events are back-dated and deleted."""
+
+    random = Random(seed)
+    jobs = [job for entries in fleet.values() for job in entries]
+
+    results.time(
+        'save_crontab',
+        lambda: [
+            store.save_crontab(host, user, fleet_crontab(entries))
+            for ((host, user), entries) in sorted(fleet.items())],
+        len(fleet))
+
+    # Re-saving unchanged crontabs is the common case for clients.
+    results.time(
+        'save_crontab_unchanged',
+        lambda: [
+            store.save_crontab(host, user, fleet_crontab(entries))
+            for ((host, user), entries) in sorted(fleet.items())],
+        len(fleet))
+
+    def log_start(job):
+        store.log_start(
+            job.host, job.user, job.crabid, 'bench_command')
+
+    def log_finish(job_status):
+        (job, status) = job_status
+        store.log_finish(
+            job.host, job.user, job.crabid, 'bench_command', status,
+            'output of {}'.format(job.crabid), '')
+
+    start_time = finish_time = 0.0
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for i in range(rounds):
+            statuses = [random.choice(FINISH_STATUSES) for job in jobs]
+
+            start = perf_counter()
+            list(pool.map(log_start, jobs))
+            start_time += perf_counter() - start
+
+            start = perf_counter()
+            list(pool.map(log_finish, zip(jobs, statuses)))
+            finish_time += perf_counter() - start
+
+    results.record('log_start', start_time, rounds * len(jobs))
+    results.record('log_finish', finish_time, rounds * len(jobs))
+
+    ids = [job['id'] for job in store.get_jobs()]
+
+    for id_ in random.sample(ids, max(1, len(ids) // 100)):
+        store.log_alarm(id_, CrabStatus.MISSED)
+
+    # Pass a log ID, as the monitor does, so that the event log is used
+    # if enabled.
+    results.time(
+        'get_events_since_all',
+        lambda: [
+            store.get_events_since(0, 0, 0, logid=0) for i in range(repeat)],
+        repeat)
+
+    # Fetch approximately the last round of events, as the monitor would
+    # when catching up after a short delay.
+    events = store.get_events_since(0, 0, 0, logid=0)
+    max_id = {}
+    for event in events:
+        max_id[event['type']] = max(
+            max_id.get(event['type'], 0), event['eventid'])
+    recent = [max(0, max_id.get(x, 0) - len(jobs)) for x in (1, 2, 3)]
+    recent_logid = max(0, len(events) - 2 * len(jobs))
+
+    results.time(
+        'get_events_since_recent',
+        lambda: [
+            store.get_events_since(*recent, logid=recent_logid)
+            for i in range(repeat)],
+        repeat)
+
+    sample = random.sample(ids, min(len(ids), repeat * 10))
+
+    results.time(
+        'get_job_events',
+        lambda: [store.get_job_events(id_) for id_ in sample],
+        len(sample))
+
+    results.time(
+        'get_fail_events',
+        lambda: [store.get_fail_events() for i in range(repeat)],
+        repeat)
+
+    # Back-date half of the events so that the cleaning operation
+    # has something to delete.
+    old = datetime.now(pytz.UTC).replace(
+        tzinfo=None, microsecond=0) - timedelta(days=30)
+
+    with store.lock as c:
+        for table in ('jobstart', 'jobfinish', 'jobalarm', 'jobevent'):
+            c.execute(
+                'UPDATE ' + table + ' SET datetime=? WHERE id % 2 = 0',
+                [old])
+
+    results.time(
+        'delete_old_events',
+        lambda: store.delete_old_events(old + timedelta(days=1)),
+        len(events) // 2)
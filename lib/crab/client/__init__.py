@@ -46,6 +46,7 @@ except:
     from httplib import HTTPConnection, HTTPException
 
 from crab import CrabError, CrabStatus
+from crab.util.crontab import crontab_hash
 
 
 class CrabClient:
@@ -147,21 +148,72 @@ class CrabClient:
                 'stderr':   stderrdata,
             })
 
-    def send_crontab(self, crontab, timezone=None):
+    def send_crontab(self, crontab, timezone=None, force=False):
         """Takes the crontab as a string, breaks it into lines,
         and transmits it to the server.
 
-        Returns a list of warnings."""
+        Unless the "force" option is specified, the server is asked
+        not to process the crontab if it has not changed since it was
+        last imported.
+
+        Returns a list of warnings, which will be empty if the crontab
+        was not processed."""
+
+        lines = crontab.split('\n')
+        headers = {}
+
+        if not force:
+            headers['If-None-Match'] = \
+                '"' + crontab_hash(lines, timezone) + '"'
 
         data = self._write_json(
             self._get_url('crontab'), {
-                'crontab': crontab.split('\n'),
+                'crontab': lines,
                 'timezone': timezone,
             },
-            read=True)
+            read=True, headers=headers)
+
+        if data is None:
+            return []
 
         return data['warning']
 
+    def send_crontabs(self, entries, force=False):
+        """Transmits a number of crontabs to the server in one request.
+
+        The entries should be dictionaries containing "host", "user",
+        "crontab" (as a string) and optionally "timezone".  They are
+        streamed to the server as they are read from the given iterable,
+        except with Python versions before 3.6, which do not support
+        this.
+
+        Returns a list of result dictionaries, giving the "line" number
+        (counting from 1), "host", "user" and "warning" list for each
+        entry, or an "error" message if the entry was not understood.
+        Crontabs which had not changed are marked as "unchanged" unless
+        the "force" option was specified."""
+
+        url = '/api/0/crontabs'
+        if force:
+            url = url + '?force=true'
+
+        def body():
+            for entry in entries:
+                entry = dict(entry)
+                entry['crontab'] = entry['crontab'].split('\n')
+                yield latin_1_encode(json.dumps(entry) + '\n')[0]
+
+        body = body()
+
+        # Iterable bodies are only sent with chunked transfer encoding
+        # from Python 3.6, so otherwise send the whole body at once.
+        if sys.version_info < (3, 6):
+            body = b''.join(body)
+
+        data = self._put(url, body, read=True)
+
+        return data['results']
+
     def fetch_crontab(self, raw=False):
         """Retrieves crontab lines from the server, and returns
         them as a single string."""
@@ -311,21 +363,37 @@ class CrabClient:
             if conn is not None:
                 conn.close()
 
-    def _write_json(self, url, obj, read=False):
+    def _write_json(self, url, obj, read=False, headers={}):
         """Converts the given object to JSON and sends it with an
         HTTP PUT to the given URL.
 
-        Optionally attempts to read JSON from the response."""
+        Optionally attempts to read JSON from the response.
+
+        Additional HTTP headers can be given.  If these include
+        If-None-Match and the server responds that the precondition
+        failed, None is returned."""
+
+        return self._put(url, json.dumps(obj), read, headers)
+
+    def _put(self, url, body, read=False, headers={}):
+        """Performs an HTTP PUT of the given body to the given URL.
+
+        The body may be an iterable, in which case it is sent using
+        chunked transfer encoding.  See _write_json for the handling
+        of the response."""
 
         conn = None
 
         try:
             try:
                 conn = self._get_conn()
-                conn.request('PUT', url, json.dumps(obj))
+                conn.request('PUT', url, body, headers)
 
                 res = conn.getresponse()
 
+                if res.status == 412 and 'If-None-Match' in headers:
+                    return None
+
                 if res.status != 200:
                     raise CrabError('server error: ' + self._read_error(res))
 
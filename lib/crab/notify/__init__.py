@@ -14,8 +14,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 
+from crab import CrabError
 from crab.report import CrabReportGenerator, CrabReportJob
 from crab.notify.email import CrabNotifyEmail
 
@@ -35,10 +37,19 @@ class CrabNotify:
             config['crab']['base_url'],
             config['email'])
 
+        # Prepare a pool of threads with which to render messages.
+        self.pool = ThreadPoolExecutor(
+            max_workers=config['notify'].get('threads', 4))
+
+        # Should messages be placed in the store's notification queue
+        # rather than being sent directly?
+        self.queue = config['notify'].get('queue', False)
+
     def __call__(self, notifications):
         "Sends notification messages."""
 
         report = CrabReportGenerator(self.store)
+        messages = []
 
         for (jobs, keys) in self._group_notifications(notifications):
             output = report(jobs)
@@ -57,7 +68,50 @@ class CrabNotify:
                             'Unknown notification method: {}'.format(method))
 
                 if email:
-                    self.send_email(output, email)
+                    messages.append((email, self.pool.submit(
+                        self.send_email.make_message, output, email)))
+
+        if not messages:
+            return
+
+        if self.queue:
+            for (email, message) in messages:
+                try:
+                    self.store.queue_notification(
+                        'email', email, message.result())
+
+                except Exception:
+                    logger.exception(
+                        'Error queueing notification to: {}'.format(
+                            ', '.join(email)))
+
+            return
+
+        # Send the messages, in order, as they are rendered, using a single
+        # email session.
+        session = self.send_email.session()
+
+        try:
+            for (email, message) in messages:
+                try:
+                    session.send(email, message.result())
+
+                except Exception:
+                    logger.exception(
+                        'Error sending notification to: {}'.format(
+                            ', '.join(email)))
+
+        finally:
+            session.close()
+
+    def session(self, method):
+        """Creates a session object for sending messages by the
+        given method."""
+
+        if method == 'email':
+            return self.send_email.session()
+
+        raise CrabError('Unknown notification method: {}'.format(method))
 
     def _group_notifications(self, notifications):
         """Constructs a list of notifications to be sent.
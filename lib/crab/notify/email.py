@@ -19,11 +19,18 @@ from __future__ import absolute_import
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate
-from smtplib import SMTP
+from smtplib import SMTP, SMTPException, SMTPServerDisconnected
+import socket
 
 from crab.report.text import report_to_text
 from crab.report.html import report_to_html
 from crab.report.summary import report_to_summary
+from crab.util.metrics import counter, histogram
+
+send_time = histogram(
+    'crab_notify_send_seconds', 'Time taken to send notification messages')
+send_errors = counter(
+    'crab_notify_send_errors_total', 'Number of messages which failed to send')
 
 
 class CrabNotifyEmail:
@@ -46,6 +53,19 @@ class CrabNotifyEmail:
     def __call__(self, report, to):
         """Sends a report by email to the given addresses."""
 
+        session = self.session()
+
+        try:
+            session.send(to, self.make_message(report, to))
+
+        finally:
+            session.close()
+
+    def make_message(self, report, to):
+        """Prepares an email message for the given report.
+
+        Returns the message as a string."""
+
         if report.error:
             subject = self.subject_error
         elif report.warning:
@@ -69,6 +89,67 @@ class CrabNotifyEmail:
             report_to_html(report, self.home, self.base_url),
             'html'))
 
-        smtp = SMTP(self.server)
-        smtp.sendmail(self.from_, to, message.as_string())
-        smtp.quit()
+        return message.as_string()
+
+    def session(self):
+        """Creates a session object which can be used to send a number
+        of messages through a single SMTP connection."""
+
+        return CrabNotifyEmailSession(self.server, self.from_)
+
+
+class CrabNotifyEmailSession:
+    """Class representing an SMTP session.
+
+    The connection is opened when the first message is sent and is
+    then re-used for subsequent messages until the close method
+    is called."""
+
+    def __init__(self, server, from_):
+        self.server = server
+        self.from_ = from_
+        self.smtp = None
+
+    @send_time.timed
+    def send(self, to, message):
+        """Sends a message (given as a string) to the given addresses.
+
+        If the server has closed an existing connection, a new
+        connection is opened and the message is sent again.  Any failure
+        to send the message is counted by the send_errors metric."""
+
+        try:
+            self._send(to, message)
+
+        except Exception:
+            send_errors.inc()
+            raise
+
+    def _send(self, to, message):
+        """Sends a message, opening a new connection if necessary."""
+
+        if self.smtp is not None:
+            try:
+                self.smtp.sendmail(self.from_, to, message)
+                return
+
+            except SMTPServerDisconnected:
+                self.smtp = None
+
+        self.smtp = SMTP(self.server)
+        self.smtp.sendmail(self.from_, to, message)
+
+    def close(self):
+        """Closes the SMTP connection, if it is open."""
+
+        if self.smtp is None:
+            return
+
+        try:
+            self.smtp.quit()
+
+        except (SMTPException, socket.error):
+            pass
+
+        finally:
+            self.smtp = None
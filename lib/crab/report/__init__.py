@@ -60,6 +60,7 @@ class CrabReportGenerator:
         or None if there are no entries to show."""
 
         checked = set()
+        report_jobs = []
         error = set()
         warning = set()
         ok = set()
@@ -75,12 +76,9 @@ class CrabReportGenerator:
             else:
                 checked.add(job)
 
-            (id_, start, end, skip_ok, skip_warning, skip_error,
-                include_output) = job
+            id_ = job.id_
 
-            if id_ in self.cache_info:
-                info = self.cache_info[id_]
-            else:
+            if id_ not in self.cache_info:
                 info = self.store.get_job_info(id_)
                 if info is None:
                     continue
@@ -92,22 +90,21 @@ class CrabReportGenerator:
 
                 self.cache_info[id_] = info
 
-            if job in self.cache_event:
-                events = self.cache_event[job]
-                num_errors = self.cache_error[job]
-                num_warnings = self.cache_warning[job]
+            report_jobs.append(job)
 
-            else:
-                self.filter_.set_timezone(info['timezone'])
+        self._fetch_events([job for job in report_jobs
+                            if job not in self.cache_event])
+
+        output_finishes = []
 
-                events = self.cache_event[job] = self.filter_(
-                    self.store.get_job_events(
-                        id_, limit=None, start=start, end=end),
-                    skip_ok=skip_ok, skip_warning=skip_warning,
-                    skip_error=skip_error, skip_start=True)
+        for job in report_jobs:
+            (id_, start, end, skip_ok, skip_warning, skip_error,
+                include_output) = job
 
-                num_errors = self.cache_error[job] = self.filter_.errors
-                num_warnings = self.cache_warning[job] = self.filter_.warnings
+            info = self.cache_info[id_]
+            events = self.cache_event[job]
+            num_errors = self.cache_error[job]
+            num_warnings = self.cache_warning[job]
 
             if events:
                 num += 1
@@ -126,20 +123,23 @@ class CrabReportGenerator:
                     for event in events:
                         if event['type'] == CrabEvent.FINISH:
                             finishid = event['eventid']
-                            if finishid in self.cache_stdout:
-                                report_stdout[finishid] = \
-                                    self.cache_stdout[finishid]
-                                report_stderr[finishid] = \
-                                    self.cache_stderr[finishid]
-                            else:
-                                (stdout, stderr) = self.store.get_job_output(
+                            if finishid not in self.cache_stdout:
+                                output_finishes.append((
                                     finishid, info['host'], info['user'],
-                                    id_, info['crabid'])
+                                    id_, info['crabid']))
+
+                            report_stdout[finishid] = None
+                            report_stderr[finishid] = None
 
-                                report_stdout[finishid] = \
-                                    self.cache_stdout[finishid] = stdout
-                                report_stderr[finishid] = \
-                                    self.cache_stderr[finishid] = stderr
+        if output_finishes:
+            for (finishid, (stdout, stderr)) in \
+                    self.store.get_job_outputs(output_finishes).items():
+                self.cache_stdout[finishid] = stdout
+                self.cache_stderr[finishid] = stderr
+
+        for finishid in report_stdout:
+            report_stdout[finishid] = self.cache_stdout[finishid]
+            report_stderr[finishid] = self.cache_stderr[finishid]
 
         if num:
             return CrabReport(
@@ -148,3 +148,34 @@ class CrabReportGenerator:
                 report_stdout, report_stderr)
         else:
             return None
+
+    def _fetch_events(self, jobs):
+        """Fetches and filters the events for the given jobs.
+
+        The events are retrieved from the store in bulk for each
+        distinct reporting period, and the filtered results are stored
+        in the event cache."""
+
+        periods = {}
+
+        for job in jobs:
+            key = (job.start, job.end)
+            if key in periods:
+                periods[key].append(job)
+            else:
+                periods[key] = [job]
+
+        for ((start, end), period_jobs) in periods.items():
+            events = self.store.get_jobs_events(
+                [job.id_ for job in period_jobs], start=start, end=end)
+
+            for job in period_jobs:
+                self.filter_.set_timezone(self.cache_info[job.id_]['timezone'])
+
+                self.cache_event[job] = self.filter_(
+                    events.get(job.id_, []),
+                    skip_ok=job.skip_ok, skip_warning=job.skip_warning,
+                    skip_error=job.skip_error, skip_start=True)
+
+                self.cache_error[job] = self.filter_.errors
+                self.cache_warning[job] = self.filter_.warnings
@@ -13,9 +13,27 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from threading import Lock
+
 from mako.template import Template
 
+_template_cache = {}
+_template_cache_lock = Lock()
+
 
 def report_to_html(report, home, base_url):
-    template = Template(filename=home + '/templ/report/basic.html')
+    template = _get_template(home + '/templ/report/basic.html')
     return template.render(report=report, base_url=base_url)
+
+
+def _get_template(filename):
+    """Returns the template from the given file, which is compiled
+    only on the first request."""
+
+    with _template_cache_lock:
+        template = _template_cache.get(filename)
+
+        if template is None:
+            template = _template_cache[filename] = Template(filename=filename)
+
+    return template
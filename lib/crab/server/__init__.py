@@ -23,6 +23,8 @@ from cherrypy import HTTPError
 
 from crab import CrabError, CrabStatus
 from crab.util.bus import CrabStoreListener
+from crab.util.crontab import crontab_hash
+from crab.util.string import true_string
 
 
 class CrabServer(CrabStoreListener):
@@ -39,7 +41,13 @@ class CrabServer(CrabStoreListener):
 
         Allows the client to PUT a new crontab, or use a GET
         request to see a crontab-style representation of the
-        job information held in the the storage backend."""
+        job information held in the the storage backend.
+
+        The response to a PUT request includes an ETag header giving
+        the hash of the crontab.  If the client sends this in an
+        If-None-Match header, and the crontab has not changed, the
+        request fails with status 412 (Precondition Failed) without
+        the crontab being processed."""
 
         if cherrypy.request.method == 'GET':
             try:
@@ -54,14 +62,28 @@ class CrabServer(CrabStoreListener):
 
         elif cherrypy.request.method == 'PUT':
             try:
+                match = cherrypy.request.headers.get('If-None-Match')
+
+                if match is not None:
+                    hash_ = self.store.get_raw_crontab_hash(host, user)
+
+                    if hash_ is not None and _etag(hash_) in (
+                            x.strip() for x in match.split(',')):
+                        raise HTTPError(412, 'crontab unchanged')
+
                 data = self._read_json()
                 crontab = data.get('crontab')
 
                 if crontab is None:
                     raise CrabError('no crontab received')
 
+                timezone = data.get('timezone')
+
                 warning = self.store.save_crontab(
-                    host, user, crontab, timezone=data.get('timezone'))
+                    host, user, crontab, timezone=timezone)
+
+                cherrypy.response.headers['ETag'] = _etag(
+                    crontab_hash(crontab, timezone))
 
                 return json.dumps({'warning': warning})
 
@@ -69,6 +91,37 @@ class CrabServer(CrabStoreListener):
                 cherrypy.log.error('CrabError: write error: ' + str(err))
                 raise HTTPError(message='write error: ' + str(err))
 
+    @cherrypy.expose
+    def crontabs(self, force=False):
+        """CherryPy handler for the bulk crontabs action.
+
+        Allows the client to PUT a number of crontabs in one request.
+        The body should contain one JSON object per line, each giving
+        "host", "user", "crontab" and optionally "timezone".  The lines
+        are read as they arrive and the crontabs saved in batches.
+
+        Unless "force" is specified (with a true value such as "true"
+        or "1"), crontabs which have not changed since they were last
+        imported are skipped.
+
+        Returns a list of results, one per line, including the warnings
+        for each crontab or an error message for lines which could
+        not be read or saved."""
+
+        if cherrypy.request.method != 'PUT':
+            raise HTTPError(405)
+
+        try:
+            results = save_crontab_lines(
+                self.store, cherrypy.request.body,
+                force=(bool(force) and true_string(force)))
+
+        except CrabError as err:
+            cherrypy.log.error('CrabError: write error: ' + str(err))
+            raise HTTPError(message='write error: ' + str(err))
+
+        return json.dumps({'results': results})
+
     @cherrypy.expose
     def start(self, host, user, crabid=None):
         """CherryPy handler allowing clients to report jobs starting."""
@@ -127,3 +180,80 @@ class CrabServer(CrabStoreListener):
         except ValueError:
             cherrypy.log.error('CrabError: Failed to read JSON: ' + message)
             raise HTTPError(400, message='Did not understand JSON')
+
+
+def _etag(hash_):
+    """Formats a hash value as an HTTP entity tag."""
+
+    return '"' + hash_ + '"'
+
+
+def save_crontab_lines(store, lines, force=False):
+    """Saves crontabs given as lines of JSON via the store's
+    save_crontabs method.
+
+    The lines should be given as an iterable of bytes, which are
+    decoded as they are read.  Returns a list of results, one per line,
+    including the warnings for each crontab or an error message for
+    lines which could not be read or saved."""
+
+    errors = []
+
+    def entries():
+        for (n, line) in enumerate(lines, 1):
+            line = latin_1_decode(line, 'replace')[0].strip()
+
+            if not line:
+                continue
+
+            try:
+                data = json.loads(line)
+            except ValueError:
+                errors.append({'line': n, 'error': 'invalid JSON'})
+                continue
+
+            if not isinstance(data, dict):
+                errors.append({'line': n, 'error': 'not an object'})
+                continue
+
+            entry = {
+                'line': n,
+                'host': data.get('host'),
+                'user': data.get('user'),
+                'crontab': data.get('crontab'),
+                'timezone': data.get('timezone'),
+            }
+
+            if not (entry['host'] and entry['user']):
+                errors.append({'line': n, 'error': 'no host or user'})
+            elif entry['crontab'] is None:
+                errors.append({'line': n, 'error': 'no crontab received'})
+            else:
+                yield entry
+
+    results = []
+
+    for (entry, warning, error) in store.save_crontabs(
+            entries(), force=force):
+        result = {
+            'line': entry['line'],
+            'host': entry['host'],
+            'user': entry['user'],
+        }
+
+        if error is not None:
+            result['error'] = error
+            if warning is not None:
+                result['warning'] = warning
+        elif warning is None:
+            result['unchanged'] = True
+            result['warning'] = []
+        else:
+            result['warning'] = warning
+
+        results.append(result)
+
+    results.extend(errors)
+    results.sort(key=lambda x: x['line'])
+
+    return results
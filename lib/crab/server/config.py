@@ -23,6 +23,7 @@ from cherrypy.lib.reprconf import Config
 
 from crab.store.file import CrabStoreFile
 from crab.store.sqlite import CrabStoreSQLite
+from crab.util.statuspattern import CrabPatternChecker
 
 
 def read_crabd_config():
@@ -116,11 +117,16 @@ def construct_log_handler(filename, log_config):
         backupCount=log_config['backup_count'])
 
 
-def construct_store(storeconfig, outputstore=None):
-    """Constructs a storage backend from the given dictionary."""
+def construct_store(storeconfig, outputstore=None, pattern_checker=None):
+    """Constructs a storage backend from the given dictionary.
+
+    The pattern checker, if given, is passed to database stores."""
 
     if storeconfig['type'] == 'sqlite':
-        store = CrabStoreSQLite(storeconfig['file'], outputstore)
+        store = CrabStoreSQLite(
+            storeconfig['file'], outputstore,
+            event_log=storeconfig.get('event_log', False),
+            pattern_checker=pattern_checker)
 
     elif storeconfig['type'] == 'mysql':
         # Only import the MySQL store module when required in case the
@@ -131,7 +137,10 @@ def construct_store(storeconfig, outputstore=None):
             database=storeconfig['database'],
             user=storeconfig['user'],
             password=storeconfig['password'],
-            outputstore=outputstore)
+            outputstore=outputstore,
+            event_log=storeconfig.get('event_log', False),
+            partitioned=storeconfig.get('partitioned', False),
+            pattern_checker=pattern_checker)
 
     elif storeconfig['type'] == 'file':
         store = CrabStoreFile(storeconfig['dir'])
@@ -140,3 +149,13 @@ def construct_store(storeconfig, outputstore=None):
         raise Exception('Unknown output store type: ' + storeconfig['type'])
 
     return store
+
+
+def construct_pattern_checker(patternconfig):
+    """Constructs a status pattern checker from the given dictionary."""
+
+    return CrabPatternChecker(
+        head=patternconfig.get('output_head'),
+        tail=patternconfig.get('output_tail'),
+        timeout=patternconfig.get('timeout'),
+        processes=patternconfig.get('processes', 1))
@@ -0,0 +1,791 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from codecs import latin_1_decode
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from html import escape
+from http.client import responses
+import json
+from logging import getLogger
+import multiprocessing
+import os
+from select import select
+import signal
+import socket
+from threading import Event, Thread
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from crab import CrabError, CrabStatus
+from crab.server import _etag, save_crontab_lines
+from crab.util.crontab import crontab_hash
+from crab.util.bus import priority
+from crab.util.metrics import gauge, histogram
+from crab.util.string import true_string
+
+logger = getLogger(__name__)
+
+request_time = histogram(
+    'crab_ingest_request_seconds', 'Time taken to handle ingest requests')
+pending = gauge(
+    'crab_ingest_pending', 'Number of ingest requests waiting for the store')
+
+API_PREFIX = '/api/0/'
+
+# Maximum number of header lines in a request.
+MAX_HEADERS = 100
+
+# Size of the blocks in which request bodies are read.
+BODY_BLOCK_SIZE = 65536
+
+# Interval (seconds) at which the worker supervisor checks its workers.
+SUPERVISE_INTERVAL = 1
+
+
+class CrabIngestError(Exception):
+    """Exception class for ingest listener errors, giving the HTTP
+    status to be returned to the client."""
+
+    def __init__(self, status, message=None):
+        super(CrabIngestError, self).__init__(
+            message if message is not None else responses.get(status, ''))
+        self.status = status
+
+
+class CrabIngestBody():
+    """Class reading the body of a request in blocks as it is received.
+
+    This allows handlers to process a large body without it all being
+    held in memory.  The "finished" attribute is set once the whole body
+    has been read, and "failed" if it could not be read."""
+
+    def __init__(self, reader, headers, max_size):
+        self.reader = reader
+        self.max_size = max_size
+        self.chunked = 'chunked' in headers.get(
+            'transfer-encoding', '').lower()
+        self.size = 0
+        self.remaining = 0
+        self.finished = False
+        self.failed = False
+
+        if not self.chunked:
+            try:
+                length = int(headers.get('content-length', 0))
+            except ValueError:
+                raise CrabIngestError(400, 'Invalid Content-Length')
+
+            if length > max_size:
+                raise CrabIngestError(413)
+
+            self.remaining = max(length, 0)
+            self.finished = self.remaining == 0
+
+    async def read(self):
+        """Returns the next block of the body, or an empty bytes object
+        at the end of the body."""
+
+        if self.finished:
+            return b''
+
+        try:
+            if self.remaining == 0:
+                await self._read_chunk_size()
+
+                if self.finished:
+                    return b''
+
+            block = await self.reader.read(
+                min(BODY_BLOCK_SIZE, self.remaining))
+
+            if not block:
+                raise asyncio.IncompleteReadError(b'', self.remaining)
+
+            self.remaining -= len(block)
+
+            if self.remaining == 0:
+                if self.chunked:
+                    await self.reader.readline()
+                else:
+                    self.finished = True
+
+        except BaseException:
+            self.failed = True
+            raise
+
+        return block
+
+    async def read_all(self):
+        """Reads the rest of the body, returning it as a bytes object."""
+
+        blocks = []
+
+        while True:
+            block = await self.read()
+
+            if not block:
+                return b''.join(blocks)
+
+            blocks.append(block)
+
+    async def discard(self):
+        """Reads and discards the rest of the body."""
+
+        while await self.read():
+            pass
+
+    async def _read_chunk_size(self):
+        try:
+            chunk_size = int((await self.reader.readline()).split(b';')[0], 16)
+        except ValueError:
+            raise CrabIngestError(400, 'Malformed chunk size')
+
+        if chunk_size < 0:
+            raise CrabIngestError(400, 'Malformed chunk size')
+
+        if chunk_size == 0:
+            # Discard any trailer headers.
+            while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            self.finished = True
+            return
+
+        self.size += chunk_size
+        if self.size > self.max_size:
+            raise CrabIngestError(413)
+
+        self.remaining = chunk_size
+
+
+class CrabIngestRequest():
+    """Class representing an HTTP request received by the listener.
+
+    The body is available as a CrabIngestBody "stream".  Unless the
+    handler reads the stream itself, it is read into "body" before
+    the handler is called."""
+
+    __slots__ = (
+        'method', 'path', 'query', 'version', 'headers', 'stream', 'body')
+
+    def __init__(self, method, path, query, version, headers, stream=None):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.version = version
+        self.headers = headers
+        self.stream = stream
+        self.body = b''
+
+    @property
+    def keep_alive(self):
+        # The connection can not be re-used if the body could not be read.
+        if self.stream is not None and self.stream.failed:
+            return False
+
+        connection = self.headers.get('connection', '').lower()
+
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+
+        return connection != 'close'
+
+    def read_json(self):
+        message = latin_1_decode(self.body, 'replace')[0]
+
+        try:
+            return json.loads(message)
+        except ValueError:
+            logger.error('CrabError: Failed to read JSON: ' + message)
+            raise CrabIngestError(400, 'Did not understand JSON')
+
+
+class CrabIngestService(Thread):
+    """Standalone listener for the client API.
+
+    This implements the start, finish, crontab and crontabs actions
+    of CrabServer using an asyncio event loop, so that a large number
+    of concurrent connections can be handled by a single thread.
+    The store methods are called via a pool of "threads".  At most
+    "queue" further requests are passed to the pool while all of the
+    threads are busy: others wait in the event loop until there is room,
+    so that the pool's queue does not grow without limit.
+
+    A listening socket may be given, for example if it is shared by
+    a number of worker processes.  If a "notify" function is given,
+    it is called whenever a start or finish event has been recorded."""
+
+    def __init__(self, store, config, sock=None, notify=None):
+        Thread.__init__(self)
+
+        self.store = store
+        self.sock = sock
+        self.notify = notify
+        self.host = config.get('host', '0.0.0.0')
+        self.port = config.get('port', 8001)
+        self.threads = config.get('threads', 4)
+        self.queue = config.get('queue', 100)
+        self.timeout = config.get('timeout', 30)
+        self.max_body = config.get('max_body_size', 10) * 1024 * 1024
+
+        self.address = None
+        self.ready = Event()
+
+        self._loop = None
+        self._stopping = None
+        self._slots = None
+
+    def run(self):
+        """Thread run function.
+
+        Runs the event loop until the stop method is called."""
+
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=self.threads, thread_name_prefix='crab-ingest'))
+
+        try:
+            self._loop.run_until_complete(self._serve())
+
+        finally:
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+
+    def stop(self):
+        """Requests that the listener stop, from another thread."""
+
+        if self._loop is not None and self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def _serve(self):
+        self._stopping = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.threads + self.queue)
+
+        if self.sock is not None:
+            server = await asyncio.start_server(
+                self._handle_connection, sock=self.sock)
+        else:
+            server = await asyncio.start_server(
+                self._handle_connection, self.host, self.port)
+
+        self.address = server.sockets[0].getsockname()[:2]
+        logger.info('Ingest listener on {}:{}'.format(*self.address))
+        self.ready.set()
+
+        async with server:
+            await self._stopping.wait()
+
+    async def _handle_connection(self, reader, writer):
+        """Handles requests from a client connection.
+
+        Requests are handled in turn until the connection is closed,
+        or a request asks for it to be closed."""
+
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        self._read_request(reader), self.timeout)
+
+                except CrabIngestError as err:
+                    await self._write_error(writer, err)
+                    break
+
+                if request is None:
+                    break
+
+                try:
+                    with request_time.time():
+                        (body, headers) = await self._dispatch(request)
+
+                except CrabIngestError as err:
+                    await self._write_error(writer, err, request.keep_alive)
+
+                else:
+                    await self._write_response(
+                        writer, 200, body, headers, request.keep_alive)
+
+                if not request.keep_alive:
+                    break
+
+                # Discard any part of the body which was not read,
+                # for example if the request was rejected.
+                await asyncio.wait_for(
+                    request.stream.discard(), self.timeout)
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                ConnectionError, CrabIngestError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        """Reads an HTTP request, returning None if the connection was
+        closed before a request was received."""
+
+        try:
+            line = await reader.readline()
+
+            if not line:
+                return None
+
+            try:
+                (method, target, version) = latin_1_decode(
+                    line, 'replace')[0].split()
+            except ValueError:
+                raise CrabIngestError(400, 'Malformed request line')
+
+            if not version.startswith('HTTP/1.'):
+                raise CrabIngestError(505)
+
+            headers = {}
+
+            while True:
+                line = await reader.readline()
+
+                if line in (b'\r\n', b'\n', b''):
+                    break
+
+                if len(headers) >= MAX_HEADERS:
+                    raise CrabIngestError(431)
+
+                (name, sep, value) = latin_1_decode(
+                    line, 'replace')[0].partition(':')
+
+                if not sep:
+                    raise CrabIngestError(400, 'Malformed header')
+
+                headers[name.strip().lower()] = value.strip()
+
+        except (ValueError, asyncio.LimitOverrunError):
+            raise CrabIngestError(400, 'Request line or header too long')
+
+        target = urlsplit(target)
+
+        return CrabIngestRequest(
+            method, target.path, parse_qs(target.query), version, headers,
+            CrabIngestBody(reader, headers, self.max_body))
+
+    async def _dispatch(self, request):
+        """Determines which action the request is for and calls the
+        corresponding handler in the executor.
+
+        Returns the body and a dictionary of additional headers."""
+
+        if not request.path.startswith(API_PREFIX):
+            raise CrabIngestError(404)
+
+        args = [unquote(x) for x in request.path[len(API_PREFIX):].split('/')]
+        action = args.pop(0)
+
+        handler = self._handlers.get(action)
+
+        if handler is None:
+            raise CrabIngestError(404)
+
+        (methods, min_args, max_args, stream, func) = handler
+
+        if request.method not in methods:
+            raise CrabIngestError(405)
+
+        if not (min_args <= len(args) <= max_args):
+            raise CrabIngestError(404)
+
+        if not stream:
+            request.body = await asyncio.wait_for(
+                request.stream.read_all(), self.timeout)
+
+        pending.inc()
+
+        try:
+            async with self._slots:
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, partial(func, self, request, *args))
+
+        finally:
+            pending.dec()
+
+    async def _write_response(
+            self, writer, status, body, headers={}, keep_alive=True):
+        if isinstance(body, str):
+            body = body.encode('latin_1', 'replace')
+
+        lines = [
+            'HTTP/1.1 {} {}'.format(status, responses.get(status, '')),
+            'Content-Length: {}'.format(len(body)),
+            'Connection: {}'.format('keep-alive' if keep_alive else 'close'),
+        ]
+
+        for (name, value) in headers.items():
+            lines.append('{}: {}'.format(name, value))
+
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin_1'))
+        writer.write(body)
+        await writer.drain()
+
+    async def _write_error(self, writer, err, keep_alive=False):
+        """Writes an error response.
+
+        The message is given in a paragraph of an HTML document,
+        as for CherryPy, so that clients can find it."""
+
+        body = '<html><body><h2>{}</h2><p>{}</p></body></html>'.format(
+            escape(responses.get(err.status, '')), escape(str(err)))
+
+        await self._write_response(
+            writer, err.status, body, {'Content-Type': 'text/html'},
+            keep_alive)
+
+    def _start(self, request, host, user, crabid=None):
+        data = request.read_json()
+        command = data.get('command')
+
+        try:
+            if command is None:
+                raise CrabError('cron command not specified')
+
+            data = self.store.log_start(host, user, crabid, command)
+
+        except CrabError as err:
+            logger.error('CrabError: log error: ' + str(err))
+            raise CrabIngestError(500, 'log error: ' + str(err))
+
+        if self.notify is not None:
+            self.notify()
+
+        return (json.dumps({'inhibit': data['inhibit']}), {})
+
+    def _finish(self, request, host, user, crabid=None):
+        data = request.read_json()
+        command = data.get('command')
+        status = data.get('status')
+
+        try:
+            if command is None or status is None:
+                raise CrabError('insufficient information to log finish')
+
+            if status not in CrabStatus.VALUES:
+                raise CrabError('invalid finish status')
+
+            self.store.log_finish(
+                host, user, crabid, command, status,
+                data.get('stdout'), data.get('stderr'))
+
+        except CrabError as err:
+            logger.error('CrabError: log error: ' + str(err))
+            raise CrabIngestError(500, 'log error: ' + str(err))
+
+        if self.notify is not None:
+            self.notify()
+
+        return ('', {})
+
+    def _crontab(self, request, host, user):
+        if request.method == 'GET':
+            try:
+                if request.query.get('raw', [''])[0]:
+                    crontab = self.store.get_raw_crontab(host, user)
+                else:
+                    crontab = self.store.get_crontab(host, user)
+
+            except CrabError as err:
+                logger.error('CrabError: read error: ' + str(err))
+                raise CrabIngestError(500, 'read error: ' + str(err))
+
+            return (json.dumps({'crontab': crontab}), {})
+
+        try:
+            match = request.headers.get('if-none-match')
+
+            if match is not None:
+                hash_ = self.store.get_raw_crontab_hash(host, user)
+
+                if hash_ is not None and _etag(hash_) in (
+                        x.strip() for x in match.split(',')):
+                    raise CrabIngestError(412, 'crontab unchanged')
+
+            data = request.read_json()
+            crontab = data.get('crontab')
+
+            if crontab is None:
+                raise CrabError('no crontab received')
+
+            timezone = data.get('timezone')
+
+            warning = self.store.save_crontab(
+                host, user, crontab, timezone=timezone)
+
+        except CrabError as err:
+            logger.error('CrabError: write error: ' + str(err))
+            raise CrabIngestError(500, 'write error: ' + str(err))
+
+        return (json.dumps({'warning': warning}), {
+            'ETag': _etag(crontab_hash(crontab, timezone))})
+
+    def _crontabs(self, request):
+        force = request.query.get('force', [''])[0]
+
+        try:
+            results = save_crontab_lines(
+                self.store, self._read_lines(request),
+                force=(bool(force) and true_string(force)))
+
+        except CrabError as err:
+            logger.error('CrabError: write error: ' + str(err))
+            raise CrabIngestError(500, 'write error: ' + str(err))
+
+        return (json.dumps({'results': results}), {})
+
+    def _read_lines(self, request):
+        """Generator yielding the lines of the request body.
+
+        This is for handlers which read the request's stream themselves.
+        They run in the executor, so each block of the body is read
+        by the event loop as it is required."""
+
+        rest = b''
+
+        while True:
+            block = asyncio.run_coroutine_threadsafe(
+                asyncio.wait_for(request.stream.read(), self.timeout),
+                self._loop).result()
+
+            if not block:
+                break
+
+            lines = (rest + block).split(b'\n')
+            rest = lines.pop()
+
+            for line in lines:
+                yield line
+
+        if rest:
+            yield rest
+
+    # Handlers for each action: allowed methods, minimum and maximum
+    # number of path arguments, whether the handler reads the request
+    # body stream itself, and handler method.
+    _handlers = {
+        'start': (('PUT',), 2, 3, False, _start),
+        'finish': (('PUT',), 2, 3, False, _finish),
+        'crontab': (('GET', 'PUT'), 2, 2, False, _crontab),
+        'crontabs': (('PUT',), 0, 0, True, _crontabs),
+    }
+
+
+class CrabIngestWorkers():
+    """CherryPy plugin which runs the ingest listener in a number of
+    worker processes.
+
+    The workers share a listening socket, and each constructs its own
+    store using the "get_store" function.  They are started by a
+    supervisor process, which is forked when the bus starts, before
+    the store and services (and their threads) are constructed in this
+    process.  As the supervisor is single-threaded, it can safely fork
+    replacements for any workers which exit unexpectedly.  The process
+    IDs of the current workers are available in the "pids" array.
+
+    This process acts as the coordinator: workers write to a pipe when
+    they record an event, and a thread reading the pipe wakes any
+    services (such as the monitor) which have a "wake" method."""
+
+    def __init__(self, bus, get_store, config):
+        self.bus = bus
+        self.get_store = get_store
+        self.config = config
+        self.processes = config.get('processes', 1)
+
+        self.services = []
+        self.supervisor = None
+        self.pids = None
+        self.sock = None
+        self.pipe = None
+        self.stopping = False
+
+    def subscribe(self):
+        self.bus.subscribe('start', self.start)
+        self.bus.subscribe('stop', self.stop)
+        self.bus.subscribe('crab-service', self.service)
+
+    @priority(68)
+    def start(self):
+        self.bus.log('Starting {} Crab ingest workers'.format(self.processes))
+
+        self.sock = socket.create_server(
+            (self.config.get('host', '0.0.0.0'),
+             self.config.get('port', 8001)),
+            backlog=self.config.get('backlog', 1024))
+
+        self.pipe = os.pipe()
+        os.set_blocking(self.pipe[1], False)
+
+        # The worker supervisor process must be forked so that it inherits
+        # the listening socket and notification pipe.
+        fork_context = multiprocessing.get_context('fork')
+
+        self.pids = fork_context.Array('i', self.processes)
+
+        self.supervisor = fork_context.Process(
+            target=_supervise_workers, name='crab-ingest-supervisor',
+            args=(self.get_store, self.config, self.sock, self.pipe,
+                  self.pids))
+        self.supervisor.daemon = True
+        self.supervisor.start()
+
+        thread = Thread(target=self._coordinate)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.stopping = True
+
+        if self.supervisor is not None:
+            self.supervisor.terminate()
+            self.supervisor.join(10)
+
+    def service(self, name, service):
+        if hasattr(service, 'wake'):
+            self.services.append(service)
+
+    def _coordinate(self):
+        """Reads notifications from the workers, and checks that the
+        supervisor is still running.
+
+        The supervisor is not restarted if it exits, as this process
+        may not be forked safely once other threads have started."""
+
+        while not self.stopping:
+            (readable, _, _) = select([self.pipe[0]], [], [], 5)
+
+            if readable:
+                # Read all waiting notifications: the services only
+                # need to be woken once.
+                os.read(self.pipe[0], 4096)
+
+                for service in self.services:
+                    service.wake()
+
+            if not (self.stopping or self.supervisor.is_alive()):
+                logger.error(
+                    'Ingest worker supervisor exited with code {}'.format(
+                        self.supervisor.exitcode))
+                break
+
+
+def _supervise_workers(get_store, config, sock, pipe, pids):
+    """Starts the ingest worker processes and replaces any which exit.
+
+    The workers are stopped when this process is terminated, or if
+    the coordinating process exits."""
+
+    parent = os.getppid()
+    workers = {}
+
+    def start_worker(i):
+        pid = os.fork()
+
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            status = 1
+            try:
+                _run_worker(get_store, config, sock, pipe)
+                status = 0
+            except Exception:
+                logger.exception('Ingest worker failed')
+            finally:
+                os._exit(status)
+
+        workers[pid] = i
+        pids[i] = pid
+
+    def stop_workers(signum=None, frame=None):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop_workers)
+
+    for i in range(len(pids)):
+        start_worker(i)
+
+    while os.getppid() == parent:
+        (pid, status) = os.waitpid(-1, os.WNOHANG)
+
+        if pid == 0:
+            time.sleep(SUPERVISE_INTERVAL)
+            continue
+
+        i = workers.pop(pid)
+
+        logger.warning(
+            'Ingest worker {} exited with status {}: restarting'.format(
+                pid, status))
+
+        start_worker(i)
+
+    stop_workers()
+
+
+def _run_worker(get_store, config, sock, pipe):
+    """Runs the ingest listener in a worker process.
+
+    The listener is stopped if the supervising process exits, in case
+    it was not able to stop the workers itself."""
+
+    os.close(pipe[0])
+    write_fd = pipe[1]
+    parent = os.getppid()
+
+    def notify():
+        try:
+            os.write(write_fd, b'.')
+        except BlockingIOError:
+            # The pipe is full, so the coordinator already has
+            # notifications to read.
+            pass
+
+    service = CrabIngestService(
+        store=get_store(), config=config, sock=sock, notify=notify)
+
+    def watch_parent():
+        service.ready.wait()
+
+        while os.getppid() == parent:
+            time.sleep(5)
+
+        logger.warning('Ingest worker {} stopping: coordinator exited'.format(
+            os.getpid()))
+        service.stop()
+
+    thread = Thread(target=watch_parent)
+    thread.daemon = True
+    thread.start()
+
+    service.run()
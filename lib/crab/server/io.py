@@ -111,7 +111,7 @@ def export_config(store, file_):
     # Create list of jobs.
     jobs = []
     hostuser = set()
-    for job in store.get_jobs():
+    for job in store.iter_jobs():
         hostuser.add((job['host'], job['user']))
 
         config = store.get_job_config(job['id'])
@@ -0,0 +1,33 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import cherrypy
+
+from crab.util.metrics import format_metrics
+
+
+class CrabMetricsServer():
+    """Class presenting the server's metrics in the Prometheus text
+    exposition format.
+
+    Only metrics recorded in this process are shown: those of any
+    ingest worker processes are not included."""
+
+    @cherrypy.expose
+    def index(self):
+        cherrypy.response.headers['Content-Type'] = \
+            'text/plain; version=0.0.4; charset=utf-8'
+
+        return format_metrics()
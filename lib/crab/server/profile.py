@@ -0,0 +1,109 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import cProfile
+from datetime import datetime
+import hmac
+import os
+import re
+
+import cherrypy
+import pytz
+
+from crab.util.profile import start_profile, stop_profile
+
+PROFILE_HEADER = 'X-Crab-Profile'
+
+
+class CrabProfileTool(cherrypy.Tool):
+    """CherryPy tool to profile requests.
+
+    Requests are profiled if the "always" parameter is set, or if they
+    include an X-Crab-Profile header matching the "token" parameter.
+    A summary, including the number of queries and the time spent
+    holding the store lock and rendering templates, is returned in the
+    X-Crab-Profile response header and logged.  If a "dir" parameter
+    is given, a cProfile file is written there for each request."""
+
+    def __init__(self):
+        super(CrabProfileTool, self).__init__(
+            'before_handler', self._start, priority=10)
+
+    def _setup(self):
+        super(CrabProfileTool, self)._setup()
+
+        # Use both hooks: on_end_request ensures that profiling stops
+        # even if the request fails before it is finalized.
+        hooks = cherrypy.request.hooks
+        hooks.attach('before_finalize', self._finish, priority=90)
+        hooks.attach('on_end_request', self._finish)
+
+    def _start(self, always=False, token=None, dir=None):
+        request = cherrypy.request
+
+        if not always:
+            header = request.headers.get(PROFILE_HEADER)
+
+            if (token is None or header is None or
+                    not hmac.compare_digest(header, token)):
+                return
+
+        request.crab_profile_dir = dir
+        request.crab_profile = None
+
+        if dir is not None:
+            profile = cProfile.Profile()
+
+            try:
+                profile.enable()
+                request.crab_profile = profile
+
+            except ValueError as err:
+                # Python may refuse to run multiple profilers at once.
+                cherrypy.log.error('Could not start profiler: ' + str(err))
+
+        start_profile()
+
+    def _finish(self):
+        request = cherrypy.request
+
+        stats = stop_profile()
+        if stats is None:
+            return
+
+        profile = request.crab_profile
+        summary = stats.summary()
+
+        if profile is not None:
+            profile.disable()
+
+            filename = os.path.join(
+                request.crab_profile_dir, '{}_{}_{}.prof'.format(
+                    datetime.now(pytz.UTC).strftime('%Y%m%dT%H%M%S.%f'),
+                    request.method,
+                    re.sub('[^-_.a-zA-Z0-9]', '_',
+                           request.path_info.strip('/')) or 'index'))
+
+            try:
+                profile.dump_stats(filename)
+                summary += '; file=' + os.path.basename(filename)
+
+            except EnvironmentError as err:
+                cherrypy.log.error(
+                    'Could not write profile file: ' + str(err))
+
+        cherrypy.response.headers[PROFILE_HEADER] = summary
+        cherrypy.log.error('Profile: {} {}: {}'.format(
+            request.method, request.path_info, summary))
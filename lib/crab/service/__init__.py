@@ -14,15 +14,299 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from logging import getLogger
+import os
 import pytz
+import socket
 import time
-from threading import Thread
+from threading import Event, Lock, Thread
+
+from crab import CrabError
+from crab.util.bus import CrabStoreListener, priority
 
 logger = getLogger(__name__)
 
 
+class CrabClock():
+    """Source of the current time for services.
+
+    This may be replaced, for example with a CrabSimulatedClock,
+    to run services without waiting in real time."""
+
+    def now(self):
+        """Returns the current time, as a datetime in UTC."""
+
+        return datetime.now(pytz.UTC)
+
+    def sleep(self, seconds):
+        """Pauses for the given number of seconds."""
+
+        time.sleep(seconds)
+
+    def wait(self, event, seconds):
+        """Pauses for the given number of seconds, or until the given
+        threading.Event is set.  Returns True if the event was set."""
+
+        return event.wait(seconds)
+
+
+class CrabSimulatedClock(CrabClock):
+    """Clock which only advances when its sleep method is called."""
+
+    def __init__(self, datetime_):
+        self.current = datetime_
+
+    def now(self):
+        return self.current
+
+    def sleep(self, seconds):
+        self.current += timedelta(seconds=seconds)
+
+    def wait(self, event, seconds):
+        self.sleep(seconds)
+        return event.is_set()
+
+
+class CrabLease(CrabStoreListener):
+    """Lease which services must hold in order to act.
+
+    This allows several servers to share a store, with only one of them
+    writing alarms, sending notifications and cleaning at a time.
+    The lease is renewed (or, if held by another server, acquisition
+    is re-tried) by a heartbeat thread each time a third of its duration
+    has passed, independently of the services which check whether
+    it is held.  If it can not be renewed, it is considered lost
+    when it expires.  The servers' clocks should be synchronized."""
+
+    def __init__(self, bus, config, clock=None):
+        super(CrabLease, self).__init__(bus)
+
+        self.clock = clock if clock is not None else CrabClock()
+        self.name = config.get('name', 'crabd')
+        self.holder = config.get('holder') or '{}:{}'.format(
+            socket.getfqdn(), os.getpid())
+        self.duration = timedelta(seconds=config.get('duration', 60))
+
+        self.expires = None
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.thread = None
+
+    def subscribe(self):
+        super(CrabLease, self).subscribe()
+
+        self.bus.subscribe('start', self.start)
+        self.bus.subscribe('stop', self.stop)
+
+    @priority(71)
+    def start(self):
+        """Starts the heartbeat thread which renews the lease."""
+
+        self.stop_event.clear()
+        self.thread = Thread(target=self._heartbeat, name='crab-lease')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stops the heartbeat thread and releases the lease."""
+
+        self.stop_event.set()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        self.release()
+
+    def _heartbeat(self):
+        """Heartbeat thread function.
+
+        Attempts to renew the lease each time a third of its duration
+        has passed, until the stop event is set."""
+
+        while True:
+            attempt = self.clock.now()
+            self.renew()
+
+            next_attempt = attempt + self.duration / 3
+            if self.clock.wait(self.stop_event, max(
+                    0, (next_attempt - self.clock.now()).total_seconds())):
+                break
+
+    def held(self):
+        """Determines whether the lease is held.
+
+        This does not access the store, so it can be called by services
+        at any time without waiting for a renewal attempt."""
+
+        with self.lock:
+            if self.expires is not None and self.clock.now() >= self.expires:
+                logger.warning('Lease "{}" expired'.format(self.name))
+                self.expires = None
+
+            return self.expires is not None
+
+    def renew(self):
+        """Attempts to acquire or renew the lease."""
+
+        datetime_ = self.clock.now()
+
+        # The store does not record fractions of a second, so
+        # discard them here to avoid over-estimating the expiry.
+        expires = (datetime_ + self.duration).replace(microsecond=0)
+
+        try:
+            acquired = self.store.acquire_lease(
+                self.name, self.holder, expires, datetime_)
+
+        except CrabError:
+            logger.exception('Error renewing lease')
+            return
+
+        with self.lock:
+            if acquired:
+                if self.expires is None:
+                    logger.info('Acquired lease "{}" as {}'.format(
+                        self.name, self.holder))
+
+                self.expires = expires
+
+            elif self.expires is not None:
+                logger.warning('Lost lease "{}"'.format(self.name))
+                self.expires = None
+
+    def release(self):
+        """Releases the lease, if held, so that another server may
+        acquire it without waiting for it to expire."""
+
+        with self.lock:
+            if self.expires is None:
+                return
+
+            self.expires = None
+
+            try:
+                self.store.release_lease(self.name, self.holder)
+
+            except CrabError:
+                logger.exception('Error releasing lease')
+
+
+class CrabScheduler(Thread):
+    """Scheduler which dispatches minute ticks and deadlines to services.
+
+    Rather than each service waking every few seconds to check whether
+    the minute has changed, services are added to the scheduler, which
+    sleeps until the start of the next minute, or the earliest deadline
+    requested via set_deadline.  Services which have a "wake" method,
+    such as the monitor which runs its own loop, are woken.  Otherwise
+    the service's _check_minute method is called by a pool of worker
+    threads, so that long-running work (e.g. cleaning the store) can not
+    delay other services.  A service is not called again while a
+    previous call is still running: any minutes which pass in the
+    meantime are caught up by _check_minute."""
+
+    def __init__(self, clock=None, threads=4):
+        Thread.__init__(self)
+
+        self.clock = clock if clock is not None else CrabClock()
+        self.services = []
+        self.deadlines = {}
+        self.running = set()
+        self.minute = None
+        self.lock = Lock()
+        self.wake_event = Event()
+        self.stopped = Event()
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def add(self, service):
+        """Adds a service to those dispatched each minute."""
+
+        with self.lock:
+            self.services.append(service)
+
+    def set_deadline(self, service, datetime_):
+        """Requests that the given service also be dispatched at the
+        given time, or clears its deadline if the time is None."""
+
+        with self.lock:
+            if self.deadlines.get(service) == datetime_:
+                return
+
+            if datetime_ is None:
+                del self.deadlines[service]
+            else:
+                self.deadlines[service] = datetime_
+
+        self.wake_event.set()
+
+    def run(self):
+        """Thread run function.
+
+        Dispatches services as required and then sleeps until the
+        next minute or deadline, or until a deadline is changed."""
+
+        try:
+            while True:
+                self.wake_event.clear()
+                wake = self._dispatch(self.clock.now())
+
+                self.clock.wait(self.wake_event, max(
+                    0, (wake - self.clock.now()).total_seconds()))
+
+        finally:
+            self.stopped.set()
+
+    def _dispatch(self, datetime_):
+        """Dispatches all services if the minute has changed, and any
+        services with deadlines which have passed.
+
+        Returns the time at which this method should next be called."""
+
+        minute = datetime_.replace(second=0, microsecond=0)
+        services = []
+
+        with self.lock:
+            if self.minute is None or minute > self.minute:
+                self.minute = minute
+                services.extend(self.services)
+
+            for (service, deadline) in list(self.deadlines.items()):
+                if deadline <= datetime_:
+                    del self.deadlines[service]
+                    if service not in services:
+                        services.append(service)
+
+            wake = min(
+                [minute + timedelta(minutes=1)] +
+                list(self.deadlines.values()))
+
+            for service in services:
+                if hasattr(service, 'wake'):
+                    service.wake()
+
+                elif service not in self.running:
+                    self.running.add(service)
+                    self.pool.submit(self._run_service, service)
+
+        return wake
+
+    def _run_service(self, service):
+        """Worker function calling a service's _check_minute method."""
+
+        try:
+            service._check_minute()
+
+        except Exception:
+            logger.exception('Error: scheduled service raised exception')
+
+        finally:
+            with self.lock:
+                self.running.discard(service)
+
+
 class CrabMinutely(Thread):
     """A thread which will call its run_minutely method for each minute
     which passes.
@@ -32,46 +316,76 @@ class CrabMinutely(Thread):
     to pause for longer than expected.  Therefore in the context of
     cron jobs, it might be possible to miss a cron scheduling point."""
 
-    def __init__(self):
+    def __init__(self, clock=None, scheduler=None):
         """Constructor for minutely scheduled sevices.
 
         In order to allow subclasses to override the run method,
-        we record the start time here."""
+        we record the start time here.  A CrabClock object may be
+        given, otherwise the real time is used.
+
+        If a CrabScheduler is given, the service is dispatched by it
+        rather than by this thread checking the time itself."""
 
         Thread.__init__(self)
-        self._previous = datetime.now(pytz.UTC)
+        self.clock = clock if clock is not None else CrabClock()
+        self.scheduler = scheduler
+        self._previous = self.clock.now()
 
     def run(self):
         """Thread run function.
 
-        This calls _check_minute on regular intervals."""
+        This calls _check_minute on regular intervals.  If there
+        is a scheduler, the service is added to it instead, and this
+        thread waits for as long as the scheduler is running."""
+
+        if self.scheduler is not None:
+            self.scheduler.add(self)
+            self.scheduler.stopped.wait()
+            return
 
         while True:
-            time.sleep(5)
+            self.clock.sleep(5)
             self._check_minute()
 
     def _check_minute(self):
         """Check whether one or more minutes has passed, and if so,
-        run the run_minutely method for each of them.
+        run the run_interval method for them.
 
         If a subclass needs to implements its own run method, it should
         call this method regularly."""
 
-        delta = timedelta(seconds=55)
-        current = datetime.now(pytz.UTC)
-        previous = self._previous
+        current = self.clock.now()
+
+        if minute_before(self._previous, current):
+            start = (self._previous.replace(second=0, microsecond=0) +
+                     timedelta(minutes=1))
+            end = current.replace(second=0, microsecond=0)
+
+            try:
+                self.run_interval(start, end)
+            except Exception as e:
+                logger.exception("Error: run_interval raised exception")
+
+            self._previous = current
+
+    def run_interval(self, start, end):
+        """This method is called with the first and last minutes
+        (inclusive) which have passed since it was last called.
+
+        Usually this will be a single minute, but if the process has been
+        stalled, there may be several.  This method calls run_minutely
+        for each minute.  Subclasses can override it in order to handle
+        the whole interval at once."""
 
-        while minute_before(previous, current):
-            previous = self._previous + delta
+        datetime_ = start
 
-            if not minute_equal(previous, self._previous):
-                try:
-                    self.run_minutely(
-                        previous.replace(second=0, microsecond=0))
-                except Exception as e:
-                    logger.exception("Error: run_minutely raised exception")
+        while datetime_ <= end:
+            try:
+                self.run_minutely(datetime_)
+            except Exception as e:
+                logger.exception("Error: run_minutely raised exception")
 
-            self._previous = previous
+            datetime_ += timedelta(minutes=1)
 
     def run_minutely(self, datetime_):
         """This is the method which will be called each minute.  It should
@@ -17,26 +17,55 @@ from datetime import timedelta
 
 from crab import CrabError
 from crab.service import CrabMinutely
+from crab.util.metrics import histogram
 from crab.util.schedule import CrabSchedule
 
+clean_time = histogram(
+    'crab_clean_seconds', 'Time taken to delete old events',
+    (1, 10, 60, 300, 900, 3600))
+
 
 class CrabCleanService(CrabMinutely):
     """Service to clean the store by removing old events."""
 
-    def __init__(self, config, store):
+    def __init__(self, config, store, lease=None, scheduler=None):
         """Constructor method.
 
-        Stores the store object and a CrabSchedule object."""
+        Stores the store object and a CrabSchedule object.
+        If a CrabLease object is given, cleaning is only performed
+        while the lease is held.  A CrabScheduler may be given
+        to dispatch the service."""
 
-        CrabMinutely.__init__(self)
+        CrabMinutely.__init__(self, scheduler=scheduler)
 
         self.store = store
+        self.lease = lease
         self.schedule = CrabSchedule(config['schedule'], config['timezone'])
         self.keep_days = config['keep_days']
+        self.batch_size = config.get('batch_size')
+
+    def run_interval(self, start, end):
+        """Performs cleaning once, for the last scheduled minute in
+        the interval, if any."""
+
+        if not self.schedule.match(end):
+            if start == end:
+                return
+
+            end = self.schedule.previous_match(end)
+            if end is None or end < start:
+                return
+
+        self.run_minutely(end)
 
     def run_minutely(self, datetime_):
         """Performs cleaning if scheduled for the given minute."""
 
         if self.schedule.match(datetime_):
-            self.store.delete_old_events(
-                datetime_=(datetime_ - timedelta(days=self.keep_days)))
+            if self.lease is not None and not self.lease.held():
+                return
+
+            with clean_time.time():
+                self.store.delete_old_events(
+                    datetime_=(datetime_ - timedelta(days=self.keep_days)),
+                    batch_size=self.batch_size)
@@ -15,31 +15,131 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import datetime, timedelta
+import json
 from logging import getLogger
-import pytz
-import time
 from random import Random
 from threading import Condition, Event, Thread
 
+import pytz
+
 from crab import CrabError, CrabEvent, CrabStatus
 from crab.service import CrabMinutely
+from crab.util.metrics import gauge, histogram
 from crab.util.schedule import CrabSchedule
 
 HISTORY_COUNT = 10
+HISTORY_OFFSET = 128
+FAIL_COUNT = 40
+FAIL_FIELDS = ('id', 'status', 'datetime', 'finishid')
 LATE_GRACE_PERIOD = timedelta(seconds=30)
+EVENT_BATCH = 1000
+EVENT_GAP_LIMIT = 100
+EVENT_GAP_TIMEOUT = timedelta(minutes=1)
+SNAPSHOT_DATETIME = '%Y-%m-%d %H:%M:%S'
 
 logger = getLogger(__name__)
 
+tick_time = histogram(
+    'crab_monitor_tick_seconds', 'Time taken by each monitor loop iteration')
+waiters = gauge(
+    'crab_monitor_waiters', 'Number of clients waiting for new events')
+lag_time = gauge(
+    'crab_monitor_lag_seconds',
+    'Age of the latest event processed while catching up')
+
 
 class JobDeleted(Exception):
     """Exception raised by _initialize_job if the job can not be found."""
     pass
 
 
+class CrabJobStatus():
+    """Compact record of the monitor's information about a job.
+
+    The statuses of the most recent runs are stored as a byte string
+    (offset by HISTORY_OFFSET) from which the reliability is computed.
+    They are presented as a list via the "history" property.
+    For compatibility the public fields can be accessed as if
+    this were a dictionary."""
+
+    __slots__ = (
+        'status', 'running', 'installed', 'scheduled', 'reliability',
+        '_history',
+        'sched', 'graceperiod', 'timeout', 'last_start')
+
+    FIELDS = (
+        'status', 'running', 'installed', 'scheduled', 'reliability',
+        'history')
+
+    def __init__(self, installed):
+        self.status = None
+        self.running = False
+        self.installed = installed
+        self.scheduled = False
+        self.reliability = 0
+        self._history = b''
+        self.sched = None
+        self.graceperiod = None
+        self.timeout = None
+        self.last_start = None
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in self.FIELDS:
+            return default
+
+        return getattr(self, key)
+
+    def as_dict(self):
+        """Returns a dictionary of the public fields."""
+
+        return dict((x, getattr(self, x)) for x in self.FIELDS)
+
+    @property
+    def history(self):
+        """List of the statuses of the most recent runs, oldest first."""
+
+        return [x - HISTORY_OFFSET for x in self._history]
+
+    @history.setter
+    def history(self, statuses):
+        self._history = bytes(
+            x + HISTORY_OFFSET for x in statuses[-HISTORY_COUNT:])
+
+    @property
+    def history_count(self):
+        """Number of runs in the history."""
+
+        return len(self._history)
+
+    def add_history(self, status):
+        """Adds the status of a run to the history."""
+
+        self._history = (
+            self._history + bytes((status + HISTORY_OFFSET,))
+        )[-HISTORY_COUNT:]
+
+    def compute_reliability(self):
+        """Recalculates the reliability percentage from the history."""
+
+        if not self._history:
+            self.reliability = 0
+        else:
+            successes = self._history.count(
+                CrabStatus.SUCCESS + HISTORY_OFFSET)
+            self.reliability = int(100 * successes / len(self._history))
+
+
 class CrabMonitor(CrabMinutely):
     """A class implementing the crab monitor thread."""
 
-    def __init__(self, store, passive=False):
+    def __init__(self, store, passive=False, clock=None, lease=None,
+                 snapshot=False, scheduler=None):
         """Constructor.
 
         Saves the given storage backend and prepares the instance
@@ -49,24 +149,49 @@ class CrabMonitor(CrabMinutely):
         job status but will not write alarms into the store.  This could
         be used, for example, to implement a web interface (which requires
         a monitor) separately from the active monitor.
+
+        A CrabClock object may be given in order to run the monitor
+        in simulated time.
+
+        If a CrabLease object is given, alarms are only written while
+        the lease is held.  Otherwise the monitor continues to track
+        the job deadlines, but leaves them pending until an alarm
+        written by the server holding the lease is seen.  This allows
+        it to take over if the lease is acquired.
+
+        If "snapshot" is specified, the status of each job is written to
+        the store's monitor status snapshot whenever it changes (while
+        the lease, if any, is held).  Passive servers can then use
+        CrabMonitorSnapshot instead of processing the events themselves.
+
+        If a CrabScheduler is given, the monitor is woken by it at
+        the start of each minute and when its next deadline expires.
         """
 
-        CrabMinutely.__init__(self)
+        CrabMinutely.__init__(self, clock, scheduler)
 
         self.store = store
         self.passive = passive
-        self.sched = {}
+        self.lease = lease
+        self.snapshot = snapshot
+        self.published = None
         self.status = {}
         self.status_ready = Event()
-        self.config = {}
-        self.last_start = {}
+
+        # Pending deadlines, by job ID.
         self.timeout = {}
         self.late_timeout = {}
         self.miss_timeout = {}
         self.max_startid = 0
         self.max_alarmid = 0
         self.max_finishid = 0
+        self.max_logid = 0
+        self.gaps = {}
+        self.lag = None
+        self.failures = []
+        self.failure_keys = set()
         self.new_event = Condition()
+        self.wake_event = Event()
         self.num_warning = 0
         self.num_error = 0
         self.random = Random()
@@ -81,11 +206,40 @@ class CrabMonitor(CrabMinutely):
 
         It then goes into a loop, and every few seconds it checks
         for new events, processing any which are found.  The new_event
-        Condition is fired if there were any new events.
+        Condition is fired if there were any new events.  The wake method
+        can be used to have it check for events immediately.  If the
+        monitor is catching up with a backlog of events, it continues
+        without pausing.  If there is a scheduler, the monitor is added
+        to it after initialization.
 
         We call _check_minute from CrabMinutely to check whether the
         minute has changed since the last time round the loop."""
 
+        self._initialize()
+
+        if self.scheduler is not None:
+            self.scheduler.add(self)
+
+        while True:
+            if self.lag is None:
+                self.clock.wait(self.wake_event, 5)
+                self.wake_event.clear()
+
+            with tick_time.time():
+                self._tick()
+
+    def wake(self):
+        """Requests that the monitor check for new events without
+        waiting for the end of its current pause.
+
+        This may be used when events are written by another process."""
+
+        self.wake_event.set()
+
+    def _initialize(self):
+        """Loads the initial list of jobs and sets the status_ready
+        Event."""
+
         jobs = self.store.get_jobs()
 
         for job in jobs:
@@ -96,104 +250,342 @@ class CrabMonitor(CrabMinutely):
             except JobDeleted:
                 logger.warning('Warning: job {} has vanished'.format(id_))
 
+        for failure in self.store.get_fail_events(FAIL_COUNT):
+            failure = dict((x, failure[x]) for x in FAIL_FIELDS)
+            self.failures.append(failure)
+            self.failure_keys.add(_failure_key(failure))
+
         self.status_ready.set()
 
-        while True:
-            time.sleep(5)
-            datetime_ = datetime.now(pytz.UTC)
+    def _tick(self):
+        """Performs one iteration of the monitor loop."""
+
+        datetime_ = self.clock.now()
+
+        self._check_events()
+
+        # Allow superclass CrabMinutely to call our run_minutely
+        # method as required.  Note: the call back to run_minutely
+        # is protected by a try-except block in the superclass.
+        self._check_minute()
+
+        # Deadlines may have been met by events not yet processed.
+        if self.lag is None:
+            self._check_timeouts(datetime_)
+
+            if self.scheduler is not None and not self.passive:
+                self.scheduler.set_deadline(
+                    self, self._next_deadline(datetime_))
+
+        self._publish_status()
+
+    def _check_events(self):
+        """Fetches and processes new events.
+
+        Events are fetched in batches of up to EVENT_BATCH.  If a full
+        batch is received, the "lag" attribute is set to the time since
+        the last event in the batch, indicating that further events
+        may be waiting.  Otherwise it is set to None.
+
+        Events with IDs which were skipped are fetched again first,
+        in case they were written by another process (such as an
+        ingest worker) which committed them after later events.
+
+        The new_event Condition is fired if there were any events,
+        so that the web interface shows progress while catching up."""
+
+        # Retrieve events.  Trap exceptions in case of database
+        # disconnection.
+        skipped = []
+        events = []
+        try:
+            skipped = self._get_skipped_events()
+            events = self.store.get_events_since(
+                self.max_startid, self.max_alarmid, self.max_finishid,
+                logid=self.max_logid, limit=EVENT_BATCH)
+        except Exception as e:
+            logger.exception('Error: monitor exception getting events')
+
+        for event in skipped + events:
+            id_ = event['jobid']
+            self._update_max_id_values(event)
 
-            # Retrieve events.  Trap exceptions in case of database
-            # disconnection.
-            events = []
             try:
-                events = self.store.get_events_since(
-                    self.max_startid, self.max_alarmid, self.max_finishid)
+                if id_ not in self.status:
+                    self._initialize_job(id_)
+
+                self._process_event(id_, event)
+                self._compute_reliability(id_)
+                self._record_failure(id_, event)
+
+            # If the monitor is loaded when a job has just been
+            # deleted, then it may have events more recent
+            # than those of the events that still exist.
+            except JobDeleted:
+                pass
+
+            # Also trap other exceptions, in case a database disconnection
+            # causes a failure from _initialize_job.  Do this separately,
+            # inside the events loop so that we keep the max_id_values
+            # up to date with the other events.
             except Exception as e:
-                logger.exception('Error: monitor exception getting events')
+                logger.exception('Error: monitor exception handling event')
 
-            for event in events:
-                id_ = event['jobid']
-                self._update_max_id_values(event)
+        self._count_status()
 
-                try:
-                    if id_ not in self.status:
-                        self._initialize_job(id_)
+        if len(events) < EVENT_BATCH:
+            if self.lag is not None:
+                logger.info('Monitor has processed backlog of events')
+            self.lag = None
+            lag_time.set(0)
 
-                    self._process_event(id_, event)
-                    self._compute_reliability(id_)
+        else:
+            if self.lag is None:
+                logger.info('Monitor processing backlog of events')
+            self.lag = self.clock.now() - events[-1]['datetime']
+            lag_time.set(self.lag.total_seconds())
 
-                # If the monitor is loaded when a job has just been
-                # deleted, then it may have events more recent
-                # than those of the events that still exist.
-                except JobDeleted:
-                    pass
-
-                # Also trap other exceptions, in case a database disconnection
-                # causes a failure from _initialize_job.  Do this separately,
-                # inside the events loop so that we keep the max_id_values
-                # up to date with the other events.
-                except Exception as e:
-                    logger.exception('Error: monitor exception handling event')
-
-            self.num_error = 0
-            self.num_warning = 0
-            for id_ in self.status:
-                jobstatus = self.status[id_]['status']
-                if jobstatus is None or CrabStatus.is_ok(jobstatus):
-                    pass
-                elif CrabStatus.is_warning(jobstatus):
-                    self.num_warning += 1
-                else:
-                    self.num_error += 1
-
-            if events:
-                with self.new_event:
-                    self.new_event.notify_all()
-
-            # Allow superclass CrabMinutely to call our run_minutely
-            # method as required.  Note: the call back to run_minutely
-            # is protected by a try-except block in the superclass.
-            self._check_minute()
-
-            # Check status of timeouts - need to get a list of keys
-            # so that we can delete from the dict while iterating.
-            # Note: _write_alarm uses a try-except block for CrabErrors.
-            for id_ in list(self.late_timeout.keys()):
-                if self.late_timeout[id_] < datetime_:
-                    self._write_alarm(id_, CrabStatus.LATE)
-                    del self.late_timeout[id_]
+        if skipped or events:
+            with self.new_event:
+                self.new_event.notify_all()
 
-            for id_ in list(self.miss_timeout.keys()):
-                if self.miss_timeout[id_] < datetime_:
-                    self._write_alarm(id_, CrabStatus.MISSED)
-                    del self.miss_timeout[id_]
+    def _get_skipped_events(self):
+        """Fetches any events with IDs which were skipped, and which
+        were noted less than EVENT_GAP_TIMEOUT ago.
 
-            for id_ in list(self.timeout.keys()):
-                if self.timeout[id_] < datetime_:
-                    self._write_alarm(id_, CrabStatus.TIMEOUT)
-                    del self.timeout[id_]
+        Older skipped IDs are forgotten, as they may never be used,
+        for example if a transaction was rolled back."""
+
+        expiry = self.clock.now() - EVENT_GAP_TIMEOUT
+        for (key, noted) in list(self.gaps.items()):
+            if noted < expiry:
+                del self.gaps[key]
+
+        if not self.gaps:
+            return []
+
+        ids = {
+            'log': [],
+            CrabEvent.START: [],
+            CrabEvent.ALARM: [],
+            CrabEvent.FINISH: [],
+        }
+
+        for (type_, id_) in self.gaps:
+            ids[type_].append(id_)
+
+        return self.store.get_events_by_id(
+            startids=ids[CrabEvent.START], alarmids=ids[CrabEvent.ALARM],
+            finishids=ids[CrabEvent.FINISH], logids=ids['log'])
+
+    def _count_status(self):
+        """Counts the number of jobs in warning and error states."""
+
+        self.num_error = 0
+        self.num_warning = 0
+        for id_ in self.status:
+            jobstatus = self.status[id_].status
+            if jobstatus is None or CrabStatus.is_ok(jobstatus):
+                pass
+            elif CrabStatus.is_warning(jobstatus):
+                self.num_warning += 1
+            else:
+                self.num_error += 1
+
+    def _publish_status(self):
+        """Writes the status of any jobs which have changed since
+        the previous call to the store's monitor status snapshot,
+        if enabled.
+
+        The snapshot also includes a summary entry, with job ID 0, giving
+        the maximum event IDs seen.  The status entries written are
+        recorded in the "published" dict, which is reset if the lease
+        is not held, so that everything is written again if it is
+        subsequently acquired.  The first time entries are written,
+        jobs which appear in the snapshot but are no longer monitored
+        are removed from it."""
+
+        if not self.snapshot:
+            return
+
+        if self.lease is not None and not self.lease.held():
+            self.published = None
+            return
+
+        entries = {}
+
+        try:
+            if self.published is None:
+                for entry in self.store.get_monitor_status():
+                    id_ = entry['jobid']
+                    if (id_ != 0 and id_ not in self.status and
+                            entry['status'] is not None):
+                        entries[id_] = None
+
+                self.published = {}
+
+            for (id_, job) in self.status.items():
+                record = tuple(getattr(job, x) for x in CrabJobStatus.FIELDS)
+                if self.published.get(id_) != record:
+                    entries[id_] = record
+
+            for id_ in self.published:
+                if id_ != 0 and id_ not in self.status:
+                    entries[id_] = None
+
+            summary = (self.max_startid, self.max_alarmid, self.max_finishid)
+            if self.published.get(0) != summary:
+                entries[0] = summary
+
+            if not entries:
+                return
+
+            self.store.write_monitor_status([
+                (id_, _encode_snapshot_entry(id_, record))
+                for (id_, record) in entries.items()])
+
+        except Exception:
+            logger.exception('Error: monitor exception writing snapshot')
+            return
+
+        for (id_, record) in entries.items():
+            if record is None:
+                self.published.pop(id_, None)
+            else:
+                self.published[id_] = record
+
+    def _check_timeouts(self, datetime_):
+        """Writes alarms for any timeouts which have expired by the
+        given time."""
+
+        if self.lease is not None and not self.lease.held():
+            return
+
+        # Check status of timeouts - need to get a list of keys
+        # so that we can delete from the dict while iterating.
+        # Note: _write_alarm uses a try-except block for CrabErrors.
+        for id_ in list(self.late_timeout.keys()):
+            if self.late_timeout[id_] < datetime_:
+                self._write_alarm(id_, CrabStatus.LATE)
+                del self.late_timeout[id_]
+
+        for id_ in list(self.miss_timeout.keys()):
+            if self.miss_timeout[id_] < datetime_:
+                self._write_alarm(id_, CrabStatus.MISSED)
+                del self.miss_timeout[id_]
+
+        for id_ in list(self.timeout.keys()):
+            if self.timeout[id_] < datetime_:
+                self._write_alarm(id_, CrabStatus.TIMEOUT)
+                del self.timeout[id_]
+
+    def _next_deadline(self, datetime_):
+        """Determines the earliest pending deadline after the given
+        time, or None if there is none.
+
+        Deadlines which have already passed are not considered, because
+        they are checked each time round the monitor loop, and they may
+        remain pending if the lease is not held."""
+
+        deadline = None
+
+        for deadlines in (self.late_timeout, self.miss_timeout, self.timeout):
+            for value in deadlines.values():
+                if value <= datetime_:
+                    continue
+                if deadline is None or value < deadline:
+                    deadline = value
+
+        return deadline
 
     def run_minutely(self, datetime_):
         """Every minute the job scheduling is checked.
 
         At this stage we also check for new / deleted / updated jobs."""
 
+        self.run_interval(datetime_, datetime_)
+
+    def run_interval(self, start, end):
+        """Checks the job scheduling for the interval of minutes from
+        start to end (inclusive) in a single pass, and then checks for
+        new / deleted / updated jobs once.
+
+        For each job, the deadlines are set as if each minute had been
+        checked in turn: the late timeout follows the last scheduled
+        time in the interval, and the miss timeout (unless already
+        "running") follows the first scheduled time after the grace
+        period for the previous start."""
+
         if not self.passive:
-            for id_ in self.sched:
-                if self.sched[id_].match(datetime_):
-                    if ((id_ not in self.last_start) or (
-                            self.last_start[id_]
-                            + self.config[id_]['graceperiod'] < datetime_)):
-                        # No need to check if the late timeout is already
-                        # running as the grace period is currently less
-                        # than the minimum scheduling interval.
-                        self.late_timeout[id_] = datetime_ + LATE_GRACE_PERIOD
-
-                        # Do not reset the miss timeout if it is already
-                        # "running".
-                        if id_ not in self.miss_timeout:
-                            self.miss_timeout[id_] = (
-                                datetime_ + self.config[id_]['graceperiod'])
+            for (id_, job) in self.status.items():
+                if job.sched is None:
+                    continue
+
+                scheduled = self._scheduled_between(job, start, end)
+                if scheduled is None:
+                    continue
+
+                (first, last) = scheduled
+
+                # No need to check if the late timeout is already
+                # running as the grace period is currently less
+                # than the minimum scheduling interval.
+                self.late_timeout[id_] = last + LATE_GRACE_PERIOD
+
+                # Do not reset the miss timeout if it is already
+                # "running".
+                if id_ not in self.miss_timeout:
+                    self.miss_timeout[id_] = first + job.graceperiod
+
+        self._check_jobs()
+
+    def _scheduled_between(self, job, start, end):
+        """Determines the first and last minutes, from start to end
+        (inclusive), at which the job was scheduled to run and which are
+        after the grace period for its previous start.
+
+        Returns a (first, last) tuple, or None if there are no such
+        minutes.  For a single minute only the schedule's match method
+        is used, as determining the next and previous scheduled times
+        is slower.
+
+        The threshold is truncated to the minute, since only whole
+        minutes are compared with it, and the schedule's next_match and
+        previous_match methods are used so that the result is correct
+        across UTC offset changes."""
+
+        sched = job.sched
+        threshold = None
+        if job.last_start is not None:
+            threshold = (job.last_start + job.graceperiod).replace(
+                second=0, microsecond=0)
+
+        if start == end:
+            if not sched.match(end):
+                return None
+            if threshold is not None and not threshold < end:
+                return None
+            return (end, end)
+
+        if threshold is not None and not threshold < start:
+            first = sched.next_match(threshold)
+        elif sched.match(start):
+            first = start
+        else:
+            first = sched.next_match(start)
+
+        if first is None or first > end:
+            return None
+
+        if sched.match(end):
+            last = end
+        else:
+            last = sched.previous_match(end)
+
+        return (first, last)
+
+    def _check_jobs(self):
+        """Checks for new / deleted / updated jobs."""
 
         # Look for new or deleted jobs.
         currentjobs = set(self.status.keys())
@@ -205,9 +597,9 @@ class CrabMonitor(CrabMinutely):
 
                 # Compare installed timestamp is case we need to
                 # reload the schedule.
-                if job['installed'] > self.status[id_]['installed']:
+                if job['installed'] > self.status[id_].installed:
                     self._schedule_job(id_)
-                    self.status[id_]['installed'] = job['installed']
+                    self.status[id_].installed = job['installed']
 
                 # TODO: is there a quick way to check whether we
                 # need to do this?
@@ -230,12 +622,7 @@ class CrabMonitor(CrabMinutely):
         if jobinfo is None or jobinfo['deleted'] is not None:
             raise JobDeleted
 
-        self.status[id_] = {
-            'status': None,
-            'running': False,
-            'history': [],
-            'installed': jobinfo['installed'],
-        }
+        self.status[id_] = CrabJobStatus(jobinfo['installed'])
 
         self._schedule_job(id_, jobinfo)
         self._configure_job(id_)
@@ -248,7 +635,7 @@ class CrabMonitor(CrabMinutely):
             # Events are returned newest-first but we need to work
             # through them in order.
             for event in reversed(events):
-                self._update_max_id_values(event)
+                self._update_max_id_values(event, note_gaps=False)
                 self._process_event(id_, event)
 
             self._compute_reliability(id_)
@@ -259,56 +646,50 @@ class CrabMonitor(CrabMinutely):
         The job information can either be passed in as a dict, or it
         will be fetched from the storage backend.  If scheduling information
         (i.e. a "time" string, and optionally a timezone) is present,
-        a CrabSchedule object is constructed and stored in the sched dict."""
+        a CrabSchedule object is constructed and stored in the job's
+        status record."""
 
         if jobinfo is None:
             jobinfo = self.store.get_job_info(id_)
 
-        self.status[id_]['scheduled'] = False
+        job = self.status[id_]
+        job.scheduled = False
 
         if jobinfo is not None and jobinfo['time'] is not None:
             try:
-                self.sched[id_] = CrabSchedule(
+                job.sched = CrabSchedule(
                     jobinfo['time'],
                     jobinfo['timezone'])
             except CrabError as err:
                 logger.exception('Warning: could not add schedule')
 
             else:
-                self.status[id_]['scheduled'] = True
+                job.scheduled = True
 
     def _configure_job(self, id_):
         """Sets the job configuration.
 
         The configuration will be fetched from the storage backend
-        and stored in the config dict."""
+        and stored in the job's status record."""
 
         default_time = {'graceperiod': 2, 'timeout': 5}
 
-        if id_ not in self.config:
-            self.config[id_] = {}
-
+        job = self.status[id_]
         dbconfig = self.store.get_job_config(id_)
 
         for parameter in default_time:
             if dbconfig is not None and dbconfig[parameter] is not None:
-                self.config[id_][parameter] = timedelta(
-                    minutes=dbconfig[parameter])
+                setattr(job, parameter, timedelta(
+                    minutes=dbconfig[parameter]))
             else:
-                self.config[id_][parameter] = timedelta(
-                    minutes=default_time[parameter])
+                setattr(job, parameter, timedelta(
+                    minutes=default_time[parameter]))
 
     def _remove_job(self, id_):
         """Removes a job from the instance data structures."""
 
         try:
             del self.status[id_]
-            if id_ in self.config:
-                del self.config[id_]
-            if id_ in self.sched:
-                del self.sched[id_]
-            if id_ in self.last_start:
-                del self.last_start[id_]
             if id_ in self.timeout:
                 del self.timeout[id_]
             if id_ in self.late_timeout:
@@ -320,55 +701,89 @@ class CrabMonitor(CrabMinutely):
             logger.warning(
                 'Warning: stopping monitoring job but it is not in monitor.')
 
-    def _update_max_id_values(self, event):
+    def _update_max_id_values(self, event, note_gaps=True):
         """Updates the instance max_startid, max_alarmid and max_finishid
-        values if they are outdate by the event, which is passed as a dict."""
+        values if they are outdate by the event, which is passed as a dict.
+
+        The max_logid value is also updated if the event came from
+        the store's event log.  Skipped IDs are then noted for the
+        event log, rather than for the type of event.  They are not
+        noted if "note_gaps" is false, for example when events are
+        read one job at a time."""
+
+        noted = event['datetime'] if note_gaps else None
+
+        logid = event.get('logid')
+        if logid is not None:
+            self.max_logid = self._update_max_id(
+                'log', logid, self.max_logid, noted)
+            noted = None
+
+        if event['type'] == CrabEvent.START:
+            self.max_startid = self._update_max_id(
+                CrabEvent.START, event['eventid'], self.max_startid, noted)
+
+        elif event['type'] == CrabEvent.ALARM:
+            self.max_alarmid = self._update_max_id(
+                CrabEvent.ALARM, event['eventid'], self.max_alarmid, noted)
 
-        if (event['type'] == CrabEvent.START and
-                event['eventid'] > self.max_startid):
-            self.max_startid = event['eventid']
+        elif event['type'] == CrabEvent.FINISH:
+            self.max_finishid = self._update_max_id(
+                CrabEvent.FINISH, event['eventid'], self.max_finishid, noted)
 
-        if (event['type'] == CrabEvent.ALARM and
-                event['eventid'] > self.max_alarmid):
-            self.max_alarmid = event['eventid']
+    def _update_max_id(self, type_, id_, max_id, noted):
+        """Returns the new maximum ID of the given type.
 
-        if (event['type'] == CrabEvent.FINISH and
-                event['eventid'] > self.max_finishid):
-            self.max_finishid = event['eventid']
+        If the ID is beyond the next expected ID, and the event was
+        recorded recently (at time "noted"), the skipped IDs are noted
+        in the "gaps" dictionary so that they can be checked again by
+        _get_skipped_events.  Large jumps in ID are not noted, nor are
+        those seen when the monitor starts, as these will be due to
+        deleted events.  No IDs are noted if "noted" is None."""
+
+        self.gaps.pop((type_, id_), None)
+
+        if id_ <= max_id:
+            return max_id
+
+        if (max_id and noted is not None and id_ - max_id <= EVENT_GAP_LIMIT
+                and noted >= self.clock.now() - EVENT_GAP_TIMEOUT):
+            for skipped in range(max_id + 1, id_):
+                self.gaps[(type_, skipped)] = noted
+
+        return id_
 
     def _process_event(self, id_, event):
         """Processes the given event, updating the instance data
         structures accordingly."""
 
         datetime_ = event['datetime']
+        job = self.status[id_]
 
         if event['status'] is not None:
             status = event['status']
-            prevstatus = self.status[id_]['status']
+            prevstatus = job.status
 
             # Avoid overwriting a status with a less important one.
 
             if status == CrabStatus.CLEARED:
-                self.status[id_]['status'] = status
+                job.status = status
 
             elif CrabStatus.is_trivial(status):
                 if prevstatus is None or CrabStatus.is_ok(prevstatus):
-                    self.status[id_]['status'] = status
+                    job.status = status
 
             elif CrabStatus.is_warning(status):
                 if prevstatus is None or not CrabStatus.is_error(prevstatus):
-                    self.status[id_]['status'] = status
+                    job.status = status
 
             # Always set success / failure status (the remaining options).
 
             else:
-                self.status[id_]['status'] = status
+                job.status = status
 
             if not CrabStatus.is_trivial(status):
-                history = self.status[id_]['history']
-                if len(history) >= HISTORY_COUNT:
-                    del history[0]
-                history.append(status)
+                job.add_history(status)
 
         # Handle ALREADYRUNNING as a 'start' type event, so that
         # the MISSED alarm is not raised and the timeout period
@@ -376,10 +791,10 @@ class CrabMonitor(CrabMinutely):
 
         if (event['type'] == CrabEvent.START or
                 event['status'] == CrabStatus.ALREADYRUNNING):
-            self.status[id_]['running'] = True
+            job.running = True
             if not self.passive:
-                self.last_start[id_] = datetime_
-                self.timeout[id_] = datetime_ + self.config[id_]['timeout']
+                job.last_start = datetime_
+                self.timeout[id_] = datetime_ + job.timeout
                 if id_ in self.late_timeout:
                     del self.late_timeout[id_]
                 if id_ in self.miss_timeout:
@@ -387,23 +802,87 @@ class CrabMonitor(CrabMinutely):
 
         elif (event['type'] == CrabEvent.FINISH or
                 event['status'] == CrabStatus.TIMEOUT):
-            self.status[id_]['running'] = False
+            job.running = False
             if not self.passive:
                 if id_ in self.timeout:
                     del self.timeout[id_]
 
+        # If sharing the store with other servers, the alarm may have been
+        # written by another server.  Remove the corresponding deadline
+        # if it had passed, so that it is not written again should this
+        # monitor acquire the lease.
+        if self.lease is not None and event['type'] == CrabEvent.ALARM:
+            pending = {
+                CrabStatus.LATE: self.late_timeout,
+                CrabStatus.MISSED: self.miss_timeout,
+                CrabStatus.TIMEOUT: self.timeout,
+            }.get(event['status'])
+
+            if (pending is not None and id_ in pending and
+                    pending[id_] <= datetime_):
+                del pending[id_]
+
+    def _record_failure(self, id_, event):
+        """Adds the event to the list of recent failures, if appropriate.
+
+        The same statuses are skipped as by the store's get_fail_events
+        method, which is used to fill the list initially.  An event may
+        have been included in that initial list, in which case it is
+        not added again.  The list is kept in order of datetime, most
+        recent first, as events with skipped IDs may be received late."""
+
+        status = event['status']
+
+        if event['type'] == CrabEvent.FINISH:
+            if status in (
+                    CrabStatus.SUCCESS, CrabStatus.ALREADYRUNNING,
+                    CrabStatus.INHIBITED):
+                return
+
+            finishid = event['eventid']
+
+        elif event['type'] == CrabEvent.ALARM:
+            if status in (CrabStatus.CLEARED, CrabStatus.LATE):
+                return
+
+            finishid = None
+
+        else:
+            return
+
+        failure = {
+            'id': id_,
+            'status': status,
+            'datetime': event['datetime'],
+            'finishid': finishid,
+        }
+
+        key = _failure_key(failure)
+
+        if key in self.failure_keys:
+            return
+
+        # Find the position of the failure, which is usually at the start.
+        i = 0
+        while (i < len(self.failures) and
+                self.failures[i]['datetime'] > failure['datetime']):
+            i += 1
+
+        if i >= FAIL_COUNT:
+            return
+
+        self.failures.insert(i, failure)
+        self.failure_keys.add(key)
+
+        while len(self.failures) > FAIL_COUNT:
+            self.failure_keys.discard(_failure_key(self.failures.pop()))
+
     def _compute_reliability(self, id_):
-        """Uses the history list of the specified job to recalculate its
+        """Uses the history of the specified job to recalculate its
         reliability percentage and store it in the 'reliability'
-        entry of the status dict."""
+        field of its status record."""
 
-        history = self.status[id_]['history']
-        if len(history) == 0:
-            self.status[id_]['reliability'] = 0
-        else:
-            self.status[id_]['reliability'] = int(
-                100 * len([x for x in history if x == CrabStatus.SUCCESS]) /
-                len(history))
+        self.status[id_].compute_reliability()
 
     def _write_alarm(self, id_, status):
         """Inserts an alarm into the storage backend."""
@@ -420,10 +899,10 @@ class CrabMonitor(CrabMinutely):
     def get_job_status(self, id_=None):
         """Fetches the status of all jobs as a dict.
 
-        For efficiency this returns a reference to our job status dict.
-        Callers should not modify it.  If a job ID is specified, the
-        status entry for that job is returned, or a dummy entry if it is not
-        in the status dict."""
+        For efficiency this returns a reference to our job status dict,
+        which contains CrabJobStatus records.  Callers should not modify it.
+        If a job ID is specified, the status entry for that job is returned,
+        or a dummy entry if it is not in the status dict."""
 
         self.status_ready.wait()
 
@@ -436,6 +915,17 @@ class CrabMonitor(CrabMinutely):
             else:
                 return {'status': None, 'running': False}
 
+    def get_fail_events(self, limit=FAIL_COUNT):
+        """Fetches a list of recent failures, most recent first.
+
+        The entries are dictionaries of the job ID, status, datetime and
+        finish ID (for finish events), giving a subset of the information
+        returned by the store method of the same name."""
+
+        self.status_ready.wait()
+
+        return list(self.failures)[:limit]
+
     def wait_for_event_since(self, startid, alarmid, finishid, timeout=120):
         """Function which waits for new events.
 
@@ -450,8 +940,12 @@ class CrabMonitor(CrabMinutely):
                 self.max_finishid > finishid):
             pass
         else:
-            with self.new_event:
-                self.new_event.wait(timeout + self.random.randint(0, 20))
+            waiters.inc()
+            try:
+                with self.new_event:
+                    self.new_event.wait(timeout + self.random.randint(0, 20))
+            finally:
+                waiters.dec()
 
         return {
             'startid': self.max_startid,
@@ -461,3 +955,114 @@ class CrabMonitor(CrabMinutely):
             'numwarning': self.num_warning,
             'numerror': self.num_error,
         }
+
+
+class CrabMonitorSnapshot(CrabMonitor):
+    """A passive monitor which reads the job status from the monitor
+    status snapshot written to the store by the active monitor.
+
+    This avoids processing all of the events, and (at start up) reading
+    the history of every job, on each passive server.  The web interface
+    uses this class in the same way as a CrabMonitor instance."""
+
+    def __init__(self, store, clock=None):
+        """Constructor.
+
+        Prepares the instance data, and the last snapshot entry ID read,
+        which is zero until the snapshot has been read."""
+
+        CrabMonitor.__init__(self, store, passive=True, clock=clock)
+
+        self.version = 0
+
+    def _initialize(self):
+        """Reads the initial snapshot and sets the status_ready Event."""
+
+        self._tick()
+
+        self.status_ready.set()
+
+    def _tick(self):
+        """Reads the entries which have been written since the
+        last iteration, and fires the new_event Condition if there
+        were any."""
+
+        try:
+            entries = self.store.get_monitor_status(self.version)
+        except Exception:
+            logger.exception('Error: monitor exception reading snapshot')
+            return
+
+        for entry in entries:
+            self.version = entry['id']
+            id_ = entry['jobid']
+
+            if entry['status'] is None:
+                self.status.pop(id_, None)
+                continue
+
+            values = json.loads(entry['status'])
+
+            if id_ == 0:
+                self.max_startid = values['startid']
+                self.max_alarmid = values['alarmid']
+                self.max_finishid = values['finishid']
+                continue
+
+            installed = values['installed']
+            if installed is not None:
+                installed = datetime.strptime(
+                    installed, SNAPSHOT_DATETIME).replace(tzinfo=pytz.UTC)
+
+            job = CrabJobStatus(installed)
+            for field in CrabJobStatus.FIELDS:
+                if field != 'installed':
+                    setattr(job, field, values[field])
+
+            self.status[id_] = job
+
+        self._count_status()
+
+        if entries:
+            with self.new_event:
+                self.new_event.notify_all()
+
+    def get_fail_events(self, limit=FAIL_COUNT):
+        """Fetches a list of recent failures from the store.
+
+        The entries are reduced to the same fields as returned by the
+        CrabMonitor method."""
+
+        return [
+            dict((x, failure[x]) for x in FAIL_FIELDS)
+            for failure in self.store.get_fail_events(limit)]
+
+
+def _encode_snapshot_entry(id_, record):
+    """Converts a record, as stored in the monitor's "published" dict,
+    to JSON for the monitor status snapshot.
+
+    The record for job ID 0 is a tuple of the maximum start, alarm
+    and finish event IDs.  Otherwise it contains the values of the
+    CrabJobStatus public fields."""
+
+    if record is None:
+        return None
+
+    if id_ == 0:
+        return json.dumps(dict(zip(
+            ('startid', 'alarmid', 'finishid'), record)))
+
+    values = dict(zip(CrabJobStatus.FIELDS, record))
+
+    if values['installed'] is not None:
+        values['installed'] = values['installed'].astimezone(
+            pytz.UTC).strftime(SNAPSHOT_DATETIME)
+
+    return json.dumps(values)
+
+
+def _failure_key(failure):
+    """Returns a tuple identifying an entry in the list of failures."""
+
+    return tuple(failure[x] for x in FAIL_FIELDS)
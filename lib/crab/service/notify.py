@@ -14,85 +14,271 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import heapq
+import itertools
 from logging import getLogger
+import pytz
+from threading import Thread
+import time
 
 from crab import CrabError
 from crab.notify import CrabNotify, CrabNotifyJob
 from crab.service import CrabMinutely
 from crab.util.schedule import CrabSchedule
 
+QUEUE_INTERVAL = 10
+QUEUE_BATCH = 100
+
 logger = getLogger(__name__)
 
 
 class CrabNotifyService(CrabMinutely):
     """Service to send notifications as required.
 
-    Currently only a single daily schedule is implemented."""
+    The list of notifications is cached, and only re-read from the
+    store when it reports that a relevant change has been made, or
+    periodically (to catch changes made by other processes).
+    Notifications are grouped by schedule, and the schedules are
+    kept in a heap ordered by the time at which they next fire, so that
+    only the notifications which are due need to be examined
+    each minute."""
 
-    def __init__(self, config, store, notify):
+    def __init__(self, config, store, notify, lease=None, scheduler=None):
         """Constructor method.
 
-        Stores CrabNotify object and daily CrabSchedule object."""
+        Stores CrabNotify object and daily CrabSchedule object.
+        If a CrabLease object is given, notifications are only sent
+        while the lease is held.  A CrabScheduler may be given
+        to dispatch the service."""
 
-        CrabMinutely.__init__(self)
+        CrabMinutely.__init__(self, scheduler=scheduler)
 
         self.store = store
         self.notify = notify
+        self.lease = lease
         self.schedule = CrabSchedule(
             config['daily'], config['timezone'])
-        self.config = {}
+        self.refresh = timedelta(minutes=config.get('refresh', 60))
+
+        # Cached notifications, grouped by schedule key.  The key None
+        # represents the daily schedule.
+        self.notifications = None
+        self.version = None
+        self.expiry = None
         self.sched = {}
+        self.fire = []
+
+        # Counter used to order heap entries which fire at the same time.
+        self.counter = itertools.count()
+
+        # Send notifications from a separate thread, so that
+        # slow delivery does not delay the checking of the schedule.
+        self.delivery = ThreadPoolExecutor(max_workers=1)
 
     def run_minutely(self, datetime_):
         """Issues notifications if any are scheduled for the given minute."""
 
+        if (self.notifications is None or
+                self.version != self.store.notification_version or
+                datetime_ >= self.expiry):
+            try:
+                self._load_notifications(datetime_)
+
+            except CrabError as err:
+                logger.exception('Error fetching notifications')
+                return
+
         current = []
-        match_daily = self.schedule.match(datetime_)
 
-        if match_daily:
-            daily_start = self.schedule.previous_datetime(datetime_)
-        else:
-            daily_start = None
+        while self.fire and self.fire[0][0] <= datetime_:
+            (_, _, key) = heapq.heappop(self.fire)
+            schedule = self.sched[key]
 
-        try:
-            notifications = self.store.get_notifications()
+            # Check the schedule in case of any discrepancy with the
+            # next time computed when the entry was added to the heap.
+            if schedule.match(datetime_):
+                start = schedule.previous_match(datetime_)
+                if start is None:
+                    start = datetime_ - timedelta(days=1)
+
+                for notification in self.notifications[key]:
+                    current.append(CrabNotifyJob(
+                        notification, start, datetime_))
+
+            self._push_schedule(key, datetime_)
+
+        if current and (self.lease is None or self.lease.held()):
+            self.delivery.submit(self._send_notifications, current)
+
+    def _load_notifications(self, datetime_):
+        """Reads the notifications from the store and prepares the
+        heap of schedules for the given minute onwards."""
+
+        # Read the version before fetching the notifications so that
+        # a concurrent change causes them to be read again.
+        version = self.store.notification_version
+        notifications = {}
+        sched = {None: self.schedule}
+
+        for notification in self.store.get_notifications():
+            key = (notification['time'], notification['timezone'])
+
+            if notification['time'] is None:
+                key = None
+
+            elif key not in sched:
+                try:
+                    sched[key] = CrabSchedule(*key)
+                except CrabError as err:
+                    logger.exception(
+                        'Warning: could not read notification schedule')
+                    sched[key] = None
 
-        except CrabError as err:
-            logger.exception('Error fetching notifications')
-            return
+            if sched[key] is None:
+                key = None
 
-        for notification in notifications:
-            n_id = notification['notifyid']
+            notifications.setdefault(key, []).append(notification)
 
-            if (n_id in self.config and n_id in self.sched and
-                    notification['time'] == self.config[n_id]['time'] and
-                    notification['timezone'] == self.config[n_id]['timezone']):
-                schedule = self.sched[n_id]
+        self.notifications = notifications
+        self.sched = sched
+        self.fire = []
+        self.version = version
+        self.expiry = datetime_ + self.refresh
+
+        for key in notifications:
+            if sched[key].match(datetime_):
+                heapq.heappush(self.fire, (datetime_, next(self.counter), key))
             else:
-                self.config[n_id] = notification
-                if notification['time'] is not None:
-                    try:
-                        schedule = CrabSchedule(
-                            notification['time'],
-                            notification['timezone'])
-                    except CrabError as err:
-                        schedule = None
-                        logger.exception(
-                            'Warning: could not read notification schedule')
+                self._push_schedule(key, datetime_)
+
+    def _push_schedule(self, key, datetime_):
+        """Adds the given schedule to the heap for the first minute
+        after the given minute which matches it.
+
+        The schedule's next_match method is used, rather than
+        next_datetime, so that no time is skipped where the timezone's
+        UTC offset changes.  If no time is found, the schedule is
+        not added."""
+
+        next_ = self.sched[key].next_match(datetime_)
+
+        if next_ is not None:
+            heapq.heappush(self.fire, (next_, next(self.counter), key))
+
+    def _send_notifications(self, notifications):
+        """Sends the given notifications, logging any exception raised."""
+
+        try:
+            self.notify(notifications)
+
+        except Exception:
+            logger.exception('Error sending notifications')
+
+
+class CrabNotifyQueueService(Thread):
+    """Service to send messages from the store's notification queue.
+
+    Messages which can not be sent are retried, with the delay doubling
+    after each attempt.  Once the maximum number of attempts has been
+    made, they are marked as "dead" and must be re-queued manually
+    via the web interface."""
+
+    def __init__(self, config, store, notify, lease=None):
+        """Constructor method.
+
+        Reads the queue configuration and prepares the pool of sender
+        threads.  If a CrabLease object is given, the queue is only
+        processed while the lease is held."""
+
+        Thread.__init__(self)
+
+        self.store = store
+        self.notify = notify
+        self.lease = lease
+        self.threads = config.get('queue_threads', 2)
+        self.max_attempts = config.get('queue_attempts', 10)
+        self.retry_delay = config.get('queue_retry_delay', 60)
+        self.retry_delay_max = config.get('queue_retry_delay_max', 3600)
+
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+
+    def run(self):
+        """Thread run function.
+
+        Checks the queue at regular intervals."""
+
+        while True:
+            time.sleep(QUEUE_INTERVAL)
+
+            if self.lease is not None and not self.lease.held():
+                continue
+
+            try:
+                self.send_queue()
+
+            except Exception:
+                logger.exception('Error sending queued notifications')
+
+    def send_queue(self):
+        """Sends the messages which are currently due.
+
+        The messages are divided between the sender threads, each of
+        which uses its own session.  This method does not return until
+        all of the messages have been processed, so that a message can not
+        be picked up again while still being sent."""
+
+        entries = self.store.get_queued_notifications(
+            due=True, limit=QUEUE_BATCH, include_message=True)
+
+        batches = [entries[i::self.threads] for i in range(self.threads)]
+
+        for future in [self.pool.submit(self._send_batch, batch)
+                       for batch in batches if batch]:
+            future.result()
+
+    def _send_batch(self, entries):
+        """Sends the given queue entries."""
+
+        sessions = {}
+
+        try:
+            for entry in entries:
+                method = entry['method']
+
+                try:
+                    if method not in sessions:
+                        sessions[method] = self.notify.session(method)
+
+                    sessions[method].send(entry['address'], entry['message'])
+
+                except Exception as err:
+                    self._send_failed(entry, err)
+
                 else:
-                    schedule = None
+                    self.store.delete_queued_notification(entry['queueid'])
 
-                self.sched[n_id] = schedule
+        finally:
+            for session in sessions.values():
+                session.close()
 
-            if schedule is None:
-                if match_daily:
-                    current.append(CrabNotifyJob(
-                        notification, daily_start, datetime_))
-            else:
-                if schedule.match(datetime_):
-                    current.append(CrabNotifyJob(
-                        notification, schedule.previous_datetime(datetime_),
-                        datetime_))
+    def _send_failed(self, entry, err):
+        """Records a failure to send the given queue entry."""
+
+        attempts = entry['attempts'] + 1
+        dead = attempts >= self.max_attempts
+
+        logger.warning(
+            'Warning: failed to send queued notification {} '
+            '(attempt {}{}): {}'.format(
+                entry['queueid'], attempts, ', giving up' if dead else '',
+                err))
+
+        delay = min(
+            self.retry_delay * (2 ** (attempts - 1)), self.retry_delay_max)
 
-        if current:
-            self.notify(current)
+        self.store.update_queued_notification(
+            entry['queueid'],
+            next_attempt=(datetime.now(pytz.UTC) + timedelta(seconds=delay)),
+            error=str(err), dead=dead)
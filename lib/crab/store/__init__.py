@@ -14,11 +14,28 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from crab.util.crontab import parse_crontab, write_crontab
-from crab.util.statuspattern import check_status_patterns
+from itertools import islice
+
+from crab.util.crontab import crontab_hash, parse_crontab, write_crontab
+from crab.util.metrics import histogram
+
+# Number of rows to fetch at a time when iterating over results.
+ITER_CHUNK = 1000
+
+# Number of crontabs to save in each transaction by save_crontabs.
+SAVE_CHUNK = 100
+
+log_start_time = histogram(
+    'crab_log_start_seconds', 'Time taken to record job starts')
+log_finish_time = histogram(
+    'crab_log_finish_seconds', 'Time taken to record job finishes')
 
 
 class CrabStore:
+    # Counter incremented whenever a change is made which could affect
+    # the list of notifications, allowing it to be cached.
+    notification_version = 0
+
     def get_jobs(self, host=None, user=None, **kwargs):
         """Fetches a list of all of the cron jobs,
         excluding deleted jobs by default.
@@ -31,15 +48,39 @@ class CrabStore:
         with self.lock as c:
             return self._get_jobs(c, host, user, **kwargs)
 
+    def iter_jobs(self, host=None, user=None, chunk=ITER_CHUNK, **kwargs):
+        """Generator yielding cron jobs in order of ID number.
+
+        The jobs are fetched in chunks of the given size, and the lock
+        is released between chunks.  Other arguments are as for
+        get_jobs."""
+
+        after_id = 0
+
+        while True:
+            with self.lock as c:
+                jobs = self._get_jobs(
+                    c, host, user, after_id=after_id, limit=chunk, **kwargs)
+
+            for job in jobs:
+                yield job
+
+            if len(jobs) < chunk:
+                break
+
+            after_id = jobs[-1]['id']
+
     def delete_job(self, id_):
         """Mark a job as deleted."""
         with self.lock as c:
             self._delete_job(c, id_)
+            self._clear_job_raw_crontab_hash(c, id_)
 
     def undelete_job(self, id_):
         """Remove deletion mark from a job."""
         with self.lock as c:
             self._update_job(c, id_)
+            self._clear_job_raw_crontab_hash(c, id_)
 
     def update_job(self, id_, **kwargs):
         """Updates job information.
@@ -48,7 +89,9 @@ class CrabStore:
         and can include: crabid, command, time, timezone."""
         with self.lock as c:
             self._update_job(c, id_, **kwargs)
+            self._clear_job_raw_crontab_hash(c, id_)
 
+    @log_start_time.timed
     def log_start(self, host, user, crabid, command):
         """Inserts a job start record into the database.
 
@@ -71,6 +114,7 @@ class CrabStore:
 
         return data
 
+    @log_finish_time.timed
     def log_finish(
             self, host, user, crabid, command, status,
             stdout=None, stderr=None):
@@ -84,12 +128,14 @@ class CrabStore:
 
             # Fetch the configuration so that we can check the status.
             config = self._get_job_config(c, id_)
-            if config is not None:
-                status = check_status_patterns(
-                    status, config,
-                    '\n'.join((x for x in (stdout, stderr)
-                               if x is not None)))
 
+        # Compare the output with the status patterns without holding
+        # the lock, so that a slow pattern does not hold up other
+        # clients.
+        if config is not None:
+            status = self.pattern_checker(status, config, stdout, stderr)
+
+        with self.lock as c:
             finishid = self._log_finish(c, id_, command, status)
 
         if stdout or stderr:
@@ -144,6 +190,37 @@ class CrabStore:
             return self._get_job_output(
                 c, finishid, host, user, id_, crabid)
 
+    def get_job_outputs(self, finishes):
+        """Fetches the standard output and standard error for a number
+        of finishes.
+
+        The finishes are specified as a list of (finishid, host, user,
+        id_, crabid) tuples, matching the arguments of get_job_output.
+        The result is a dictionary of (stdout, stderr) pairs by finish ID.
+        Pairs of empty strings are included for finishes without output.
+
+        This will use the outputstore if it is defined, otherwise it reads
+        from this store."""
+
+        if self.outputstore is not None:
+            if hasattr(self.outputstore, 'get_job_outputs'):
+                result = self.outputstore.get_job_outputs(finishes)
+            else:
+                result = dict(
+                    (finish[0], self.outputstore.get_job_output(*finish))
+                    for finish in finishes)
+
+        else:
+            with self.lock as c:
+                result = self._get_job_outputs(
+                    c, [finish[0] for finish in finishes])
+
+        for finish in finishes:
+            if finish[0] not in result:
+                result[finish[0]] = ('', '')
+
+        return result
+
     def get_crontab(self, host, user):
         """Fetches the job entries for a particular host and user and builds
         a crontab style representation.
@@ -170,55 +247,200 @@ class CrabStore:
         skipped if they have a specified user name or client host name
         which does not match the given host or user name.
 
+        The existing jobs for the host and user are read once and
+        compared with the crontab in memory, following the same rules
+        as _check_job.  The resulting changes are then written together.
+
+        The raw crontab is saved afterwards, along with its hash
+        (as given by crab.util.crontab.crontab_hash) which can be
+        retrieved via get_raw_crontab_hash.
+
         Returns a list of warning strings."""
 
-        # Save the raw crontab.
-        self.write_raw_crontab(host, user, crontab)
+        with self.lock as c:
+            warning = self._save_crontab(
+                c, host, user, crontab, timezone, allow_filter)
+
+        # Save the raw crontab.  This is done after updating the jobs
+        # so that the hash is not stored if that fails.
+        self.write_raw_crontab(
+            host, user, crontab, crontab_hash(crontab, timezone))
+
+        return warning
+
+    def save_crontabs(
+            self, entries, force=False, chunk=SAVE_CHUNK,
+            allow_filter=True):
+        """Saves a number of crontabs.
+
+        The entries should be dictionaries containing "host", "user",
+        "crontab" (as a list of lines) and optionally "timezone".
+        They may be given as an iterator, and are saved in transactions
+        of up to "chunk" entries.  Unless "force" is specified, crontabs
+        are skipped if they have not changed since they were last saved.
+        If a transaction fails, its entries are saved again one at a time,
+        so that an error only affects the entry which caused it.
 
-        # Prepare set of existing job ID numbers.
-        idset = set()
-        for job in self.get_jobs(host, user):
-            idset.add(job['id'])
+        Generator yielding (entry, warning, error) tuples, where the
+        warning is a list of warning strings, or None if the crontab was
+        skipped or could not be saved, and the error is None or
+        a message explaining why the crontab could not be saved."""
+
+        outputstore = self.outputstore
+        if outputstore is not None and not hasattr(
+                outputstore, 'write_raw_crontab'):
+            outputstore = None
+
+        entries = iter(entries)
+
+        while True:
+            batch = list(islice(entries, chunk))
+            if not batch:
+                break
+
+            try:
+                results = self._save_crontab_batch(
+                    batch, force, outputstore, allow_filter)
+
+            except Exception as err:
+                if len(batch) == 1:
+                    results = [(batch[0], None, str(err))]
+
+                else:
+                    results = []
+
+                    for entry in batch:
+                        try:
+                            results.extend(self._save_crontab_batch(
+                                [entry], force, outputstore, allow_filter))
+
+                        except Exception as err:
+                            results.append((entry, None, str(err)))
+
+            for result in results:
+                yield result
+
+    def _save_crontab_batch(self, batch, force, outputstore, allow_filter):
+        """Saves a list of crontab entries in a single transaction.
+
+        This is the private part of save_crontabs.  Raw crontabs are
+        written to the output store, if given, after the transaction.
+        Errors doing so are recorded for the corresponding entry, as its
+        job records have already been saved.
+
+        Returns a list of (entry, warning, error) tuples."""
+
+        results = []
+        raw = []
+
+        with self.lock as c:
+            for entry in batch:
+                (host, user, crontab) = (
+                    entry['host'], entry['user'], entry['crontab'])
+                timezone = entry.get('timezone')
+                hash_ = crontab_hash(crontab, timezone)
+
+                if not force:
+                    if outputstore is None:
+                        existing = self._get_raw_crontab_hash(
+                            c, host, user)
+                    elif hasattr(outputstore, 'get_raw_crontab_hash'):
+                        existing = outputstore.get_raw_crontab_hash(
+                            host, user)
+                    else:
+                        existing = None
+
+                    if existing == hash_:
+                        results.append((entry, None, None))
+                        continue
+
+                results.append((entry, self._save_crontab(
+                    c, host, user, crontab, timezone, allow_filter), None))
+
+                if outputstore is None:
+                    self._write_raw_crontab(
+                        c, host, user, crontab, hash_)
+                else:
+                    raw.append((len(results) - 1, hash_))
+
+        for (i, hash_) in raw:
+            (entry, warning, error) = results[i]
+
+            try:
+                outputstore.write_raw_crontab(
+                    entry['host'], entry['user'], entry['crontab'], hash_)
+
+            except Exception as err:
+                results[i] = (entry, warning, str(err))
+
+        return results
+
+    def _save_crontab(self, c, host, user, crontab, timezone, allow_filter):
+        """Updates the job records for the given crontab.
+
+        This is the private part of save_crontab which does not save the
+        raw crontab.  The lock should already have been acquired."""
 
         # Parse the crontab.
         (jobs, warning) = parse_crontab(crontab, timezone=timezone)
 
-        # Iterate over the supplied cron jobs, removing each
-        # job from the idset set as we encounter it.
-        idsaved = set()
-        with self.lock as c:
-            for job in jobs:
-                if allow_filter:
-                    vars_ = job['vars']
+        existing = _CrabJobSet(
+            self._get_jobs(c, host, user, include_deleted=True))
 
-                    vars_hostname = vars_.get('CRABCLIENTHOSTNAME')
-                    if (vars_hostname is not None) and (vars_hostname != host):
-                        warning.append(
-                            'Skipped job for other hostname: ' + job['rule'])
-                        continue
+        # Prepare set of existing (not deleted) job records, from
+        # which we remove each job as we encounter it.
+        remaining = set(
+            job for job in existing.jobs if job.deleted is None)
 
-                    vars_username = vars_.get('CRABUSERNAME')
-                    if (vars_username is not None) and (vars_username != user):
-                        warning.append(
-                            'Skipped job for other user: ' + job['rule'])
-                        continue
+        idsaved = set()
 
-                id_ = self._check_job(
-                    c, host, user, job['crabid'],
-                    job['command'], job['time'], job['timezone'])
+        for job in jobs:
+            if allow_filter:
+                vars_ = job['vars']
 
-                if id_ in idsaved:
+                vars_hostname = vars_.get('CRABCLIENTHOSTNAME')
+                if (vars_hostname is not None) and (vars_hostname != host):
                     warning.append(
-                        'Indistinguishable duplicated job: ' + job['rule'])
-                else:
-                    idsaved.add(id_)
+                        'Skipped job for other hostname: ' + job['rule'])
+                    continue
 
-                idset.discard(id_)
+                vars_username = vars_.get('CRABUSERNAME')
+                if (vars_username is not None) and (vars_username != user):
+                    warning.append(
+                        'Skipped job for other user: ' + job['rule'])
+                    continue
 
-            # Set any jobs remaining in the id set to deleted
-            # because we did not see them in the current crontab
-            for id_ in idset:
-                self._delete_job(c, id_)
+            record = existing.check(
+                job['crabid'], job['command'], job['time'],
+                job['timezone'])
+
+            if record in idsaved:
+                warning.append(
+                    'Indistinguishable duplicated job: ' + job['rule'])
+            else:
+                idsaved.add(record)
+
+            remaining.discard(record)
+
+        inserted = []
+        updated = []
+
+        for record in existing.changed:
+            if record.id is None:
+                inserted.append(record)
+            else:
+                updated.append(record)
+
+        if inserted:
+            self._insert_jobs(c, host, user, inserted)
+
+        if updated:
+            self._update_jobs(c, updated)
+
+        # Set any jobs remaining in the set to deleted
+        # because we did not see them in the current crontab
+        if remaining:
+            self._delete_jobs(c, sorted(job.id for job in remaining))
 
         return warning
 
@@ -238,12 +460,15 @@ class CrabStore:
         Tries to find (and update if necessary) the corresponding job.
         If it is not found, the job is stored as a new entry.
 
-        In either case, the job's ID number is returned.
+        In either case, the job's ID number is returned.  If the job was
+        added or updated, the hash of the raw crontab is cleared so that
+        the next import of the crontab is processed in full.
 
         This is a private method because the lock must be acquired
         prior to calling it."""
 
         id_ = None
+        changed = True
 
         # We know the crabid, so use it to search
 
@@ -260,7 +485,7 @@ class CrabStore:
                         command == job['command'] and
                         (time is None or time == job['time']) and
                         (timezone is None or timezone == job['timezone'])):
-                    pass
+                    changed = False
 
                 else:
                     self._update_job(c, id_, None, command, time, timezone)
@@ -300,7 +525,7 @@ class CrabStore:
                 if (job['deleted'] is None and
                         (time is None or time == job['time']) and
                         (timezone is None or timezone == job['timezone'])):
-                    pass
+                    changed = False
 
                 else:
                     self._update_job(c, id_, None, None, time, timezone)
@@ -312,15 +537,19 @@ class CrabStore:
         if id_ is None:
             raise CrabError('store error: failed to identify job')
 
+        if changed:
+            self._clear_raw_crontab_hash(c, host, user)
+
         return id_
 
-    def write_raw_crontab(self, host, user, crontab):
+    def write_raw_crontab(self, host, user, crontab, hash_=None):
         if self.outputstore is not None and hasattr(
                 self.outputstore, 'write_raw_crontab'):
-            return self.outputstore.write_raw_crontab(host, user, crontab)
+            return self.outputstore.write_raw_crontab(
+                host, user, crontab, hash_)
 
         with self.lock as c:
-            return self._write_raw_crontab(c, host, user, crontab)
+            return self._write_raw_crontab(c, host, user, crontab, hash_)
 
     def get_raw_crontab(self, host, user):
         if self.outputstore is not None and hasattr(
@@ -329,3 +558,165 @@ class CrabStore:
 
         with self.lock as c:
             return self._get_raw_crontab(c, host, user)
+
+    def get_raw_crontab_hash(self, host, user):
+        """Retrieves the hash of the raw crontab as last saved, or None
+        if there is no hash or it has been cleared because the jobs
+        have been altered since."""
+
+        if self.outputstore is not None and hasattr(
+                self.outputstore, 'get_raw_crontab'):
+            if hasattr(self.outputstore, 'get_raw_crontab_hash'):
+                return self.outputstore.get_raw_crontab_hash(host, user)
+
+            return None
+
+        with self.lock as c:
+            return self._get_raw_crontab_hash(c, host, user)
+
+
+class _CrabJobRecord():
+    """Record of a job used by save_crontab."""
+
+    __slots__ = ('id', 'crabid', 'command', 'time', 'timezone', 'deleted',
+                 'rank')
+
+    def __init__(self, id_, crabid, command, time, timezone, deleted, rank):
+        self.id = id_
+        self.crabid = crabid
+        self.command = command
+        self.time = time
+        self.timezone = timezone
+        self.deleted = deleted
+        self.rank = rank
+
+    def sort_key(self):
+        """Returns a key corresponding to the order in which _get_jobs
+        returns jobs for a given host and user."""
+
+        return (self.crabid is not None, self.crabid or '', self.rank)
+
+
+class _CrabJobSet():
+    """Set of job records for a given host and user, used by save_crontab
+    to apply the logic of CrabStore._check_job without querying the
+    database for each job."""
+
+    def __init__(self, jobs):
+        """Constructs a job set from a list of jobs as returned
+        by _get_jobs, including deleted jobs."""
+
+        self.jobs = []
+        self.changed = []
+        self.next_rank = 0
+        self.by_crabid = {}
+        self.by_command = {}
+
+        for job in jobs:
+            self._add(_CrabJobRecord(
+                job['id'], job['crabid'], job['command'], job['time'],
+                job['timezone'], job['deleted'], self._rank()))
+
+    def _rank(self):
+        rank = self.next_rank
+        self.next_rank += 1
+        return rank
+
+    def _add(self, record):
+        self.jobs.append(record)
+
+        if record.crabid is not None:
+            self.by_crabid[record.crabid] = record
+
+        self.by_command.setdefault(record.command, []).append(record)
+
+    def _first(self, command, without_crabid=False):
+        """Finds the first record with the given command."""
+
+        records = self.by_command.get(command)
+
+        if not records:
+            return None
+
+        if without_crabid:
+            records = [x for x in records if x.crabid is None]
+
+            if not records:
+                return None
+
+        return min(records, key=_CrabJobRecord.sort_key)
+
+    def _update(self, record, crabid, command, time, timezone):
+        """Updates a record, corresponding to _update_job.
+
+        The job is marked as not deleted and its ranking is updated
+        as if it had been installed now."""
+
+        if crabid is not None:
+            record.crabid = crabid
+            self.by_crabid[crabid] = record
+
+        if command is not None and command != record.command:
+            self.by_command[record.command].remove(record)
+            record.command = command
+            self.by_command.setdefault(command, []).append(record)
+
+        if time is not None:
+            record.time = time
+
+        if timezone is not None:
+            record.timezone = timezone
+
+        record.deleted = None
+        record.rank = self._rank()
+
+        if record not in self.changed:
+            self.changed.append(record)
+
+    def check(self, crabid, command, time=None, timezone=None):
+        """Finds the record for a job, updating it if necessary, or adds
+        a new record.  This follows the logic of _check_job."""
+
+        if crabid is not None:
+            record = self.by_crabid.get(crabid)
+
+            if record is not None:
+                if (record.deleted is None and
+                        command == record.command and
+                        (time is None or time == record.time) and
+                        (timezone is None or timezone == record.timezone)):
+                    pass
+
+                else:
+                    self._update(record, None, command, time, timezone)
+
+                return record
+
+            record = self._first(command, without_crabid=True)
+
+            if record is not None:
+                self._update(record, crabid, None, time, timezone)
+
+                return record
+
+        else:
+            record = self._first(command)
+
+            if record is not None:
+                if (record.deleted is None and
+                        (time is None or time == record.time) and
+                        (timezone is None or timezone == record.timezone)):
+                    pass
+
+                else:
+                    self._update(record, None, None, time, timezone)
+
+                return record
+
+        record = _CrabJobRecord(
+            None, crabid, command, time, timezone, None, self._rank())
+
+        self._add(record)
+        self.changed.append(record)
+
+        return record
@@ -15,12 +15,33 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import datetime
+from logging import getLogger
 from threading import Lock
+from time import perf_counter
 
 import pytz
 
-from crab import CrabError, CrabStatus
-from crab.store import CrabStore
+from crab import CrabError, CrabEvent, CrabStatus
+from crab.store import CrabStore, ITER_CHUNK
+from crab.util.metrics import COUNT_BUCKETS, histogram
+from crab.util.profile import CrabProfileCursor, profile_record, profile_stats
+from crab.util.statuspattern import CrabPatternChecker, discard_patterns
+
+# Maximum number of ID numbers to include in a single query.
+JOB_ID_BLOCK = 500
+
+# Number of rows to fetch from the cursor at a time.
+FETCH_SIZE = 500
+
+logger = getLogger(__name__)
+
+lock_wait_time = histogram(
+    'crab_db_lock_wait_seconds', 'Time spent waiting for the database lock')
+lock_hold_time = histogram(
+    'crab_db_lock_hold_seconds', 'Time for which the database lock was held')
+events_since_rows = histogram(
+    'crab_events_since_rows', 'Number of events fetched by the monitor',
+    COUNT_BUCKETS)
 
 
 class CrabDBLock():
@@ -32,7 +53,10 @@ class CrabDBLock():
         self.ping = ping
 
     def __enter__(self):
+        start = perf_counter()
         self.lock.acquire(True)
+        self.acquired = perf_counter()
+        lock_wait_time.observe(self.acquired - start)
 
         # Open a cursor, but be sure to release the lock again if this
         # fails.
@@ -43,13 +67,20 @@ class CrabDBLock():
             self.cursor = self.conn.cursor(**self.cursor_args)
 
         except self.error_class as err:
-            self.lock.release()
+            self._release()
             raise CrabError('database error (opening cursor): ' + str(err))
 
         except:
-            self.lock.release()
+            self._release()
             raise
 
+        # If this thread is being profiled, record the time waited
+        # and count the queries executed.
+        stats = profile_stats()
+        if stats is not None:
+            stats.record('lock_wait', self.acquired - start)
+            return CrabProfileCursor(self.cursor, stats)
+
         return self.cursor
 
     def __exit__(self, type_, value, tb):
@@ -81,7 +112,7 @@ class CrabDBLock():
                     'database error (ending transaction): ' + str(err))
 
         finally:
-            self.lock.release()
+            self._release()
 
         # If an exception happened during the transaction, raise if it was
         # database error, otherwise leave it alone (do nothing).  If there
@@ -93,6 +124,12 @@ class CrabDBLock():
         elif new_exception is not None:
             raise new_exception
 
+    def _release(self):
+        held = perf_counter() - self.acquired
+        lock_hold_time.observe(held)
+        profile_record('lock_hold', held)
+        self.lock.release()
+
 
 class CrabStoreDB(CrabStore):
     """Crab storage backend using a database.
@@ -101,7 +138,8 @@ class CrabStoreDB(CrabStore):
     it should be possible to generalize it by altering the queries
     based on the database type where necessary."""
 
-    def __init__(self, lock, outputstore=None):
+    def __init__(self, lock, outputstore=None, event_log=False,
+                 pattern_checker=None):
         """Constructor for CrabDB.
 
         Records the reference to the database connection for future reference.
@@ -110,16 +148,35 @@ class CrabStoreDB(CrabStore):
         job output.  An outputstore should implement write_job_output
         and get_job_output, and if provided will be used instead of
         writing the stdout and stderr from the cron jobs to the database.
-        The outputstore should only raise instances of CrabError."""
+        The outputstore should only raise instances of CrabError.
+
+        If "event_log" is set, each event is also recorded in the
+        jobevent table, which gives all events a single sequence of
+        ID numbers.  Event queries are then made using this table
+        rather than combining the separate event tables.
+
+        A CrabPatternChecker may be given to control how job output is
+        compared with the status patterns, for example to limit the
+        output considered or the time taken.  Otherwise a checker with
+        the default settings is used."""
 
         self.lock = lock
         self.outputstore = outputstore
+        self.event_log = event_log
+        self.pattern_checker = (
+            pattern_checker if pattern_checker is not None
+            else CrabPatternChecker())
+        self.raw_crontab_hash = None
 
     def _get_jobs(
             self, c, host, user, include_deleted=False,
-            crabid=None, command=None, without_crabid=False):
+            crabid=None, command=None, without_crabid=False,
+            after_id=None, limit=None):
         """Private/protected version of get_jobs which does not
-        acquire the lock, and takes more search parameters."""
+        acquire the lock, and takes more search parameters.
+
+        If "after_id" is given, only jobs with greater ID numbers
+        are returned, in order of ID number."""
 
         params = []
         conditions = []
@@ -150,18 +207,31 @@ class CrabStoreDB(CrabStore):
 
             conditions.append('crabid IS NULL')
 
+        if after_id is not None:
+            conditions.append('id>?')
+            params.append(after_id)
+            order = 'id ASC'
+        else:
+            order = 'host ASC, user ASC, crabid ASC, installed ASC'
+
         if conditions:
             where_clause = 'WHERE ' + ' AND '.join(conditions)
         else:
             where_clause = ''
 
+        if limit is not None:
+            limit_clause = 'LIMIT ?'
+            params.append(limit)
+        else:
+            limit_clause = ''
+
         return self._query_to_dict_list(
             c,
             'SELECT id, host, user, crabid, command, time, timezone, '
-            'installed AS "installed [timestamp]", '
-            'deleted AS "deleted [timestamp]" '
+            'installed AS "installed [crab_timestamp]", '
+            'deleted AS "deleted [crab_timestamp]" '
             'FROM job ' + where_clause + ' '
-            'ORDER BY host ASC, user ASC, crabid ASC, installed ASC', params)
+            'ORDER BY ' + order + ' ' + limit_clause, params)
 
     def _insert_job(self, c, host, user, crabid, time, command, timezone):
         """Inserts a job record into the database."""
@@ -172,7 +242,11 @@ class CrabStoreDB(CrabStore):
             'VALUES (?, ?, ?, ?, ?, ?)',
             [host, user, crabid, time, command, timezone])
 
-        return c.lastrowid
+        id_ = c.lastrowid
+
+        self.notification_version += 1
+
+        return id_
 
     def _delete_job(self, c, id_):
         """Marks a job as deleted in the database."""
@@ -182,6 +256,8 @@ class CrabStoreDB(CrabStore):
             'WHERE id=?',
             [id_])
 
+        self.notification_version += 1
+
     def _update_job(
             self, c, id_,
             crabid=None, command=None, time=None, timezone=None):
@@ -214,6 +290,47 @@ class CrabStoreDB(CrabStore):
             'UPDATE job SET ' + ', '.join(fields) + ' WHERE id=?',
             params)
 
+        self.notification_version += 1
+
+    def _insert_jobs(self, c, host, user, records):
+        """Inserts a number of job records into the database.
+
+        The records should have crabid, time, command and timezone
+        attributes."""
+
+        c.executemany(
+            'INSERT INTO job (host, user, crabid, ' +
+            'time, command, timezone)' +
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [[host, user, x.crabid, x.time, x.command, x.timezone]
+             for x in records])
+
+        self.notification_version += 1
+
+    def _update_jobs(self, c, records):
+        """Marks a number of jobs as not deleted, and updates all of
+        their information from the given records.
+
+        The records should have id, crabid, command, time and timezone
+        attributes."""
+
+        c.executemany(
+            'UPDATE job SET installed=CURRENT_TIMESTAMP, deleted=NULL, '
+            'crabid=?, command=?, time=?, timezone=? WHERE id=?',
+            [[x.crabid, x.command, x.time, x.timezone, x.id]
+             for x in records])
+
+        self.notification_version += 1
+
+    def _delete_jobs(self, c, ids):
+        """Marks a number of jobs as deleted in the database."""
+
+        c.executemany(
+            'UPDATE job SET deleted=CURRENT_TIMESTAMP WHERE id=?',
+            [[x] for x in ids])
+
+        self.notification_version += 1
+
     def _log_start(self, c, id_, command):
         """Inserts a job start record into the database.
 
@@ -224,6 +341,9 @@ class CrabStoreDB(CrabStore):
             'INSERT INTO jobstart (jobid, command) VALUES (?, ?)',
             [id_, command])
 
+        if self.event_log:
+            self._log_event(c, CrabEvent.START, c.lastrowid)
+
     def _log_finish(self, c, id_, command, status):
         """Inserts a job finish record into the database.
 
@@ -236,7 +356,12 @@ class CrabStoreDB(CrabStore):
             'INSERT INTO jobfinish (jobid, command, status) VALUES (?, ?, ?)',
             [id_, command, status])
 
-        return c.lastrowid
+        finishid = c.lastrowid
+
+        if self.event_log:
+            self._log_event(c, CrabEvent.FINISH, finishid)
+
+        return finishid
 
     def log_alarm(self, id_, status):
         """Inserts an alarm regarding a job into the database.
@@ -251,6 +376,35 @@ class CrabStoreDB(CrabStore):
                 'INSERT INTO jobalarm (jobid, status) VALUES (?, ?)',
                 [id_, status])
 
+            if self.event_log:
+                self._log_event(c, CrabEvent.ALARM, c.lastrowid)
+
+    def _log_event(self, c, type_, eventid):
+        """Copies an event into the jobevent table.
+
+        The event is copied from its own table so that the job ID and
+        datetime match exactly.  The lock should already have been
+        acquired."""
+
+        if type_ == CrabEvent.START:
+            table = 'jobstart'
+            columns = 'NULL, command'
+        elif type_ == CrabEvent.ALARM:
+            table = 'jobalarm'
+            columns = 'status, NULL'
+        elif type_ == CrabEvent.FINISH:
+            table = 'jobfinish'
+            columns = 'status, command'
+        else:
+            raise CrabError('unknown event type: {}'.format(type_))
+
+        c.execute(
+            'INSERT INTO jobevent '
+            '(jobid, type, eventid, datetime, status, command) '
+            'SELECT jobid, ?, id, datetime, ' + columns + ' '
+            'FROM ' + table + ' WHERE id=?',
+            [type_, eventid])
+
     def get_job_info(self, id_):
         """Retrieve information about a job by ID number."""
 
@@ -258,8 +412,8 @@ class CrabStoreDB(CrabStore):
             return self._query_to_dict(
                 c,
                 'SELECT host, user, command, crabid, time, timezone, '
-                'installed AS "installed [timestamp]", '
-                'deleted AS "deleted [timestamp]" '
+                'installed AS "installed [crab_timestamp]", '
+                'deleted AS "deleted [crab_timestamp]" '
                 'FROM job WHERE id = ?',
                 [id_])
 
@@ -286,7 +440,8 @@ class CrabStoreDB(CrabStore):
         with self.lock as c:
             row = self._query_to_dict(
                 c,
-                'SELECT id AS configid FROM jobconfig WHERE jobid = ?',
+                'SELECT id AS configid, success_pattern, warning_pattern, '
+                'fail_pattern FROM jobconfig WHERE jobid = ?',
                 [id_])
 
             if row is None:
@@ -299,6 +454,8 @@ class CrabStoreDB(CrabStore):
                      success_pattern, warning_pattern, fail_pattern,
                      note, inhibit])
 
+                self.notification_version += 1
+
                 return c.lastrowid
 
             else:
@@ -306,6 +463,15 @@ class CrabStoreDB(CrabStore):
                 if configid is None:
                     raise CrabError('job config: got null id')
 
+                # Remove the previous patterns from the compiled pattern
+                # cache if they are being replaced.
+                discard_patterns(*(
+                    row[x] for (x, y) in (
+                        ('success_pattern', success_pattern),
+                        ('warning_pattern', warning_pattern),
+                        ('fail_pattern', fail_pattern))
+                    if row[x] != y))
+
                 c.execute(
                     'UPDATE jobconfig SET graceperiod=?, timeout=?, '
                     'success_pattern=?, warning_pattern=?, '
@@ -349,6 +515,8 @@ class CrabStoreDB(CrabStore):
                 'UPDATE jobconfig SET jobid = ? WHERE id = ?',
                 [id_, configid])
 
+            self.notification_version += 1
+
     def get_job_finishes(
             self, id_, limit=100,
             finishid=None, before=None, after=None,
@@ -393,20 +561,59 @@ class CrabStoreDB(CrabStore):
         with self.lock as c:
             return self._query_to_dict_list(
                 c,
-                'SELECT id AS finishid, datetime AS "datetime [timestamp]", '
-                'command, status '
+                'SELECT id AS finishid, '
+                'datetime AS "datetime [crab_timestamp]", command, status '
                 'FROM jobfinish '
                 'WHERE ' + ' AND '.join(conditions) + ' '
                 'ORDER BY datetime ' + order + ' ' + limit_clause,
                 params)
 
+    def iter_job_finishes(
+            self, id_, chunk=ITER_CHUNK, include_alreadyrunning=False):
+        """Generator yielding all of the finish events for the given job,
+        in order of finish ID.
+
+        The events are fetched in chunks, releasing the lock in between."""
+
+        conditions = ['jobid = ?', 'id > ?']
+        params = [id_, 0]
+
+        if not include_alreadyrunning:
+            conditions.append('status <> ?')
+            params.append(CrabStatus.ALREADYRUNNING)
+
+        params.append(chunk)
+
+        while True:
+            with self.lock as c:
+                finishes = self._query_to_dict_list(
+                    c,
+                    'SELECT id AS finishid, '
+                    'datetime AS "datetime [crab_timestamp]", '
+                    'command, status '
+                    'FROM jobfinish '
+                    'WHERE ' + ' AND '.join(conditions) + ' '
+                    'ORDER BY id ASC LIMIT ?',
+                    params)
+
+            for finish in finishes:
+                yield finish
+
+            if len(finishes) < chunk:
+                break
+
+            params[1] = finishes[-1]['finishid']
+
     def get_job_events(self, id_, limit=100, start=None, end=None):
         """Fetches a combined list of events relating to the specified job.
 
         Return events, newest first (with finishes first for the same
         datetime).  This ordering allows us to apply the SQL limit on
         number of result rows to find the most recent events.  It gives
-        the correct ordering for the job info page."""
+        the correct ordering for the job info page.
+
+        If the event log is enabled, events are returned in reverse
+        order of logging, and include the "logid"."""
 
         conditions = ['jobid=?']
         params = [id_]
@@ -420,7 +627,9 @@ class CrabStoreDB(CrabStore):
             params.append(end.astimezone(pytz.UTC))
 
         where_clause = 'WHERE ' + ' AND '.join(conditions)
-        params = params * 3
+
+        if not self.event_log:
+            params = params * 3
 
         if limit is None:
             limit_clause = ''
@@ -428,51 +637,223 @@ class CrabStoreDB(CrabStore):
             limit_clause = 'LIMIT ?'
             params.append(limit)
 
+        if self.event_log:
+            with self.lock as c:
+                return self._query_to_dict_list(
+                    c,
+                    'SELECT id AS logid, eventid, type, '
+                    'datetime AS "datetime [crab_timestamp]", command, status '
+                    'FROM jobevent ' + where_clause + ' '
+                    'ORDER BY id DESC ' + limit_clause,
+                    params)
+
         with self.lock as c:
             return self._query_to_dict_list(
                 c,
                 'SELECT ' +
                 '    id AS eventid, 1 AS type, ' +
-                '    datetime AS "datetime [timestamp]", ' +
+                '    datetime AS "datetime [crab_timestamp]", ' +
                 '    command, NULL AS status ' +
                 '    FROM jobstart ' + where_clause + ' ' +
                 'UNION SELECT ' +
                 '    id AS eventid, 2 AS type, ' +
-                '    datetime AS "datetime [timestamp]", ' +
+                '    datetime AS "datetime [crab_timestamp]", ' +
                 '    NULL AS command, status ' +
                 '    FROM jobalarm ' + where_clause + ' ' +
                 'UNION SELECT ' +
                 '    id AS eventid, 3 AS type, ' +
-                '    datetime AS "datetime [timestamp]", ' +
+                '    datetime AS "datetime [crab_timestamp]", ' +
                 '    command, status ' +
                 '    FROM jobfinish ' + where_clause + ' ' +
                 'ORDER BY datetime DESC, type DESC ' + limit_clause,
                 params)
 
-    def get_events_since(self, startid, alarmid, finishid):
+    def get_jobs_events(self, ids, start=None, end=None):
+        """Fetches events relating to a number of jobs.
+
+        Returns a dictionary of event lists by job ID, in the same order
+        as get_job_events.  Jobs without events in the given time
+        range are not included in the dictionary.  The job ID numbers
+        are queried in blocks of JOB_ID_BLOCK to keep within database
+        limits on the number of parameters."""
+
+        result = {}
+        ids = sorted(set(ids))
+
+        conditions = []
+        params = []
+
+        if start is not None:
+            conditions.append('datetime>=?')
+            params.append(start.astimezone(pytz.UTC))
+
+        if end is not None:
+            conditions.append('datetime<?')
+            params.append(end.astimezone(pytz.UTC))
+
+        for i in range(0, len(ids), JOB_ID_BLOCK):
+            block = ids[i:i + JOB_ID_BLOCK]
+
+            where_clause = 'WHERE ' + ' AND '.join(
+                ['jobid IN (' + ', '.join(['?'] * len(block)) + ')'] +
+                conditions)
+
+            if self.event_log:
+                with self.lock as c:
+                    events = self._query_to_dict_list(
+                        c,
+                        'SELECT jobid, id AS logid, eventid, type, '
+                        'datetime AS "datetime [crab_timestamp]", '
+                        'command, status '
+                        'FROM jobevent ' + where_clause + ' '
+                        'ORDER BY id DESC',
+                        block + params)
+
+            else:
+                with self.lock as c:
+                    events = self._query_to_dict_list(
+                        c,
+                        'SELECT ' +
+                        '    jobid, id AS eventid, 1 AS type, ' +
+                        '    datetime AS "datetime [crab_timestamp]", ' +
+                        '    command, NULL AS status ' +
+                        '    FROM jobstart ' + where_clause + ' ' +
+                        'UNION SELECT ' +
+                        '    jobid, id AS eventid, 2 AS type, ' +
+                        '    datetime AS "datetime [crab_timestamp]", ' +
+                        '    NULL AS command, status ' +
+                        '    FROM jobalarm ' + where_clause + ' ' +
+                        'UNION SELECT ' +
+                        '    jobid, id AS eventid, 3 AS type, ' +
+                        '    datetime AS "datetime [crab_timestamp]", ' +
+                        '    command, status ' +
+                        '    FROM jobfinish ' + where_clause + ' ' +
+                        'ORDER BY datetime DESC, type DESC',
+                        (block + params) * 3)
+
+            for event in events:
+                id_ = event.pop('jobid')
+
+                if id_ in result:
+                    result[id_].append(event)
+                else:
+                    result[id_] = [event]
+
+        return result
+
+    def get_events_since(
+            self, startid, alarmid, finishid, logid=None, limit=None):
         """Extract minimal summary information for events on all jobs
-        since the given IDs, oldest first."""
+        since the given IDs, oldest first.
+
+        If the event log is enabled and a "logid" is given, events
+        logged after that ID are returned instead, in order of logging.
+        The events then also include their "logid".
+
+        If a limit is given, at most that many events are returned.
+        The caller can then continue from the highest ID of each
+        type of event returned, as events in each table are recorded
+        in order of time."""
 
+        limit_clause = ''
+        limit_param = []
+        if limit is not None:
+            limit_clause = ' LIMIT ?'
+            limit_param = [limit]
+
+        if self.event_log and logid is not None:
+            with self.lock as c:
+                events = self._query_to_dict_list(
+                    c,
+                    'SELECT id AS logid, jobid, eventid, type, '
+                    'datetime AS "datetime [crab_timestamp]", status '
+                    'FROM jobevent WHERE id>? ORDER BY id ASC' +
+                    limit_clause,
+                    [logid] + limit_param)
+
+            events_since_rows.observe(len(events))
+
+            return events
+
+        # Apply the limit to each table, in order of ID, as well as to the
+        # combined result so that the database need not sort the whole
+        # backlog of events.
         with self.lock as c:
-            return self._query_to_dict_list(
+            events = self._query_to_dict_list(
                 c,
                 'SELECT ' +
-                '    jobid, id AS eventid, 1 AS type, ' +
-                '    datetime AS "datetime [timestamp]", ' +
+                '    jobid, eventid, type, ' +
+                '    datetime AS "datetime [crab_timestamp]", status ' +
+                'FROM (SELECT * FROM (SELECT ' +
+                '    jobid, id AS eventid, 1 AS type, datetime, ' +
                 '    NULL AS status FROM jobstart ' +
-                '    WHERE id > ? ' +
-                'UNION SELECT ' +
-                '    jobid, id AS eventid, 2 AS type, ' +
-                '    datetime AS "datetime [timestamp]", ' +
+                '    WHERE id > ? ORDER BY id' + limit_clause + ') AS s ' +
+                'UNION SELECT * FROM (SELECT ' +
+                '    jobid, id AS eventid, 2 AS type, datetime, ' +
                 '    status FROM jobalarm ' +
-                '    WHERE id > ? ' +
-                'UNION SELECT ' +
-                '    jobid, id AS eventid, 3 AS type, ' +
-                '    datetime AS "datetime [timestamp]", ' +
+                '    WHERE id > ? ORDER BY id' + limit_clause + ') AS a ' +
+                'UNION SELECT * FROM (SELECT ' +
+                '    jobid, id AS eventid, 3 AS type, datetime, ' +
                 '    status FROM jobfinish ' +
-                '    WHERE id > ? ' +
-                'ORDER BY datetime ASC, type ASC',
-                [startid, alarmid, finishid])
+                '    WHERE id > ? ORDER BY id' + limit_clause + ') AS f ' +
+                ') AS events ' +
+                'ORDER BY datetime ASC, type ASC, eventid ASC' +
+                limit_clause,
+                [startid] + limit_param + [alarmid] + limit_param +
+                [finishid] + limit_param + limit_param)
+
+        events_since_rows.observe(len(events))
+
+        return events
+
+    def get_events_by_id(
+            self, startids=(), alarmids=(), finishids=(), logids=()):
+        """Extract the same summary information as get_events_since
+        for the events with the given IDs, oldest first.
+
+        This allows a caller to check again for events with IDs which
+        it skipped, in case they were recorded by another connection
+        whose transaction had not yet been committed.  IDs of events
+        which do not exist are ignored.  If "logids" are given, these
+        are looked up in the event log and the other IDs are ignored."""
+
+        if logids:
+            with self.lock as c:
+                return self._query_to_dict_list(
+                    c,
+                    'SELECT id AS logid, jobid, eventid, type, '
+                    'datetime AS "datetime [crab_timestamp]", status '
+                    'FROM jobevent WHERE id IN (' +
+                    ', '.join(['?'] * len(logids)) + ') ORDER BY id ASC',
+                    list(logids))
+
+        selects = []
+        param = []
+
+        for (ids, type_, table, status) in (
+                (startids, 1, 'jobstart', 'NULL'),
+                (alarmids, 2, 'jobalarm', 'status'),
+                (finishids, 3, 'jobfinish', 'status')):
+            if not ids:
+                continue
+
+            selects.append(
+                'SELECT jobid, id AS eventid, {} AS type, datetime, '
+                '{} AS status FROM {} WHERE id IN ({})'.format(
+                    type_, status, table, ', '.join(['?'] * len(ids))))
+            param.extend(ids)
+
+        if not selects:
+            return []
+
+        with self.lock as c:
+            return self._query_to_dict_list(
+                c,
+                'SELECT jobid, eventid, type, '
+                'datetime AS "datetime [crab_timestamp]", status '
+                'FROM (' + ' UNION '.join(selects) + ') AS events '
+                'ORDER BY datetime ASC, type ASC, eventid ASC',
+                param)
 
     def get_fail_events(self, limit=40):
         """Retrieves the most recent failures for all events,
@@ -482,12 +863,34 @@ class CrabStoreDB(CrabStore):
         since the filtering is done in the SQL.  The codes skipped
         are CLEARED, LATE, SUCCESS, ALREADYRUNNING and INHIBITED."""
 
+        if self.event_log:
+            with self.lock as c:
+                return self._query_to_dict_list(
+                    c,
+                    'SELECT '
+                    '    job.id AS id, status, '
+                    '    datetime AS "datetime [crab_timestamp]", '
+                    '    host, user, job.crabid AS crabid, '
+                    '    COALESCE(jobevent.command, job.command) '
+                    '        AS command, '
+                    '    CASE WHEN type=? THEN eventid ELSE NULL END '
+                    '        AS finishid '
+                    '    FROM jobevent JOIN job ON jobevent.jobid = job.id '
+                    '    WHERE (type=? AND status NOT IN (?, ?, ?)) '
+                    '    OR (type=? AND status NOT IN (?, ?)) '
+                    'ORDER BY jobevent.id DESC LIMIT ?',
+                    [CrabEvent.FINISH,
+                     CrabEvent.FINISH, CrabStatus.SUCCESS,
+                     CrabStatus.ALREADYRUNNING, CrabStatus.INHIBITED,
+                     CrabEvent.ALARM, CrabStatus.CLEARED, CrabStatus.LATE,
+                     limit])
+
         with self.lock as c:
             return self._query_to_dict_list(
                 c,
                 'SELECT ' +
                 '    job.id AS id, status, ' +
-                '    datetime AS "datetime [timestamp]", ' +
+                '    datetime AS "datetime [crab_timestamp]", ' +
                 '    host, user, ' +
                 '    job.crabid AS crabid, jobfinish.command AS command, ' +
                 '    jobfinish.id AS finishid ' +
@@ -495,7 +898,7 @@ class CrabStoreDB(CrabStore):
                 '    WHERE status NOT IN (?, ?, ?) ' +
                 'UNION SELECT ' +
                 '    job.id AS id, status, ' +
-                '    datetime AS "datetime [timestamp]", ' +
+                '    datetime AS "datetime [crab_timestamp]", ' +
                 '    host, user, ' +
                 '    job.crabid AS crabid, job.command AS command, ' +
                 '    NULL as finishid ' +
@@ -507,13 +910,45 @@ class CrabStoreDB(CrabStore):
                  CrabStatus.CLEARED, CrabStatus.LATE,
                  limit])
 
-    def delete_old_events(self, datetime_):
-        """Delete events older than the given datetime."""
+    def delete_old_events(self, datetime_, batch_size=None):
+        """Delete events older than the given datetime.
 
-        with self.lock as c:
-            c.execute('DELETE FROM jobalarm WHERE datetime<?', [datetime_])
-            c.execute('DELETE FROM jobstart WHERE datetime<?', [datetime_])
-            c.execute('DELETE FROM jobfinish WHERE datetime<?', [datetime_])
+        If a batch size is given, each table is processed in ranges of
+        that many ID numbers, releasing the lock in between.  Since
+        events are recorded in order, the old events should be those
+        with the lowest ID numbers, so each range can be found via the
+        primary key."""
+
+        tables = ['jobalarm', 'jobstart', 'jobfinish']
+
+        if self.event_log:
+            tables.append('jobevent')
+
+        if batch_size is None:
+            with self.lock as c:
+                for table in tables:
+                    c.execute(
+                        'DELETE FROM ' + table + ' WHERE datetime<?',
+                        [datetime_])
+
+            return
+
+        for table in tables:
+            with self.lock as c:
+                c.execute(
+                    'SELECT MIN(id), MAX(id) FROM ' + table + ' '
+                    'WHERE datetime<?', [datetime_])
+                (minid, maxid) = c.fetchone()
+
+            if minid is None:
+                continue
+
+            for start in range(minid - 1, maxid, batch_size):
+                with self.lock as c:
+                    c.execute(
+                        'DELETE FROM ' + table + ' '
+                        'WHERE id>? AND id<=? AND datetime<?',
+                        [start, start + batch_size, datetime_])
 
     def _write_job_output(self, c, finishid, host, user, id_, crabid,
                           stdout, stderr):
@@ -547,21 +982,118 @@ class CrabStoreDB(CrabStore):
 
         return row
 
-    def _write_raw_crontab(self, c, host, user, crontab):
+    def _get_job_outputs(self, c, finishids):
+        """Fetches the standard output and standard error for a number
+        of finish IDs.
+
+        Returns a dictionary of (stdout, stderr) pairs by finish ID,
+        omitting finishes for which there is no output."""
+
+        result = {}
+        finishids = sorted(set(finishids))
+
+        for i in range(0, len(finishids), JOB_ID_BLOCK):
+            block = finishids[i:i + JOB_ID_BLOCK]
+
+            c.execute(
+                'SELECT finishid, stdout, stderr FROM joboutput ' +
+                'WHERE finishid IN (' + ', '.join(['?'] * len(block)) + ')',
+                block)
+
+            for (finishid, stdout, stderr) in c.fetchall():
+                result[finishid] = (stdout, stderr)
+
+        return result
+
+    def _write_raw_crontab(self, c, host, user, crontab, hash_=None):
         entry = self._query_to_dict(
             c,
             'SELECT id FROM rawcrontab WHERE host = ? AND user = ?',
             [host, user])
 
-        if entry is None:
+        if not self._has_raw_crontab_hash(c):
+            if entry is None:
+                c.execute(
+                    'INSERT INTO rawcrontab (host, user, crontab) '
+                    'VALUES (?, ?, ?)',
+                    [host, user, '\n'.join(crontab)])
+            else:
+                c.execute(
+                    'UPDATE rawcrontab SET crontab = ? WHERE id = ?',
+                    ['\n'.join(crontab), entry['id']])
+
+        elif entry is None:
             c.execute(
-                'INSERT INTO rawcrontab (host, user, crontab) '
-                'VALUES (?, ?, ?)',
-                [host, user, '\n'.join(crontab)])
+                'INSERT INTO rawcrontab (host, user, crontab, hash) '
+                'VALUES (?, ?, ?, ?)',
+                [host, user, '\n'.join(crontab), hash_])
         else:
             c.execute(
-                'UPDATE rawcrontab SET crontab = ? WHERE id = ?',
-                ['\n'.join(crontab), entry['id']])
+                'UPDATE rawcrontab SET crontab = ?, hash = ? WHERE id = ?',
+                ['\n'.join(crontab), hash_, entry['id']])
+
+    def _get_raw_crontab_hash(self, c, host, user):
+        if not self._has_raw_crontab_hash(c):
+            return None
+
+        entry = self._query_to_dict(
+            c,
+            'SELECT hash FROM rawcrontab WHERE host = ? AND user = ?',
+            [host, user])
+
+        if entry is None:
+            return None
+        else:
+            return entry['hash']
+
+    def _clear_raw_crontab_hash(self, c, host, user):
+        """Clears the hash of the raw crontab for the given host and user.
+
+        This is done when jobs are altered other than by save_crontab,
+        so that the next import of the crontab is processed even
+        if the crontab has not changed."""
+
+        if self.outputstore is not None and hasattr(
+                self.outputstore, 'write_raw_crontab'):
+            if hasattr(self.outputstore, 'clear_raw_crontab_hash'):
+                self.outputstore.clear_raw_crontab_hash(host, user)
+
+        elif self._has_raw_crontab_hash(c):
+            c.execute(
+                'UPDATE rawcrontab SET hash = NULL '
+                'WHERE host = ? AND user = ? AND hash IS NOT NULL',
+                [host, user])
+
+    def _clear_job_raw_crontab_hash(self, c, id_):
+        """Clears the hash of the raw crontab for the given job's
+        host and user."""
+
+        job = self._query_to_dict(
+            c, 'SELECT host, user FROM job WHERE id = ?', [id_])
+
+        if job is not None:
+            self._clear_raw_crontab_hash(c, job['host'], job['user'])
+
+    def _has_raw_crontab_hash(self, c):
+        """Determines whether the rawcrontab table has the hash column.
+
+        This column is added to existing databases by the
+        util/update_2026-10-19_crontabhash.sql script.  Without it,
+        crontab hashes are not stored, so every import is processed
+        in full.  The result is cached."""
+
+        if self.raw_crontab_hash is None:
+            try:
+                c.execute('SELECT hash FROM rawcrontab WHERE 1=0', [])
+                c.fetchall()
+                self.raw_crontab_hash = True
+
+            except self.lock.error_class:
+                logger.warning(
+                    'Crontab hashes not stored: rawcrontab.hash missing')
+                self.raw_crontab_hash = False
+
+        return self.raw_crontab_hash
 
     def _get_raw_crontab(self, c, host, user):
         entry = self._query_to_dict(
@@ -670,12 +1202,192 @@ class CrabStoreDB(CrabStore):
                      skip_warning, skip_error, include_output,
                      notifyid])
 
+            self.notification_version += 1
+
     def delete_notification(self, notifyid):
         """Removes a notification from the database."""
 
         with self.lock as c:
             c.execute('DELETE FROM jobnotify WHERE id=?', [notifyid])
 
+            self.notification_version += 1
+
+    def queue_notification(self, method, address, message):
+        """Adds a message to the outbound notification queue.
+
+        The addresses should be given as a list.  Returns the queue
+        entry ID number."""
+
+        with self.lock as c:
+            c.execute(
+                'INSERT INTO notifyqueue (method, address, message) '
+                'VALUES (?, ?, ?)',
+                [method, '\n'.join(address), message])
+
+            return c.lastrowid
+
+    def get_queued_notifications(
+            self, due=False, dead=None, limit=None, include_message=False):
+        """Fetches entries from the notification queue, oldest first.
+
+        If "due" is specified, only entries which are not dead and
+        are ready to be sent are included.  Otherwise entries can be
+        selected by their dead status.  The message itself is only
+        retrieved if "include_message" is set."""
+
+        conditions = []
+        params = []
+
+        if due:
+            conditions.append('dead=0 AND next_attempt<=CURRENT_TIMESTAMP')
+
+        elif dead is not None:
+            conditions.append('dead=?')
+            params.append(dead)
+
+        if conditions:
+            where_clause = 'WHERE ' + ' AND '.join(conditions) + ' '
+        else:
+            where_clause = ''
+
+        if limit is None:
+            limit_clause = ''
+        else:
+            limit_clause = 'LIMIT ?'
+            params.append(limit)
+
+        with self.lock as c:
+            entries = self._query_to_dict_list(
+                c,
+                'SELECT id AS queueid, method, address, ' +
+                ('message, ' if include_message else '') +
+                'datetime AS "datetime [crab_timestamp]", attempts, '
+                'next_attempt AS "next_attempt [crab_timestamp]", error, dead '
+                'FROM notifyqueue ' + where_clause +
+                'ORDER BY id ASC ' + limit_clause,
+                params)
+
+        for entry in entries:
+            entry['address'] = entry['address'].split('\n')
+
+        return entries
+
+    def update_queued_notification(self, queueid, next_attempt, error, dead):
+        """Records an unsuccessful attempt to send a queued notification.
+
+        The next attempt time is given as a UTC datetime."""
+
+        with self.lock as c:
+            c.execute(
+                'UPDATE notifyqueue SET attempts=attempts+1, '
+                'next_attempt=?, error=?, dead=? WHERE id=?',
+                [next_attempt.astimezone(pytz.UTC).replace(
+                    tzinfo=None, microsecond=0),
+                 error, dead, queueid])
+
+    def retry_queued_notification(self, queueid):
+        """Resets a queued notification so that it will be sent
+        again as soon as possible."""
+
+        with self.lock as c:
+            c.execute(
+                'UPDATE notifyqueue SET attempts=0, '
+                'next_attempt=CURRENT_TIMESTAMP, dead=0 WHERE id=?',
+                [queueid])
+
+    def delete_queued_notification(self, queueid):
+        """Removes an entry from the notification queue."""
+
+        with self.lock as c:
+            c.execute('DELETE FROM notifyqueue WHERE id=?', [queueid])
+
+    def acquire_lease(self, name, holder, expires, datetime_=None):
+        """Attempts to acquire or renew the named lease.
+
+        The lease is granted to the given holder until the "expires"
+        time if it is not currently held by another holder, or if
+        its previous holder's lease expired before the given time
+        (default: now).  Times should be given as UTC datetimes.
+
+        Returns True if the lease was granted."""
+
+        if datetime_ is None:
+            datetime_ = datetime.now(pytz.UTC)
+
+        expires = expires.astimezone(pytz.UTC).replace(
+            tzinfo=None, microsecond=0)
+        datetime_ = datetime_.astimezone(pytz.UTC).replace(
+            tzinfo=None, microsecond=0)
+
+        with self.lock as c:
+            c.execute(
+                'UPDATE lease SET holder=?, expires=? '
+                'WHERE name=? AND (holder=? OR expires<?)',
+                [holder, expires, name, holder, datetime_])
+
+            if c.rowcount == 1:
+                return True
+
+            # The update may not have matched, or (for MySQL) may not
+            # have been counted if the row was unchanged.
+            c.execute('SELECT holder FROM lease WHERE name=?', [name])
+            row = c.fetchone()
+
+        if row is not None:
+            return row[0] == holder
+
+        # There was no lease: attempt to create it.  This fails if
+        # another server has just done so.
+        try:
+            with self.lock as c:
+                c.execute(
+                    'INSERT INTO lease (name, holder, expires) '
+                    'VALUES (?, ?, ?)',
+                    [name, holder, expires])
+
+        except CrabError:
+            return False
+
+        return True
+
+    def release_lease(self, name, holder):
+        """Releases the named lease, if held by the given holder."""
+
+        with self.lock as c:
+            c.execute(
+                'DELETE FROM lease WHERE name=? AND holder=?',
+                [name, holder])
+
+    def write_monitor_status(self, entries):
+        """Writes entries to the monitor status snapshot.
+
+        The entries are given as (jobid, status) pairs, where the status
+        is a JSON string, or None if the job is no longer monitored.
+        Job ID 0 is used for the monitor's summary entry.  Any previous
+        entries for the same jobs are removed, so that the snapshot
+        contains one entry per job and entries which have changed
+        since a given ID can be found."""
+
+        with self.lock as c:
+            c.executemany(
+                'DELETE FROM monitorstatus WHERE jobid=?',
+                [[x[0]] for x in entries])
+
+            c.executemany(
+                'INSERT INTO monitorstatus (jobid, status) VALUES (?, ?)',
+                entries)
+
+    def get_monitor_status(self, since=0):
+        """Fetches entries from the monitor status snapshot with
+        IDs greater than the given value, in order of ID."""
+
+        with self.lock as c:
+            return self._query_to_dict_list(
+                c,
+                'SELECT id, jobid, status FROM monitorstatus '
+                'WHERE id>? ORDER BY id ASC',
+                [since])
+
     def _query_to_dict(self, c, sql, param=[]):
         """Convenience method which returns a single row from
         _query_to_dict_list.
@@ -699,21 +1411,56 @@ class CrabStoreDB(CrabStore):
 
         output = []
 
+        for batch in self._query_to_dict_batches(c, sql, param):
+            output.extend(batch)
+
+        return output
+
+    def _query_to_dict_batches(self, c, sql, param=[]):
+        """Generator executing an SQL query and yielding the result
+        as lists of Python dict objects.
+
+        Rows are fetched from the cursor in batches.  The column names
+        are read once, and the columns containing naive datetime values
+        are identified from the first non-null value in each column."""
+
         c.execute(sql, param)
 
+        names = [x[0] for x in c.description]
+        unknown = set(range(len(names)))
+        naive = []
+
         while True:
-            row = c.fetchone()
-            if row is None:
+            rows = c.fetchmany(FETCH_SIZE)
+            if not rows:
                 break
 
-            dict = {}
+            if unknown:
+                for row in rows:
+                    for i in list(unknown):
+                        value = row[i]
+                        if value is not None:
+                            unknown.discard(i)
+                            if (isinstance(value, datetime) and
+                                    value.tzinfo is None):
+                                naive.append(i)
 
-            for (i, coldescription) in enumerate(c.description):
-                value = row[i]
-                if isinstance(value, datetime):
-                    value = value.replace(tzinfo=pytz.UTC)
-                dict[coldescription[0]] = value
+                    if not unknown:
+                        break
 
-            output.append(dict)
+            if not naive:
+                yield [dict(zip(names, row)) for row in rows]
 
-        return output
+            else:
+                batch = []
+
+                for row in rows:
+                    row = list(row)
+                    for i in naive:
+                        value = row[i]
+                        if value is not None:
+                            row[i] = value.replace(tzinfo=pytz.UTC)
+
+                    batch.append(dict(zip(names, row)))
+
+                yield batch
@@ -38,6 +38,7 @@ class CrabStoreFile:
         self.outext = 'txt'
         self.errext = 'err'
         self.tabext = 'txt'
+        self.hashext = 'hash'
 
         if not os.path.isdir(self.dir):
             raise CrabError('file store error: invalid base directory')
@@ -152,8 +153,11 @@ class CrabStoreFile:
 
         return (stdout, stderr)
 
-    def write_raw_crontab(self, host, user, crontab):
-        """Writes the given crontab to a file."""
+    def write_raw_crontab(self, host, user, crontab, hash_=None):
+        """Writes the given crontab to a file.
+
+        If a hash is given, it is written to a separate file, otherwise
+        any existing hash file is removed."""
 
         pathname = self._make_crontab_path(host, user)
 
@@ -177,6 +181,51 @@ class CrabStoreFile:
                 'file store error: could not write crontab: ' +
                 str(err))
 
+        if hash_ is None:
+            self.clear_raw_crontab_hash(host, user)
+
+        else:
+            try:
+                with open(self._make_crontab_path(
+                        host, user, self.hashext), 'w') as file:
+                    file.write(hash_)
+
+            except IOError as err:
+                raise CrabError(
+                    'file store error: could not write crontab hash: ' +
+                    str(err))
+
+    def get_raw_crontab_hash(self, host, user):
+        """Reads the hash of the given user's crontab, if present."""
+
+        pathname = self._make_crontab_path(host, user, self.hashext)
+
+        if not os.path.exists(pathname):
+            return None
+
+        try:
+            with open(pathname) as file:
+                return file.read().strip()
+
+        except IOError as err:
+            raise CrabError(
+                'file store error: could not read crontab hash: ' +
+                str(err))
+
+    def clear_raw_crontab_hash(self, host, user):
+        """Removes the hash of the given user's crontab, if present."""
+
+        pathname = self._make_crontab_path(host, user, self.hashext)
+
+        try:
+            os.unlink(pathname)
+
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise CrabError(
+                    'file store error: could not remove crontab hash: ' +
+                    str(err))
+
     def get_raw_crontab(self, host, user):
         """Reads the given user's crontab from a file."""
 
@@ -236,9 +285,15 @@ class CrabStoreFile:
             self.outputdir, alphanum(host), alphanum(user),
             job, *finishpath)
 
-    def _make_crontab_path(self, host, user):
-        """Determine the full path to be used to store a crontab."""
+    def _make_crontab_path(self, host, user, ext=None):
+        """Determine the full path to be used to store a crontab.
+
+        The crontab file extension (self.tabext) is used unless another
+        extension is specified."""
+
+        if ext is None:
+            ext = self.tabext
 
         return (
             os.path.join(self.tabdir, alphanum(host), alphanum(user))
-            + '.' + self.tabext)
+            + '.' + ext)
@@ -15,6 +15,8 @@
 
 from __future__ import absolute_import
 
+from datetime import datetime
+from logging import getLogger
 import re
 import pytz
 
@@ -23,6 +25,13 @@ from mysql.connector.errors import Error as _MySQLError
 from mysql.connector.cursor import MySQLCursor
 
 from crab.store.db import CrabStoreDB, CrabDBLock
+from crab.store.partition import add_partitions_query, drop_partitions_query
+
+logger = getLogger(__name__)
+
+# Number of monthly partitions, starting with the current month, which
+# should exist in each partitioned event table.
+PARTITION_MONTHS = 2
 
 
 class CrabStoreMySQLCursor(MySQLCursor):
@@ -37,20 +46,40 @@ class CrabStoreMySQLCursor(MySQLCursor):
         This is for compatability with SQL statements which were
         written for SQLite."""
 
-        # Replace placeholders.
-        query = re.sub(r'\?', '%s', query)
+        return MySQLCursor.execute(self, _prepare_query(query), params)
+
+    def executemany(self, query, seq_params):
+        """Execute an SQL query for each set of parameters.
+
+        This method prepares the query in the same way as the execute
+        method and then calls MySQLCursor.executemany."""
+
+        return MySQLCursor.executemany(
+            self, _prepare_query(query), seq_params)
 
-        # Remove column type instructions.
-        query = re.sub(r'AS "([a-z]+) \[timestamp\]"', '', query)
 
-        return MySQLCursor.execute(self, query, params)
+def _prepare_query(query):
+    """Prepares an SQL query written for SQLite for use with MySQL."""
+
+    # Replace placeholders.
+    query = re.sub(r'\?', '%s', query)
+
+    # Remove column type instructions.
+    query = re.sub(r'AS "([a-z_]+) \[crab_timestamp\]"', '', query)
+
+    return query
 
 
 class CrabStoreMySQL(CrabStoreDB):
     """MySQL-based storage class."""
 
-    def __init__(self, host, database, user, password, outputstore=None):
-        """Connects to MySQL and initializes the storage object."""
+    def __init__(self, host, database, user, password, outputstore=None,
+                 event_log=False, partitioned=False, pattern_checker=None):
+        """Connects to MySQL and initializes the storage object.
+
+        If "partitioned" is specified, the event tables should have been
+        partitioned by time using the util/update_2026-10-19_partition_mysql
+        script.  Old events are then removed by dropping partitions."""
 
         conn = mysql.connector.connect(
             host=host, database=database, user=user, password=password,
@@ -62,4 +91,96 @@ class CrabStoreMySQL(CrabStoreDB):
                 conn, error_class=_MySQLError,
                 cursor_args={'cursor_class': CrabStoreMySQLCursor},
                 ping=True),
-            outputstore=outputstore)
+            outputstore=outputstore, event_log=event_log,
+            pattern_checker=pattern_checker)
+
+        self.partitioned = partitioned
+
+    def delete_old_events(self, datetime_, batch_size=None):
+        """Delete events older than the given datetime.
+
+        If the event tables are partitioned, partitions containing only
+        older events are dropped, and partitions are added for the coming
+        months, before the remaining older events are deleted as usual.
+        As the job output table then has no foreign key to the finish
+        events, the output of the deleted finish events is deleted here.
+        This includes any output left by previous runs, as its finish
+        event ID will also be in the range searched."""
+
+        if not self.partitioned:
+            CrabStoreDB.delete_old_events(self, datetime_, batch_size)
+            return
+
+        tables = ['jobalarm', 'jobstart', 'jobfinish']
+
+        if self.event_log:
+            tables.append('jobevent')
+
+        # Determine the range of finish event IDs which are to be removed
+        # so that the search for their output can be limited to it.
+        with self.lock as c:
+            c.execute(
+                'SELECT MAX(id) FROM jobfinish WHERE datetime<?', [datetime_])
+            (maxid,) = c.fetchone()
+
+        for table in tables:
+            self._update_partitions(table, datetime_)
+
+        CrabStoreDB.delete_old_events(self, datetime_, batch_size)
+
+        if maxid is None:
+            return
+
+        query = (
+            'DELETE FROM joboutput WHERE finishid<=? AND NOT EXISTS '
+            '(SELECT 1 FROM jobfinish WHERE jobfinish.id=joboutput.finishid)')
+
+        while True:
+            with self.lock as c:
+                if batch_size is None:
+                    c.execute(query, [maxid])
+                    return
+
+                c.execute(
+                    query + ' ORDER BY finishid LIMIT ?', [maxid, batch_size])
+
+                if c.rowcount < batch_size:
+                    return
+
+    def _update_partitions(self, table, datetime_):
+        """Drops the partitions of the given table which only contain
+        events older than the given datetime, and adds partitions for
+        the current month and those following, up to PARTITION_MONTHS.
+
+        New partitions are split from the partition for later events,
+        which should be named "pmax".  MySQL copies the rows of that
+        partition, locking the table, so it is expected to be empty.
+        A warning is logged if it is not."""
+
+        with self.lock as c:
+            c.execute(
+                'SELECT partition_name, partition_description, table_rows '
+                'FROM information_schema.partitions '
+                'WHERE table_schema=DATABASE() AND table_name=? '
+                'AND partition_name IS NOT NULL '
+                'ORDER BY partition_ordinal_position', [table])
+            rows = c.fetchall()
+
+        partitions = [(name, bound) for (name, bound, count) in rows]
+
+        query = drop_partitions_query(table, partitions, datetime_)
+        if query is not None:
+            with self.lock as c:
+                c.execute(query, [])
+
+        query = add_partitions_query(
+            table, partitions, datetime.now(pytz.UTC), PARTITION_MONTHS)
+        if query is not None:
+            count = rows[-1][2]
+            if count:
+                logger.warning(
+                    'Reorganizing partition pmax of table {}, '
+                    'which has about {} rows'.format(table, count))
+
+            with self.lock as c:
+                c.execute(query, [])
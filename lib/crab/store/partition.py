@@ -0,0 +1,90 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from calendar import timegm
+from datetime import datetime
+
+# These functions prepare queries to maintain tables partitioned by month.
+# They are used by the MySQL store, but do not require the MySQL connector.
+# Existing partitions are given as lists of (name, bound) pairs, in order,
+# where the bound is the partition's "VALUES LESS THAN" value: a Unix
+# timestamp, as a string, or "MAXVALUE".
+
+
+def month_partitions(datetime_, months):
+    """Determines the names and upper bounds (as Unix timestamps) of
+    monthly partitions, starting with the month of the given datetime.
+
+    Each partition is named "p" followed by its year and month."""
+
+    (year, month) = (datetime_.year, datetime_.month)
+    partitions = []
+
+    for i in range(months):
+        name = 'p{:04d}{:02d}'.format(year, month)
+
+        (year, month) = (year + 1, 1) if month == 12 else (year, month + 1)
+
+        partitions.append(
+            (name, timegm(datetime(year, month, 1).utctimetuple())))
+
+    return partitions
+
+
+def drop_partitions_query(table, partitions, datetime_):
+    """Prepares a query to drop the partitions of the given table
+    which only contain events older than the given datetime.
+
+    Returns None if there are no such partitions."""
+
+    cutoff = timegm(datetime_.utctimetuple())
+
+    old = [
+        name for (name, bound) in partitions
+        if bound != 'MAXVALUE' and int(bound) <= cutoff]
+
+    if not old:
+        return None
+
+    return 'ALTER TABLE ' + table + ' DROP PARTITION ' + ', '.join(old)
+
+
+def add_partitions_query(table, partitions, datetime_, months):
+    """Prepares a query to add partitions to the given table for the
+    month of the given datetime and those following, up to the given
+    number of months.
+
+    New partitions are split from the partition for later events,
+    which should be the last partition and be named "pmax".  Returns None
+    if there is no such partition or no partitions need to be added."""
+
+    if not partitions or partitions[-1] != ('pmax', 'MAXVALUE'):
+        return None
+
+    bounds = [int(bound) for (name, bound) in partitions[:-1]]
+    new = [
+        (name, bound) for (name, bound) in month_partitions(
+            datetime_, months)
+        if not bounds or bound > max(bounds)]
+
+    if not new:
+        return None
+
+    return (
+        'ALTER TABLE ' + table + ' '
+        'REORGANIZE PARTITION pmax INTO (' + ', '.join(
+            'PARTITION {} VALUES LESS THAN ({})'.format(*x)
+            for x in new) +
+        ', PARTITION pmax VALUES LESS THAN MAXVALUE)')
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from contextlib import closing
+from datetime import datetime
 import os
 import pytz
 
@@ -23,8 +24,26 @@ import sqlite3
 from crab.store.db import CrabStoreDB, CrabDBLock
 
 
+def _convert_timestamp(value):
+    """Converts a timestamp, as stored by SQLite, to a datetime object
+    in UTC.
+
+    This is considerably faster than the sqlite3 module's default
+    timestamp converter, which is deprecated as of Python 3.12.
+    (It requires Python 3.7 or later.)  It is registered under
+    a name specific to Crab, since sqlite3 converters apply to all
+    connections in the process."""
+
+    return datetime.fromisoformat(value.decode('ascii')).replace(
+        tzinfo=pytz.UTC)
+
+
+sqlite3.register_converter('crab_timestamp', _convert_timestamp)
+
+
 class CrabStoreSQLite(CrabStoreDB):
-    def __init__(self, filename, outputstore=None):
+    def __init__(self, filename, outputstore=None, event_log=False,
+                 pattern_checker=None):
         if filename != ':memory:' and not os.path.exists(filename):
             raise Exception('SQLite file does not exist')
 
@@ -38,4 +57,5 @@ class CrabStoreSQLite(CrabStoreDB):
         CrabStoreDB.__init__(
             self,
             lock=CrabDBLock(conn, error_class=sqlite3.DatabaseError),
-            outputstore=outputstore)
+            outputstore=outputstore, event_log=event_log,
+            pattern_checker=pattern_checker)
@@ -28,6 +28,14 @@ def restore_signals():
     signal.signal(signal.SIGXFSZ, signal.SIG_DFL)
 
 
+# Determine the type of strings, including unicode strings in Python 2,
+# for use with isinstance.
+try:
+    string_type = basestring
+except NameError:
+    string_type = str
+
+
 # Determine which options should be given to the subprocess module
 # when starting new processes.  The "restore_signals" option was
 # added in Python 3.2, so we need only ensure that it is turned on.
@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from hashlib import sha256
+import json
 import re
 
 from crab.util.string import \
@@ -157,3 +159,21 @@ def write_crontab(jobs):
         firstrow = False
 
     return crontab
+
+
+def crontab_hash(crontab, timezone=None):
+    """
+    Computes a hash of a list of crontab lines and the timezone
+    with which they are to be interpreted.
+
+    This is used to detect crontabs which have not changed since
+    they were last imported, so the client and server must
+    compute it in the same way.
+
+    >>> crontab_hash(['0 * * * * hourly'], 'UTC')[:16]
+    '41c1a38a73611eb4'
+    """
+
+    return sha256(json.dumps(
+        {'crontab': crontab, 'timezone': timezone},
+        sort_keys=True).encode('ascii')).hexdigest()
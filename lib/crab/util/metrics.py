@@ -0,0 +1,221 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from abc import ABCMeta, abstractmethod
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+
+from crab import CrabError
+
+# Default histogram buckets, in seconds.
+TIME_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Histogram buckets suitable for counts of items.
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000)
+
+_registry = OrderedDict()
+_registry_lock = Lock()
+
+
+class CrabMetric(metaclass=ABCMeta):
+    """Base class for metrics.
+
+    Subclasses must implement the _format_values method."""
+
+    type_ = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.lock = Lock()
+
+    def format(self):
+        """Returns a list of lines describing the metric."""
+
+        return [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} {}'.format(self.name, self.type_),
+        ] + self._format_values()
+
+    @abstractmethod
+    def _format_values(self):
+        """Returns a list of lines giving the values of the metric."""
+
+
+class CrabCounter(CrabMetric):
+    """Metric which counts events."""
+
+    type_ = 'counter'
+
+    def __init__(self, name, description):
+        super(CrabCounter, self).__init__(name, description)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def _format_values(self):
+        return ['{} {}'.format(self.name, _format_number(self.value))]
+
+
+class CrabGauge(CrabCounter):
+    """Metric representing a value which may go up and down."""
+
+    type_ = 'gauge'
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+
+class CrabHistogram(CrabMetric):
+    """Metric recording the distribution of observed values."""
+
+    type_ = 'histogram'
+
+    def __init__(self, name, description, buckets=TIME_BUCKETS):
+        super(CrabHistogram, self).__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        # Find the first bucket whose upper bound the value does not exceed.
+        # Only the per-bucket counts are stored: they are accumulated
+        # when formatted.
+        i = bisect_left(self.buckets, value)
+
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Returns a context manager which records the time taken
+        by the enclosed block."""
+
+        return CrabTimer(self)
+
+    def timed(self, func):
+        """Decorator which records the time taken by each call to
+        a function."""
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(perf_counter() - start)
+
+        return wrapper
+
+    def _format_values(self):
+        with self.lock:
+            counts = list(self.counts)
+            sum_ = self.sum
+            count = self.count
+
+        lines = []
+        total = 0
+        for (bucket, n) in zip(self.buckets + ('+Inf',), counts):
+            total += n
+            lines.append('{}_bucket{{le="{}"}} {}'.format(
+                self.name, _format_number(bucket), total))
+
+        lines.append('{}_sum {}'.format(self.name, _format_number(sum_)))
+        lines.append('{}_count {}'.format(self.name, count))
+
+        return lines
+
+
+class CrabTimer():
+    """Context manager which records elapsed time in a histogram."""
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, type_, value, tb):
+        self.histogram.observe(perf_counter() - self.start)
+
+
+def counter(name, description):
+    """Gets or creates a counter."""
+
+    return _register(CrabCounter, name, description)
+
+
+def gauge(name, description):
+    """Gets or creates a gauge."""
+
+    return _register(CrabGauge, name, description)
+
+
+def histogram(name, description, buckets=TIME_BUCKETS):
+    """Gets or creates a histogram."""
+
+    return _register(CrabHistogram, name, description, buckets)
+
+
+def format_metrics():
+    """Returns the text representation of all registered metrics."""
+
+    with _registry_lock:
+        metrics = list(_registry.values())
+
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.format())
+
+    return '\n'.join(lines) + '\n'
+
+
+def _register(class_, name, description, *args):
+    with _registry_lock:
+        metric = _registry.get(name)
+
+        if metric is None:
+            metric = _registry[name] = class_(name, description, *args)
+
+        elif type(metric) is not class_:
+            raise CrabError(
+                'metric {} already registered as {}'.format(
+                    name, metric.type_))
+
+        return metric
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(value)
+
+    return str(value)
@@ -0,0 +1,104 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import local
+from time import perf_counter
+
+_local = local()
+
+
+class CrabProfileStats():
+    """Statistics gathered while profiling a request."""
+
+    __slots__ = ('start', 'queries', 'times', 'counts')
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.times = {}
+        self.counts = {}
+
+    def record(self, name, seconds):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def summary(self):
+        """Returns a one-line summary of the statistics."""
+
+        parts = [
+            'total={:.6f}'.format(perf_counter() - self.start),
+            'queries={}'.format(self.queries),
+        ]
+
+        for name in sorted(self.times.keys()):
+            parts.append('{}={:.6f}'.format(name, self.times[name]))
+            parts.append('{}_count={}'.format(name, self.counts[name]))
+
+        return '; '.join(parts)
+
+
+class CrabProfileCursor():
+    """Wrapper for a database cursor which counts the queries executed."""
+
+    def __init__(self, cursor, stats):
+        self.cursor = cursor
+        self.stats = stats
+
+    def execute(self, *args, **kwargs):
+        self.stats.queries += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.stats.queries += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def start_profile():
+    """Begins gathering statistics for the current thread."""
+
+    stats = _local.stats = CrabProfileStats()
+    return stats
+
+
+def stop_profile():
+    """Stops gathering statistics for the current thread, returning
+    the CrabProfileStats object, or None if not profiling."""
+
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    return stats
+
+
+def profile_stats():
+    """Returns the CrabProfileStats object for the current thread,
+    or None if it is not being profiled."""
+
+    return getattr(_local, 'stats', None)
+
+
+def profile_record(name, seconds):
+    """Adds the given time to the statistics, if the current thread
+    is being profiled."""
+
+    stats = getattr(_local, 'stats', None)
+
+    if stats is not None:
+        stats.record(name, seconds)
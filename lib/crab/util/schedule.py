@@ -25,6 +25,11 @@ from crab import CrabError
 
 logger = getLogger(__name__)
 
+# Maximum number of days over which to search for a matching time.
+# This is eight years as a schedule for 29 February may not match for
+# that long when the search spans a century year which is not a leap year.
+MATCH_SEARCH_DAYS = 8 * 366
+
 
 class CrabSchedule(CronTab):
     """Class handling the schedule of a cron job."""
@@ -75,17 +80,101 @@ class CrabSchedule(CronTab):
 
     def next_datetime(self, datetime_):
         """return a datetime rather than number of
-        seconds."""
+        seconds, or None if the schedule never matches."""
 
         localtime = self._localtime(datetime_)
-        return datetime_ + timedelta(seconds=int(self.next(localtime)))
+        return self._offset_datetime(datetime_, self.next(localtime))
 
     def previous_datetime(self, datetime_):
         """return a datetime rather than number of
-        seconds."""
+        seconds, or None if the schedule never matches."""
 
         localtime = self._localtime(datetime_)
-        return datetime_ + timedelta(seconds=int(self.previous(localtime)))
+        return self._offset_datetime(datetime_, self.previous(localtime))
+
+    def next_match(self, datetime_):
+        """Returns the first minute after the given time (which should
+        be on a minute boundary) matching the schedule, or None if
+        none is found within MATCH_SEARCH_DAYS.
+
+        Unlike next_datetime, this gives the same result as checking
+        each minute with the match method, including across changes in
+        the timezone's offset from UTC."""
+
+        return self._find_match(datetime_, timedelta(minutes=1))
+
+    def previous_match(self, datetime_):
+        """Returns the last minute before the given time (which should
+        be on a minute boundary) matching the schedule, or None.
+
+        This is the counterpart of next_match."""
+
+        return self._find_match(datetime_, timedelta(minutes=-1))
+
+    def _find_match(self, datetime_, step):
+        """Searches for a matching minute in the direction of the given
+        step (plus or minus one minute).
+
+        The search proceeds a day at a time.  Where the UTC offset is
+        the same for a few hours either side of the day, there is no
+        offset change nearby, so the CronTab calculation can be used,
+        and its result is confirmed with the match method.  Otherwise
+        the minutes of the day are checked in turn.
+
+        The result of the CronTab calculation is kept while the days
+        before it are passed over, so that schedules which rarely match
+        do not require it to be repeated for each day.  If it finds that
+        the schedule never matches, None is returned."""
+
+        if step > timedelta(0):
+            find = self.next_datetime
+        else:
+            find = self.previous_datetime
+
+        window = step * 1440
+        margin = step * 180
+        current = datetime_
+        found = None
+
+        for i in range(MATCH_SEARCH_DAYS):
+            end = current + window
+
+            if (self._utcoffset(current - margin) ==
+                    self._utcoffset(end + margin)):
+                if found is None:
+                    found = find(current)
+                    if found is None:
+                        return None
+
+                offset = (found - current) / step
+
+                if offset > 1440:
+                    current = end
+                    continue
+
+                if offset > 0 and self.match(found):
+                    return found
+
+            found = None
+            candidate = current + step
+            while abs(candidate - current) <= abs(window):
+                if self.match(candidate):
+                    return candidate
+
+                candidate += step
+
+            current = end
+
+        return None
+
+    def _offset_datetime(self, datetime_, seconds):
+        if seconds is None:
+            return None
+
+        return datetime_ + timedelta(seconds=int(seconds))
+
+    def _utcoffset(self, datetime_):
+        return self._localtime(datetime_).utcoffset()
 
     def _localtime(self, datetime_):
         if self.timezone is not None:
@@ -13,10 +13,67 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
+from logging import getLogger
+from multiprocessing import get_context
 import re
+from threading import BoundedSemaphore, Lock
 
 from crab import CrabStatus
 
+PATTERN_CACHE_SIZE = 256
+
+# Time (seconds) allowed for a pattern worker process to start.
+WORKER_START_TIMEOUT = 60
+
+# Number of characters from the start and end of the output sent to
+# pattern worker processes if no head or tail is configured.
+WORKER_OUTPUT_LIMIT = 1048576
+
+PATTERN_KEYS = ('success_pattern', 'warning_pattern', 'fail_pattern')
+
+logger = getLogger(__name__)
+
+_pattern_cache = OrderedDict()
+_pattern_cache_lock = Lock()
+
+
+def compile_pattern(pattern):
+    """Returns a compiled regular expression for the given pattern.
+
+    Compiled expressions are kept in a bounded least-recently-used
+    cache, keyed by the pattern string.  This avoids relying on the
+    re module's own small cache, which is cleared entirely once
+    it becomes full."""
+
+    with _pattern_cache_lock:
+        regex = _pattern_cache.pop(pattern, None)
+
+        if regex is not None:
+            _pattern_cache[pattern] = regex
+            return regex
+
+    regex = re.compile(pattern)
+
+    with _pattern_cache_lock:
+        _pattern_cache[pattern] = regex
+
+        while len(_pattern_cache) > PATTERN_CACHE_SIZE:
+            _pattern_cache.popitem(last=False)
+
+    return regex
+
+
+def discard_patterns(*patterns):
+    """Removes the given patterns from the compiled pattern cache.
+
+    Entries which are None or not present in the cache are ignored."""
+
+    with _pattern_cache_lock:
+        for pattern in patterns:
+            if pattern is not None:
+                _pattern_cache.pop(pattern, None)
+
 
 def check_status_patterns(status, config, output):
     """Function to update a job status based on the patterns.
@@ -34,7 +91,8 @@ def check_status_patterns(status, config, output):
         return status
 
     fail_pattern = config['fail_pattern']
-    if fail_pattern is not None and re.search(fail_pattern, output):
+    if (fail_pattern is not None and
+            compile_pattern(fail_pattern).search(output)):
         return CrabStatus.FAIL
 
     # Check for warning status.
@@ -42,12 +100,14 @@ def check_status_patterns(status, config, output):
         return status
 
     warning_pattern = config['warning_pattern']
-    if warning_pattern is not None and re.search(warning_pattern, output):
+    if (warning_pattern is not None and
+            compile_pattern(warning_pattern).search(output)):
         return CrabStatus.WARNING
 
     # Check for good status.
     success_pattern = config['success_pattern']
-    if success_pattern is not None and re.search(success_pattern, output):
+    if (success_pattern is not None and
+            compile_pattern(success_pattern).search(output)):
         return CrabStatus.SUCCESS
 
     # No match -- decide what to do based on which patterns were defined.
@@ -65,3 +125,188 @@ def check_status_patterns(status, config, output):
     # Otherwise return the original status.  If there was a failure
     # pattern, then we already know we didn't match it.
     return status
+
+
+class CrabPatternWorker:
+    """Worker process used by CrabPatternChecker.
+
+    Each worker receives checks over its own pipe, so that a worker
+    which exceeds the time limit can be terminated without affecting
+    checks in progress in other workers."""
+
+    def __init__(self):
+        (self.conn, child_conn) = get_context('spawn').Pipe()
+        self.process = get_context('spawn').Process(
+            target=_pattern_worker, args=(child_conn,))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self, timeout):
+        """Waits for the worker process to start, up to the given
+        timeout.  Returns True if it is ready to receive checks."""
+
+        if not self.ready and self.conn.poll(timeout):
+            self.conn.recv()
+            self.ready = True
+
+        return self.ready
+
+    def terminate(self):
+        """Stops the worker process."""
+
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class CrabPatternChecker:
+    """Class to compare job output with the status patterns.
+
+    The output can optionally be restricted to a number of characters
+    from its start ("head") and end ("tail").  If a timeout (in seconds)
+    is given, the patterns are checked by up to the given number
+    of worker processes.  Should the timeout be exceeded, a warning
+    is logged, the worker performing the check is terminated (to be
+    replaced by a new worker when next required) and the UNKNOWN
+    status is returned.  The timeout applies only once the worker is
+    ready, so does not include the time taken to start a new worker.
+    The output sent to the workers is limited to WORKER_OUTPUT_LIMIT
+    characters from each end if no head or tail is given."""
+
+    def __init__(self, head=None, tail=None, timeout=None, processes=1):
+        """Constructor for pattern checker objects."""
+
+        if timeout is not None and not (head or tail):
+            head = tail = WORKER_OUTPUT_LIMIT
+
+        self.head = head
+        self.tail = tail
+        self.timeout = timeout
+        self.processes = processes
+
+        self.workers = []
+        self.workers_lock = Lock()
+        self.slots = BoundedSemaphore(processes)
+
+    def start(self):
+        """Starts any worker processes not yet running, if a timeout is
+        configured, so that they are ready before the first check."""
+
+        if self.timeout is None:
+            return
+
+        with self.workers_lock:
+            count = self.processes - len(self.workers)
+
+        workers = [CrabPatternWorker() for i in range(count)]
+
+        for worker in workers:
+            if not worker.wait_ready(WORKER_START_TIMEOUT):
+                logger.warning('Warning: status pattern worker not started')
+
+        with self.workers_lock:
+            self.workers.extend(workers)
+
+    def __call__(self, status, config, stdout, stderr):
+        """Checks the job output and returns the updated status."""
+
+        if all(config[x] is None for x in PATTERN_KEYS):
+            return status
+
+        output = self._window('\n'.join(
+            (x for x in (stdout, stderr) if x is not None)))
+
+        if self.timeout is None:
+            return check_status_patterns(status, config, output)
+
+        with self.slots:
+            with self.workers_lock:
+                worker = self.workers.pop() if self.workers else None
+
+            if worker is None:
+                worker = CrabPatternWorker()
+
+            try:
+                if not worker.wait_ready(WORKER_START_TIMEOUT):
+                    logger.warning(
+                        'Warning: status pattern worker not started')
+
+                    worker.terminate()
+
+                    return CrabStatus.UNKNOWN
+
+                worker.conn.send((
+                    status, dict((x, config[x]) for x in PATTERN_KEYS),
+                    output))
+
+                if worker.conn.poll(self.timeout):
+                    (success, result) = worker.conn.recv()
+
+                else:
+                    logger.warning(
+                        'Warning: status pattern check exceeded {} s'.format(
+                            self.timeout))
+
+                    worker.terminate()
+
+                    return CrabStatus.UNKNOWN
+
+            except (EOFError, OSError):
+                logger.exception('Error: status pattern worker failed')
+
+                worker.terminate()
+
+                return CrabStatus.UNKNOWN
+
+            with self.workers_lock:
+                self.workers.append(worker)
+
+        if not success:
+            raise result
+
+        return result
+
+    def close(self):
+        """Stops any idle worker processes."""
+
+        with self.workers_lock:
+            workers = self.workers
+            self.workers = []
+
+        for worker in workers:
+            worker.terminate()
+
+    def _window(self, output):
+        """Restricts the output to the configured head and tail."""
+
+        head = self.head or 0
+        tail = self.tail or 0
+
+        if (not (head or tail)) or len(output) <= head + tail:
+            return output
+
+        return '\n'.join(
+            (x for x in (output[:head], output[len(output) - tail:]) if x))
+
+
+def _pattern_worker(conn):
+    """Main function of CrabPatternWorker processes.
+
+    Sends a message to indicate that it is ready, then receives the
+    arguments for check_status_patterns and sends back a tuple of
+    a success flag and the result, or exception raised."""
+
+    conn.send((True, None))
+
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            return
+
+        try:
+            conn.send((True, check_status_patterns(*args)))
+        except Exception as err:
+            conn.send((False, err))
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+from time import perf_counter
 
 import cherrypy
 from cherrypy import HTTPError, HTTPRedirect
@@ -25,6 +26,7 @@ from mako.template import Template
 from crab import CrabError, CrabStatus
 from crab.util.datetime import format_datetime, parse_datetime
 from crab.util.filter import CrabEventFilter
+from crab.util.profile import profile_record
 from crab.util.web import server_url as url
 from crab.web import CrabWebBase
 from crab.web.query import CrabWebQuery
@@ -554,6 +556,79 @@ class CrabWeb(CrabWebBase):
                     'notifications': notifications,
                 })
 
+    @cherrypy.expose
+    def notifyqueue(self, queueid=None, submit_retry=None, submit_delete=None):
+        """Displays the notification queue and allows messages to be
+        re-tried or deleted (via POST requests only)."""
+
+        if queueid is not None:
+            try:
+                queueid = int(queueid)
+            except ValueError:
+                raise HTTPError(400, 'Queue entry number not a number')
+
+            if submit_retry or submit_delete:
+                if cherrypy.request.method != 'POST':
+                    raise HTTPError(405)
+
+                if submit_retry:
+                    self.store.retry_queued_notification(queueid)
+                else:
+                    self.store.delete_queued_notification(queueid)
+
+            raise HTTPRedirect(url('/notifyqueue'))
+
+        try:
+            entries = self.store.get_queued_notifications()
+
+        except CrabError as err:
+            raise HTTPError(message=str(err))
+
+        filter_ = CrabEventFilter(self.store)
+
+        for entry in entries:
+            entry['datetime'] = filter_.in_timezone(entry['datetime'])
+            entry['next_attempt'] = filter_.in_timezone(entry['next_attempt'])
+
+        return self._write_template('notifyqueue.html', {'entries': entries})
+
+    @cherrypy.expose
+    def failures(self):
+        """Displays a list of recent failures.
+
+        The list is maintained by the monitor, so only the information
+        for the jobs involved needs to be fetched from the store."""
+
+        try:
+            if self.monitor is not None:
+                failures = self.monitor.get_fail_events()
+            else:
+                failures = self.store.get_fail_events()
+
+            info = {}
+            for failure in failures:
+                id_ = failure['id']
+                if id_ not in info:
+                    info[id_] = self.store.get_job_info(id_)
+
+        except CrabError as err:
+            raise HTTPError(message=str(err))
+
+        filter_ = CrabEventFilter(self.store)
+        entries = []
+
+        for failure in failures:
+            job = info[failure['id']]
+            if job is None:
+                continue
+
+            entry = job.copy()
+            entry.update(failure)
+            entry['datetime'] = filter_.in_timezone(entry['datetime'])
+            entries.append(entry)
+
+        return self._write_template('failures.html', {'entries': entries})
+
     @cherrypy.expose
     @cherrypy.tools.expires(secs=3600, force=True)
     def dynres(self, name):
@@ -568,8 +643,12 @@ class CrabWeb(CrabWebBase):
 
         Traps template errors and uses mako.exceptions to display them."""
 
+        start = perf_counter()
+
         try:
             template = self.templ.get_template(name)
             return template.render(options=self.options, **dict)
         except:
             return exceptions.html_error_template().render()
+        finally:
+            profile_record('render', perf_counter() - start)
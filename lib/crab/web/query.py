@@ -21,6 +21,7 @@ import cherrypy
 from cherrypy import HTTPError
 import pytz
 
+from crab.service.monitor import CrabJobStatus
 from crab.util.datetime import format_datetime
 from crab.web import CrabWebBase
 
@@ -37,6 +38,8 @@ class CrabWebQuery(CrabWebBase):
         def to_json(obj):
             if isinstance(obj, datetime):
                 return format_datetime(obj)
+            if isinstance(obj, CrabJobStatus):
+                return obj.as_dict()
             raise TypeError('Cannot JSON-encode object')
 
         self.json_encoder = JSONEncoder(default=to_json)
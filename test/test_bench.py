@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from crab.bench import CrabBenchResults, make_fleet, make_store
+from crab.bench.monitor import run_monitor_benchmark
+from crab.bench.store import run_store_benchmark
+
+
+class BenchTestCase(TestCase):
+    def test_store(self):
+        """Test that the store benchmark runs with a small fleet."""
+
+        store = make_store('doc/schema.sql')
+        fleet = make_fleet(2, 2, 3)
+        self.assertEqual(len(fleet), 4)
+
+        results = CrabBenchResults()
+        run_store_benchmark(results, store, fleet, rounds=2, repeat=2)
+
+        self.assertEqual(results.results['log_start']['count'], 24)
+        self.assertEqual(len(store.get_jobs()), 12)
+        self.assertIn('delete_old_events', results.as_dict()['results'])
+
+        store.lock.conn.close()
+
+    def test_monitor(self):
+        """Test that the monitor benchmark runs without raising alarms
+        for jobs which run as scheduled."""
+
+        store = make_store('doc/schema.sql')
+        fleet = make_fleet(1, 1, 24)
+
+        results = CrabBenchResults()
+        run_monitor_benchmark(results, store, fleet, minutes=180, miss=0)
+
+        self.assertEqual(results.results['monitor_run_interval']['count'], 180)
+        self.assertEqual(results.results['monitor_tick']['count'], 180 * 12)
+        self.assertIn(
+            results.results['monitor_process_event']['count'], (4, 6))
+
+        with store.lock as c:
+            c.execute('SELECT COUNT(*) FROM jobalarm')
+            self.assertEqual(c.fetchone()[0], 0)
+
+        store.lock.conn.close()
@@ -0,0 +1,266 @@
+from http.client import HTTPConnection
+import json
+import os
+import signal
+from tempfile import TemporaryDirectory
+from threading import Event
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from cherrypy.process.wspbus import Bus
+
+from crab import CrabError, CrabStatus
+from crab.client import CrabClient
+from crab.server.ingest import CrabIngestService, CrabIngestWorkers
+from crab.store.sqlite import CrabStoreSQLite
+
+from . import CrabDBTestCase
+
+
+class IngestTestCase(CrabDBTestCase):
+    def setUp(self):
+        super(IngestTestCase, self).setUp()
+
+        self.service = CrabIngestService(
+            self.store, {'host': '127.0.0.1', 'port': 0, 'threads': 2})
+        self.service.daemon = True
+        self.service.start()
+        self.assertTrue(self.service.ready.wait(10))
+
+    def tearDown(self):
+        self.service.stop()
+        self.service.join(10)
+
+        super(IngestTestCase, self).tearDown()
+
+    def _client(self, command=None, crabid=None):
+        env = {
+            'CRABHOST': self.service.address[0],
+            'CRABPORT': str(self.service.address[1]),
+            'CRABSYSCONFIG': '/nonexistent',
+            'CRABUSERCONFIG': '/nonexistent',
+            'CRABCLIENTHOSTNAME': 'host1',
+            'CRABUSERNAME': 'user1',
+        }
+
+        with patch.dict(os.environ, env):
+            return CrabClient(command=command, crabid=crabid)
+
+    def test_client(self):
+        """Test that the client protocol is handled by the ingest
+        listener."""
+
+        client = self._client()
+
+        self.assertEqual(client.send_crontab(
+            '0 * * * * CRABID=job1 command1\n'
+            '0 * * * * CRABID=job1 command2'),
+            ['Indistinguishable duplicated job: '
+             '0 * * * * CRABID=job1 command2'])
+
+        # Unchanged crontabs are skipped.
+        self.assertEqual(client.send_crontab(
+            '0 * * * * CRABID=job1 command1\n'
+            '0 * * * * CRABID=job1 command2'), [])
+
+        self.assertEqual(
+            client.fetch_crontab(raw=True),
+            '0 * * * * CRABID=job1 command1\n'
+            '0 * * * * CRABID=job1 command2')
+
+        client = self._client(command='command1', crabid='job1')
+
+        self.assertEqual(client.start(), {'inhibit': False})
+        client.finish(CrabStatus.FAIL, 'output', 'error')
+
+        events = self.store.get_job_events(1)
+        self.assertEqual(
+            [event['type'] for event in events], [3, 1])
+        self.assertEqual(events[0]['status'], CrabStatus.FAIL)
+        self.assertEqual(
+            self.store.get_job_output(
+                events[0]['eventid'], 'host1', 'user1', 1, 'job1'),
+            ('output', 'error'))
+
+        with self.assertRaisesRegex(CrabError, 'invalid finish status'):
+            client.finish(999)
+
+        results = client.send_crontabs([
+            {'host': 'host2', 'user': 'user1', 'crontab': '0 * * * * x'},
+            {'host': 'host3', 'user': 'user1', 'crontab': '0 * * * * y'},
+        ])
+
+        self.assertEqual([x['host'] for x in results], ['host2', 'host3'])
+        self.assertEqual(len(self.store.get_jobs('host3', 'user1')), 1)
+
+        # A false "force" parameter should still skip unchanged crontabs.
+        conn = HTTPConnection(*self.service.address)
+
+        try:
+            conn.request(
+                'PUT', '/api/0/crontabs?force=false',
+                json.dumps({
+                    'host': 'host2', 'user': 'user1',
+                    'crontab': ['0 * * * * x']}) + '\n')
+            response = conn.getresponse()
+            results = json.loads(response.read().decode('ascii'))['results']
+
+        finally:
+            conn.close()
+
+        self.assertTrue(results[0].get('unchanged'))
+
+    def test_crontabs_chunked(self):
+        """Test that a chunked crontabs request is read as lines even
+        where they are split between chunks."""
+
+        body = (
+            json.dumps({
+                'host': 'host4', 'user': 'user1',
+                'crontab': ['0 * * * * x']}) + '\n' +
+            'x\n' +
+            json.dumps({
+                'host': 'host5', 'user': 'user1',
+                'crontab': ['0 * * * * y']})).encode('ascii')
+
+        conn = HTTPConnection(*self.service.address)
+
+        try:
+            conn.request(
+                'PUT', '/api/0/crontabs',
+                (body[i:i + 10] for i in range(0, len(body), 10)),
+                encode_chunked=True)
+            response = conn.getresponse()
+            self.assertEqual(response.status, 200)
+            results = json.loads(response.read().decode('ascii'))['results']
+
+            # The connection should have been kept open.
+            conn.request('GET', '/api/0/crontab/host5/user1?raw=1')
+            response = conn.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(
+                json.loads(response.read().decode('ascii')),
+                {'crontab': ['0 * * * * y']})
+
+        finally:
+            conn.close()
+
+        self.assertEqual([x['line'] for x in results], [1, 2, 3])
+        self.assertEqual(results[1]['error'], 'invalid JSON')
+        self.assertEqual(len(self.store.get_jobs('host4', 'user1')), 1)
+
+    def test_errors(self):
+        """Test the responses to invalid requests."""
+
+        conn = HTTPConnection(*self.service.address)
+
+        try:
+            for (method, url, body, status) in [
+                    ('GET', '/api/0/start/host1/user1', '', 405),
+                    ('PUT', '/api/0/start/host1', '{}', 404),
+                    ('PUT', '/api/0/other/host1/user1', '{}', 404),
+                    ('PUT', '/api/0/start/host1/user1', 'x', 400),
+                    ('PUT', '/api/0/start/host1/user1', '{}', 500),
+                    ]:
+                conn.request(method, url, body)
+                response = conn.getresponse()
+                response.read()
+                self.assertEqual(response.status, status)
+
+            # The connection should have been kept open.
+            conn.request(
+                'PUT', '/api/0/start/host1/user1',
+                json.dumps({'command': 'command1'}))
+            response = conn.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(
+                json.loads(response.read().decode('ascii')),
+                {'inhibit': False})
+
+        finally:
+            conn.close()
+
+
+class IngestWorkersTestCase(TestCase):
+    def test_workers(self):
+        """Test that worker processes record events and notify
+        the coordinating process."""
+
+        with TemporaryDirectory() as dir_:
+            filename = os.path.join(dir_, 'crab.db')
+
+            open(filename, 'w').close()
+
+            with open('doc/schema.sql') as file:
+                store = CrabStoreSQLite(filename)
+                store.lock.conn.executescript(file.read())
+
+            bus = Bus()
+            workers = CrabIngestWorkers(
+                bus, lambda: CrabStoreSQLite(filename),
+                {'host': '127.0.0.1', 'port': 0, 'processes': 2})
+            workers.subscribe()
+
+            service = WakeRecorder()
+            bus.publish('crab-service', 'Monitor', service)
+
+            bus.start()
+
+            try:
+                address = workers.sock.getsockname()
+
+                self._start(address, 'command1')
+                self.assertTrue(service.woken.wait(10))
+
+                self.assertEqual(
+                    [job['command'] for job in store.get_jobs()],
+                    ['command1'])
+
+                # A worker which exits should be replaced.
+                pid = workers.pids[0]
+                os.kill(pid, signal.SIGTERM)
+
+                service.woken.clear()
+                self._start(address, 'command2')
+                self.assertTrue(service.woken.wait(10))
+
+                for i in range(100):
+                    if workers.pids[0] != pid:
+                        break
+                    time.sleep(0.1)
+
+                self.assertNotEqual(workers.pids[0], pid)
+                os.kill(workers.pids[0], 0)
+
+            finally:
+                bus.exit()
+                store.lock.conn.close()
+
+            self.assertFalse(workers.supervisor.is_alive())
+
+            for pid in workers.pids:
+                with self.assertRaises(ProcessLookupError):
+                    os.kill(pid, 0)
+
+    def _start(self, address, command):
+        conn = HTTPConnection(*address)
+
+        try:
+            conn.request(
+                'PUT', '/api/0/start/host1/user1',
+                json.dumps({'command': command}))
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, 200)
+
+        finally:
+            conn.close()
+
+
+class WakeRecorder():
+    def __init__(self):
+        self.woken = Event()
+
+    def wake(self):
+        self.woken.set()
@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta
+import time
+
+from pytz import UTC
+
+from crab import CrabEvent, CrabStatus
+from crab.service import CrabLease, CrabSimulatedClock
+from crab.service.monitor import CrabMonitor
+
+from . import CrabDBTestCase
+
+
+class LeaseTestCase(CrabDBTestCase):
+    def test_store_lease(self):
+        """Test the store's lease acquisition method."""
+
+        t = [datetime(2026, 1, 1, tzinfo=UTC) + timedelta(minutes=i)
+             for i in range(5)]
+        acquire = self.store.acquire_lease
+
+        self.assertTrue(acquire('crabd', 'a', t[1], t[0]))
+        self.assertFalse(acquire('crabd', 'b', t[1], t[0]))
+        self.assertTrue(acquire('other', 'b', t[1], t[0]))
+
+        # Renewal, including without change.
+        self.assertTrue(acquire('crabd', 'a', t[1], t[0]))
+        self.assertTrue(acquire('crabd', 'a', t[2], t[0]))
+
+        # Takeover once expired.
+        self.assertFalse(acquire('crabd', 'b', t[3], t[1]))
+        self.assertTrue(acquire('crabd', 'b', t[4], t[3]))
+        self.assertFalse(acquire('crabd', 'a', t[4], t[3]))
+
+        self.store.release_lease('crabd', 'a')
+        self.assertFalse(acquire('crabd', 'a', t[4], t[3]))
+
+        self.store.release_lease('crabd', 'b')
+        self.assertTrue(acquire('crabd', 'a', t[4], t[3]))
+
+    def test_lease(self):
+        """Test renewal and takeover of leases."""
+
+        clock = CrabSimulatedClock(datetime(2026, 1, 1, tzinfo=UTC))
+        leases = []
+
+        for holder in ('a', 'b'):
+            lease = CrabLease(
+                None, {'holder': holder, 'duration': 60}, clock=clock)
+            lease.store = self.store
+            leases.append(lease)
+
+        (a, b) = leases
+
+        a.renew()
+        b.renew()
+        self.assertTrue(a.held())
+        self.assertFalse(b.held())
+
+        # The lease is renewed as time passes.
+        for i in range(10):
+            clock.sleep(20)
+            a.renew()
+            b.renew()
+            self.assertTrue(a.held())
+            self.assertFalse(b.held())
+
+        # Server "a" stops renewing, so "b" takes over after expiry.
+        clock.sleep(40)
+        b.renew()
+        self.assertFalse(b.held())
+        clock.sleep(25)
+        b.renew()
+        self.assertTrue(b.held())
+        self.assertFalse(a.held())
+
+        # Releasing the lease allows immediate takeover.
+        b.release()
+        self.assertFalse(b.held())
+        a.renew()
+        self.assertTrue(a.held())
+
+    def test_heartbeat(self):
+        """Test that the heartbeat thread renews the lease without
+        it being checked, and releases it when stopped."""
+
+        lease = CrabLease(None, {'holder': 'a', 'duration': 3})
+        lease.store = self.store
+
+        lease.start()
+
+        try:
+            for i in range(50):
+                if lease.expires is not None:
+                    break
+                time.sleep(0.1)
+
+            self.assertTrue(lease.held())
+
+            # Wait for more than the duration: the lease should have been
+            # renewed, so another server can not acquire it.
+            time.sleep(4)
+            now = datetime.now(UTC)
+            self.assertFalse(self.store.acquire_lease(
+                'crabd', 'b', now + timedelta(minutes=1), now))
+            self.assertTrue(lease.held())
+
+        finally:
+            lease.stop()
+
+        self.assertIsNone(lease.thread)
+        self.assertFalse(lease.held())
+
+        now = datetime.now(UTC)
+        self.assertTrue(self.store.acquire_lease(
+            'crabd', 'b', now + timedelta(minutes=1), now))
+
+    def test_monitor(self):
+        """Test that a monitor without the lease does not write alarms,
+        but can take over."""
+
+        clock = CrabSimulatedClock(datetime.now(UTC))
+        lease = CrabLease(None, {'holder': 'b'}, clock=clock)
+        lease.store = self.store
+
+        self.store.acquire_lease(
+            'crabd', 'a', clock.now() + timedelta(minutes=1), clock.now())
+
+        id_ = self.store.check_job('host1', 'user1', None, 'command1')
+
+        monitor = CrabMonitor(self.store, lease=lease)
+        monitor._initialize()
+
+        past = clock.now() - timedelta(minutes=1)
+        monitor.miss_timeout[id_] = past
+        monitor.late_timeout[id_] = past
+
+        lease.renew()
+        monitor._check_timeouts(clock.now())
+        self.assertEqual(self._alarms(id_), [])
+        self.assertIn(id_, monitor.miss_timeout)
+
+        # Server "a" writes an alarm, which should clear the deadline.
+        self.store.log_alarm(id_, CrabStatus.MISSED)
+        monitor._check_events()
+        self.assertNotIn(id_, monitor.miss_timeout)
+        self.assertIn(id_, monitor.late_timeout)
+
+        # Once the lease expires, the remaining alarm is written.
+        clock.sleep(90)
+        lease.renew()
+        monitor._check_timeouts(clock.now())
+        self.assertEqual(
+            sorted(self._alarms(id_)), [CrabStatus.MISSED, CrabStatus.LATE])
+
+    def _alarms(self, id_):
+        return [
+            event['status'] for event in self.store.get_job_events(id_)
+            if event['type'] == CrabEvent.ALARM]
@@ -0,0 +1,69 @@
+from smtplib import SMTPRecipientsRefused
+from unittest import TestCase
+from unittest.mock import patch
+
+from crab import CrabError
+from crab.notify.email import CrabNotifyEmailSession, send_errors
+from crab.util.metrics import counter, format_metrics, gauge, histogram
+
+
+class MetricsTestCase(TestCase):
+    def test_metrics(self):
+        c = counter('test_counter_total', 'Test counter')
+        c.inc()
+        c.inc(2)
+        self.assertIs(counter('test_counter_total', 'Test counter'), c)
+
+        with self.assertRaises(CrabError):
+            gauge('test_counter_total', 'Test counter')
+
+        g = gauge('test_gauge', 'Test gauge')
+        g.inc()
+        g.inc()
+        g.dec()
+
+        h = histogram('test_histogram', 'Test histogram', (1, 10))
+        for value in (0.5, 1, 5, 20):
+            h.observe(value)
+
+        with h.time():
+            pass
+
+        text = format_metrics()
+
+        for line in [
+                '# HELP test_counter_total Test counter',
+                '# TYPE test_counter_total counter',
+                'test_counter_total 3',
+                '# TYPE test_gauge gauge',
+                'test_gauge 1',
+                '# TYPE test_histogram histogram',
+                'test_histogram_bucket{le="1"} 3',
+                'test_histogram_bucket{le="10"} 4',
+                'test_histogram_bucket{le="+Inf"} 5',
+                'test_histogram_count 5',
+                ]:
+            self.assertIn(line + '\n', text)
+
+    def test_send_errors(self):
+        """Test that failures to send are counted whether or not the
+        SMTP connection was already open."""
+
+        session = CrabNotifyEmailSession('localhost', 'crab@localhost')
+        errors = send_errors.value
+
+        with patch('crab.notify.email.SMTP') as mock_smtp:
+            mock_smtp.return_value.sendmail.side_effect = \
+                SMTPRecipientsRefused({})
+
+            with self.assertRaises(SMTPRecipientsRefused):
+                session.send(['x@localhost'], 'message')
+
+            self.assertEqual(send_errors.value, errors + 1)
+
+            # The connection is now open, and is re-used.
+            with self.assertRaises(SMTPRecipientsRefused):
+                session.send(['x@localhost'], 'message')
+
+            self.assertEqual(send_errors.value, errors + 2)
+            self.assertEqual(mock_smtp.call_count, 1)
@@ -0,0 +1,356 @@
+from datetime import datetime, timedelta
+from json import JSONEncoder
+from unittest.mock import patch
+
+from pytz import UTC
+
+from crab import CrabEvent, CrabStatus
+from crab.service import CrabMinutely
+from crab.service.monitor import \
+    CrabJobStatus, CrabMonitor, CrabMonitorSnapshot, HISTORY_COUNT
+
+from . import CrabDBTestCase
+
+
+class MonitorTestCase(CrabDBTestCase):
+    def test_history(self):
+        """Test the job status record's history ring."""
+
+        job = CrabJobStatus(None)
+        job.compute_reliability()
+        self.assertEqual(job.reliability, 0)
+
+        for status in (CrabStatus.SUCCESS, CrabStatus.FAIL,
+                       CrabStatus.SUCCESS, CrabStatus.SUCCESS):
+            job.add_history(status)
+
+        job.compute_reliability()
+        self.assertEqual(job.reliability, 75)
+        self.assertEqual(job.history, [0, 1, 0, 0])
+
+        for i in range(HISTORY_COUNT):
+            job.add_history(CrabStatus.SUCCESS)
+
+        job.compute_reliability()
+        self.assertEqual(job.history_count, HISTORY_COUNT)
+        self.assertEqual(job.reliability, 100)
+
+        job.add_history(CrabStatus.TIMEOUT)
+        job.compute_reliability()
+        self.assertEqual(job.reliability, 90)
+        self.assertEqual(job.history[-2:], [0, CrabStatus.TIMEOUT])
+
+    def test_status(self):
+        """Test that the monitor's status records behave like the
+        dictionaries previously used."""
+
+        for status in (CrabStatus.SUCCESS, CrabStatus.FAIL):
+            self.store.log_finish(
+                'host1', 'user1', None, 'command1', status)
+
+        # Ensure that the events are in order.
+        with self.store.lock as c:
+            c.execute(
+                'UPDATE jobfinish SET datetime=? WHERE id=1',
+                ['2000-01-01 00:00:00'])
+
+        monitor = CrabMonitor(self.store, passive=True)
+        monitor._initialize()
+
+        status = monitor.get_job_status(1)
+        self.assertEqual(status['status'], CrabStatus.FAIL)
+        self.assertFalse(status['running'])
+        self.assertEqual(status['reliability'], 50)
+        self.assertFalse(status['scheduled'])
+        self.assertEqual(status['history'], [0, 1])
+
+        with self.assertRaises(KeyError):
+            status['sched']
+
+        self.assertEqual(
+            monitor.get_job_status(2), {'status': None, 'running': False})
+
+        self.store.log_start('host1', 'user1', None, 'command1')
+        monitor._check_events()
+        self.assertTrue(status['running'])
+
+        encoded = JSONEncoder(
+            default=lambda x: x.as_dict() if isinstance(x, CrabJobStatus)
+            else str(x)).encode(monitor.get_job_status())
+        self.assertIn('"reliability": 50', encoded)
+        self.assertIn('"history": [0, 1]', encoded)
+        self.assertIn('"running": true', encoded)
+
+    def test_failures(self):
+        """Test the monitor's list of recent failures."""
+
+        for status in (CrabStatus.SUCCESS, CrabStatus.FAIL):
+            self.store.log_finish(
+                'host1', 'user1', None, 'command1', status)
+
+        monitor = CrabMonitor(self.store, passive=True)
+        monitor._initialize()
+
+        failures = monitor.get_fail_events()
+        self.assertEqual(failures, [
+            {'id': 1, 'status': CrabStatus.FAIL, 'finishid': 2,
+             'datetime': failures[0]['datetime']}])
+
+        self.store.log_start('host1', 'user1', None, 'command1')
+        self.store.log_alarm(1, CrabStatus.LATE)
+        self.store.log_alarm(1, CrabStatus.TIMEOUT)
+        self.store.log_finish(
+            'host1', 'user1', None, 'command1', CrabStatus.WARNING)
+        monitor._check_events()
+
+        # Processing events again should not duplicate the entries.
+        monitor._record_failure(1, {
+            'type': CrabEvent.FINISH, 'eventid': 2,
+            'status': CrabStatus.FAIL,
+            'datetime': failures[0]['datetime']})
+
+        failures = monitor.get_fail_events()
+        self.assertEqual(
+            [(x['status'], x['finishid']) for x in failures],
+            [(CrabStatus.WARNING, 3), (CrabStatus.TIMEOUT, None),
+             (CrabStatus.FAIL, 2)])
+        self.assertEqual(len(monitor.get_fail_events(limit=1)), 1)
+
+        # An event received late is placed in order of datetime.
+        monitor._record_failure(1, {
+            'type': CrabEvent.FINISH, 'eventid': 1,
+            'status': CrabStatus.FAIL,
+            'datetime': failures[-1]['datetime'] - timedelta(minutes=1)})
+        monitor._record_failure(1, {
+            'type': CrabEvent.FINISH, 'eventid': 1,
+            'status': CrabStatus.FAIL,
+            'datetime': failures[-1]['datetime'] - timedelta(minutes=1)})
+
+        failures = monitor.get_fail_events()
+        self.assertEqual(
+            [x['finishid'] for x in failures], [3, None, 2, 1])
+
+    def test_snapshot(self):
+        """Test that the monitor status snapshot can be read by
+        a passive monitor."""
+
+        for command in ('command1', 'command2'):
+            self.store.log_finish(
+                'host1', 'user1', None, command, CrabStatus.FAIL)
+
+        # An entry left by a previous monitor for a job which has gone.
+        self.store.write_monitor_status([(99, '{}')])
+
+        monitor = CrabMonitor(self.store, snapshot=True)
+        monitor._initialize()
+        monitor._publish_status()
+
+        reader = CrabMonitorSnapshot(self.store)
+        reader._initialize()
+
+        self.assertEqual(sorted(reader.status.keys()), [1, 2])
+        for id_ in (1, 2):
+            self.assertEqual(
+                reader.get_job_status(id_).as_dict(),
+                monitor.get_job_status(id_).as_dict())
+        self.assertEqual(reader.num_error, 2)
+        self.assertEqual(reader.max_finishid, 2)
+        self.assertEqual(
+            [x['status'] for x in reader.get_fail_events()],
+            [CrabStatus.FAIL, CrabStatus.FAIL])
+
+        # Only changes are written.
+        version = reader.version
+        self.store.log_start('host1', 'user1', None, 'command1')
+        monitor._check_events()
+        monitor._publish_status()
+
+        self.assertEqual(
+            [x['jobid'] for x in self.store.get_monitor_status(version)],
+            [1, 0])
+
+        result = reader.wait_for_event_since(0, 0, 1)
+        self.assertEqual(result['startid'], 0)
+        reader._tick()
+        result = reader.wait_for_event_since(0, 0, 1)
+        self.assertEqual(result['startid'], 1)
+        self.assertTrue(result['status'][1]['running'])
+
+        monitor._remove_job(2)
+        monitor._publish_status()
+        reader._tick()
+        self.assertEqual(list(reader.status.keys()), [1])
+
+        # The snapshot has a single entry per job.
+        self.assertEqual(
+            sorted(x['jobid'] for x in self.store.get_monitor_status()),
+            [0, 1, 2, 99])
+
+    def test_backlog(self):
+        """Test that the monitor processes a backlog of events
+        in batches."""
+
+        monitor = CrabMonitor(self.store, passive=True)
+        monitor._initialize()
+
+        for i in range(5):
+            self.store.log_finish(
+                'host1', 'user1', None, 'command{}'.format(i),
+                CrabStatus.FAIL)
+
+        lag = []
+        with patch('crab.service.monitor.EVENT_BATCH', 2):
+            for i in range(4):
+                monitor._check_events()
+                lag.append(monitor.lag is not None)
+
+        self.assertEqual(lag, [True, True, False, False])
+        self.assertEqual(monitor.max_finishid, 5)
+        self.assertEqual(monitor.num_error, 5)
+
+    def test_skipped(self):
+        """Test that the monitor checks again for events with skipped
+        IDs, which may be committed late by another connection."""
+
+        monitor = CrabMonitor(self.store, passive=True)
+        monitor._initialize()
+
+        for i in range(5):
+            self.store.log_finish(
+                'host1', 'user1', None, 'command{}'.format(i),
+                CrabStatus.FAIL)
+
+            if i == 0:
+                monitor._check_events()
+
+        # Simulate an event which has not yet been committed.
+        conn = self.store.lock.conn
+        row = conn.execute('SELECT * FROM jobfinish WHERE id=4').fetchone()
+        conn.execute('DELETE FROM jobfinish WHERE id=4')
+
+        monitor._check_events()
+        self.assertEqual(monitor.max_finishid, 5)
+        self.assertEqual(monitor.num_error, 4)
+        self.assertEqual(list(monitor.gaps), [(CrabEvent.FINISH, 4)])
+
+        conn.execute(
+            'INSERT INTO jobfinish VALUES (' +
+            ', '.join(['?'] * len(row)) + ')', row)
+
+        monitor._check_events()
+        self.assertEqual(monitor.max_finishid, 5)
+        self.assertEqual(monitor.num_error, 5)
+        self.assertEqual(monitor.gaps, {})
+
+        # Skipped IDs are forgotten after a while.
+        monitor.gaps[(CrabEvent.FINISH, 6)] = (
+            monitor.clock.now() - timedelta(minutes=2))
+        with patch.object(
+                self.store, 'get_events_by_id',
+                wraps=self.store.get_events_by_id) as mock:
+            monitor._check_events()
+            self.assertEqual(mock.call_count, 0)
+        self.assertEqual(monitor.gaps, {})
+
+    def test_interval(self):
+        """Test that checking the schedule for an interval at once
+        sets the same deadlines as checking each minute."""
+
+        self.store.save_crontab('host1', 'user1', [
+            '*/5 * * * * CRABID=job1 command1',
+            '0 * * * * CRABID=job2 command2',
+            '7 13 * * * CRABID=job3 command3',
+            '* * * * * CRABID=job4 command4',
+        ])
+
+        start = datetime(2026, 1, 1, 12, 1, tzinfo=UTC)
+        end = datetime(2026, 1, 1, 13, 3, tzinfo=UTC)
+        last_start = datetime(2026, 1, 1, 12, 57, 30, tzinfo=UTC)
+
+        monitors = []
+        for i in range(2):
+            monitor = CrabMonitor(self.store)
+            monitor._initialize()
+            monitor.status[1].last_start = last_start
+            monitor.status[4].last_start = last_start
+            monitor.miss_timeout[2] = start
+            monitors.append(monitor)
+
+        (minutely, interval) = monitors
+
+        CrabMinutely.run_interval(minutely, start, end)
+
+        with patch.object(
+                self.store, 'get_jobs', wraps=self.store.get_jobs) as mock:
+            interval.run_interval(start, end)
+            self.assertEqual(mock.call_count, 1)
+
+        self.assertEqual(interval.late_timeout, minutely.late_timeout)
+        self.assertEqual(interval.miss_timeout, minutely.miss_timeout)
+        self.assertEqual(sorted(interval.late_timeout), [1, 2, 4])
+        self.assertEqual(
+            interval.miss_timeout[1], datetime(2026, 1, 1, 13, 2, tzinfo=UTC))
+        self.assertEqual(interval.miss_timeout[2], start)
+
+        # A single minute.
+        interval.run_interval(end, end)
+        self.assertNotIn(3, interval.late_timeout)
+        interval.run_interval(end + timedelta(minutes=4),
+                              end + timedelta(minutes=4))
+        self.assertIn(3, interval.late_timeout)
+
+    def test_interval_subsecond(self):
+        """Test that a start time with fractional seconds gives the
+        same miss timeout as checking each minute."""
+
+        self.store.save_crontab('host1', 'user1', [
+            '* * * * * CRABID=job1 command1',
+        ])
+
+        start = datetime(2026, 1, 1, 12, 1, tzinfo=UTC)
+        end = datetime(2026, 1, 1, 12, 10, tzinfo=UTC)
+        last_start = datetime(2026, 1, 1, 12, 2, 0, 500000, tzinfo=UTC)
+
+        (minutely, interval) = self._interval_monitors(last_start)
+
+        CrabMinutely.run_interval(minutely, start, end)
+        interval.run_interval(start, end)
+
+        self.assertEqual(interval.late_timeout, minutely.late_timeout)
+        self.assertEqual(interval.miss_timeout, minutely.miss_timeout)
+        self.assertEqual(
+            interval.miss_timeout[1], datetime(2026, 1, 1, 12, 7, tzinfo=UTC))
+
+    def test_interval_dst(self):
+        """Test that checking an interval containing a DST change
+        sets the same deadlines as checking each minute."""
+
+        self.store.save_crontab('host1', 'user1', [
+            'CRON_TZ=America/New_York',
+            '5,17,43 */2 * * * CRABID=job1 command1',
+        ])
+
+        for (start, end) in (
+                (datetime(2026, 3, 8, 6, 16, tzinfo=UTC),
+                 datetime(2026, 3, 8, 7, 59, tzinfo=UTC)),
+                (datetime(2026, 3, 8, 4, 0, tzinfo=UTC),
+                 datetime(2026, 3, 8, 10, 0, tzinfo=UTC)),
+                (datetime(2026, 11, 1, 4, 0, tzinfo=UTC),
+                 datetime(2026, 11, 1, 8, 0, tzinfo=UTC))):
+            (minutely, interval) = self._interval_monitors(None)
+
+            CrabMinutely.run_interval(minutely, start, end)
+            interval.run_interval(start, end)
+
+            self.assertEqual(interval.late_timeout, minutely.late_timeout)
+            self.assertEqual(interval.miss_timeout, minutely.miss_timeout)
+
+    def _interval_monitors(self, last_start):
+        monitors = []
+        for i in range(2):
+            monitor = CrabMonitor(self.store)
+            monitor._initialize()
+            monitor.status[1].last_start = last_start
+            monitors.append(monitor)
+
+        return monitors
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+from pytz import UTC
+
+from crab.service.notify import CrabNotifyService
+from crab.util.schedule import CrabSchedule
+
+from . import CrabDBTestCase
+
+
+class NotifyServiceTestCase(CrabDBTestCase):
+    def test_schedule(self):
+        """Test that cached notifications are sent at the correct times."""
+
+        sent = []
+        service = CrabNotifyService(
+            {'daily': '0 0 * * *', 'timezone': 'UTC'}, self.store, None)
+        service.delivery.submit = lambda func, current: sent.extend(
+            (x.n['notifyid'], x.start, x.end) for x in current)
+
+        id_ = self.store.check_job('host1', 'user1', None, 'command1')
+        configid = self.store.write_job_config(id_)
+        self.store.write_notification(
+            None, configid, None, None, 'email', 'a@b',
+            '*/10 * * * *', None, False, False, False, False)
+        self.store.write_notification(
+            None, None, 'host1', None, 'email', 'c@d',
+            None, None, False, False, False, False)
+
+        def run(start, minutes):
+            for i in range(minutes):
+                service.run_minutely(start + timedelta(minutes=i))
+
+        start = datetime(2026, 1, 1, 23, 55, tzinfo=UTC)
+        run(start, 20)
+        self.assertEqual(sent, [
+            (1, datetime(2026, 1, 1, 23, 50, tzinfo=UTC),
+             datetime(2026, 1, 2, 0, 0, tzinfo=UTC)),
+            (2, datetime(2026, 1, 1, 0, 0, tzinfo=UTC),
+             datetime(2026, 1, 2, 0, 0, tzinfo=UTC)),
+            (1, datetime(2026, 1, 2, 0, 0, tzinfo=UTC),
+             datetime(2026, 1, 2, 0, 10, tzinfo=UTC)),
+        ])
+
+        # Changing the schedule should be detected immediately.
+        del sent[:]
+        self.store.write_notification(
+            1, configid, None, None, 'email', 'a@b',
+            '*/3 * * * *', None, False, False, False, False)
+        run(start + timedelta(minutes=20), 4)
+        self.assertEqual([x[0:3:2] for x in sent], [
+            (1, datetime(2026, 1, 2, 0, 15, tzinfo=UTC)),
+            (1, datetime(2026, 1, 2, 0, 18, tzinfo=UTC)),
+        ])
+
+        # As should deletion of the job.
+        del sent[:]
+        self.store.delete_job(id_)
+        run(start + timedelta(days=1), 10)
+        self.assertEqual(sent, [])
+
+    def test_dst(self):
+        """Test that notifications are sent at every minute matching
+        their schedule across the end of daylight saving time."""
+
+        sent = []
+        service = CrabNotifyService(
+            {'daily': '0 0 * * *', 'timezone': 'UTC'}, self.store, None)
+        service.delivery.submit = lambda func, current: sent.extend(
+            (x.n['notifyid'], x.end) for x in current)
+
+        self.store.check_job('host1', 'user1', None, 'command1')
+
+        times = ['0 * * * *', '15 1 * * *', '*/7 * * * *']
+        for time in times:
+            self.store.write_notification(
+                None, None, 'host1', None, 'email', 'a@b',
+                time, 'America/New_York', False, False, False, False)
+
+        start = datetime(2026, 11, 1, 3, 0, tzinfo=UTC)
+        minutes = [start + timedelta(minutes=i) for i in range(300)]
+
+        for minute in minutes:
+            service.run_minutely(minute)
+
+        expected = []
+        for minute in minutes:
+            for (i, time) in enumerate(times, 1):
+                if CrabSchedule(time, 'America/New_York').match(minute):
+                    expected.append((i, minute))
+
+        self.assertEqual(sorted(sent), sorted(expected))
+        self.assertIn((1, datetime(2026, 11, 1, 5, 0, tzinfo=UTC)), sent)
+        self.assertIn((2, datetime(2026, 11, 1, 5, 15, tzinfo=UTC)), sent)
+        self.assertIn((2, datetime(2026, 11, 1, 6, 15, tzinfo=UTC)), sent)
@@ -0,0 +1,31 @@
+from crab.util.profile import profile_stats, start_profile, stop_profile
+
+from . import CrabDBTestCase
+
+
+class ProfileTestCase(CrabDBTestCase):
+    def test_profile(self):
+        """Test that queries and lock times are recorded when
+        profiling."""
+
+        self.assertIsNone(profile_stats())
+        self.store.check_job('host1', 'user1', None, 'command1')
+
+        stats = start_profile()
+        self.assertIs(profile_stats(), stats)
+
+        self.store.check_job('host1', 'user1', None, 'command2')
+        self.store.get_jobs()
+
+        self.assertIs(stop_profile(), stats)
+        self.assertIsNone(profile_stats())
+
+        # Adding a job takes one query to look for it and two to insert
+        # it and clear the crontab hash, then get_jobs takes one.
+        self.assertEqual(stats.queries, 4)
+        self.assertEqual(stats.counts['lock_hold'], 2)
+        self.assertEqual(stats.counts['lock_wait'], 2)
+        self.assertIn('queries=4;', stats.summary())
+
+        self.store.get_jobs()
+        self.assertEqual(stats.queries, 4)
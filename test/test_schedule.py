@@ -230,6 +230,30 @@ class ScheduleTestCase(TestCase):
             hon.localize(datetime(2020, 2, 1, 12, 0)),
             'Previous lunchtime correct')
 
+    def test_match_leap_day(self):
+        lon = timezone('Europe/London')
+        ld = CrabSchedule('0 0 29 2 *', 'Europe/London')
+        never = CrabSchedule('0 0 30 2 *', 'Europe/London')
+        d = datetime(2026, 10, 19, 12, 0, tzinfo=UTC)
+
+        self.assertEqual(
+            ld.next_match(d),
+            lon.localize(datetime(2028, 2, 29, 0, 0)),
+            'Next leap day found more than a year ahead')
+        self.assertEqual(
+            ld.previous_match(d),
+            lon.localize(datetime(2024, 2, 29, 0, 0)),
+            'Previous leap day found more than a year before')
+
+        # Across a century year which is not a leap year.
+        self.assertEqual(
+            ld.previous_match(datetime(2103, 1, 1, 0, 0, tzinfo=UTC)),
+            lon.localize(datetime(2096, 2, 29, 0, 0)),
+            'Previous leap day found across 2100')
+
+        self.assertIsNone(never.next_match(d), 'Impossible date not found')
+        self.assertIsNone(never.previous_match(d), 'Impossible date not found')
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+from threading import Event
+from unittest import TestCase
+
+from pytz import UTC
+
+from crab.service import CrabMinutely, CrabScheduler, CrabSimulatedClock
+
+
+class SchedulerTestCase(TestCase):
+    def test_dispatch(self):
+        """Test that the scheduler dispatches minute ticks and
+        deadlines."""
+
+        start = datetime(2026, 1, 1, 12, 0, 30, tzinfo=UTC)
+        clock = CrabSimulatedClock(start)
+        scheduler = CrabScheduler(clock=clock)
+
+        minutely = MinuteRecorder(clock, scheduler)
+        scheduler.add(minutely)
+        blocking = BlockingService(clock, scheduler)
+        scheduler.add(blocking)
+        waker = WakeCounter()
+        scheduler.add(waker)
+
+        try:
+            self.assertEqual(
+                scheduler._dispatch(start), start + timedelta(seconds=30))
+            self.assertEqual(waker.count, 1)
+
+            # Deadlines cause earlier dispatch, but only of the service
+            # which set them.
+            deadline = start + timedelta(seconds=15)
+            scheduler.set_deadline(waker, deadline)
+            self.assertEqual(
+                scheduler._dispatch(start + timedelta(seconds=1)), deadline)
+            self.assertEqual(waker.count, 1)
+            scheduler._dispatch(deadline)
+            self.assertEqual(waker.count, 2)
+            self.assertEqual(scheduler.deadlines, {})
+
+            # At the next minute, all services are dispatched.
+            for i in range(3):
+                clock.sleep(60)
+                scheduler._dispatch(clock.now())
+                self._wait(scheduler, minutely)
+
+            self.assertEqual(waker.count, 5)
+            self.assertEqual(minutely.minutes, [
+                datetime(2026, 1, 1, 12, i, tzinfo=UTC) for i in (1, 2, 3)])
+
+            # The blocking service was not dispatched again until
+            # its first call completed, but catches up afterwards.
+            self.assertEqual(blocking.calls, 1)
+            blocking.release.set()
+            self._wait(scheduler, blocking)
+            clock.sleep(60)
+            scheduler._dispatch(clock.now())
+            self._wait(scheduler, blocking)
+            self.assertEqual(blocking.calls, 2)
+            self.assertEqual(len(blocking.minutes), 4)
+
+        finally:
+            blocking.release.set()
+            scheduler.pool.shutdown(wait=True)
+
+    def _wait(self, scheduler, service):
+        for i in range(100):
+            with scheduler.lock:
+                if service not in scheduler.running:
+                    return
+            Event().wait(0.01)
+
+        self.fail('service still running')
+
+
+class MinuteRecorder(CrabMinutely):
+    def __init__(self, clock, scheduler):
+        super(MinuteRecorder, self).__init__(clock, scheduler)
+        self.minutes = []
+
+    def run_minutely(self, datetime_):
+        self.minutes.append(datetime_)
+
+
+class BlockingService(MinuteRecorder):
+    def __init__(self, clock, scheduler):
+        super(BlockingService, self).__init__(clock, scheduler)
+        self.calls = 0
+        self.release = Event()
+
+    def _check_minute(self):
+        self.calls += 1
+        self.release.wait(10)
+        super(BlockingService, self)._check_minute()
+
+
+class WakeCounter():
+    def __init__(self):
+        self.count = 0
+
+    def wake(self):
+        self.count += 1
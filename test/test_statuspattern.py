@@ -0,0 +1,141 @@
+from threading import Thread
+from unittest import TestCase
+
+from crab import CrabStatus
+from crab.store.sqlite import CrabStoreSQLite
+from crab.util.statuspattern import CrabPatternChecker, \
+    check_status_patterns, compile_pattern, discard_patterns, \
+    WORKER_OUTPUT_LIMIT, _pattern_cache
+
+
+class StatusPatternTestCase(TestCase):
+    def test_patterns(self):
+        config = {
+            'success_pattern': 'done',
+            'warning_pattern': 'warn',
+            'fail_pattern': 'error',
+        }
+
+        self.assertEqual(
+            check_status_patterns(CrabStatus.SUCCESS, config, 'all done'),
+            CrabStatus.SUCCESS)
+        self.assertEqual(
+            check_status_patterns(CrabStatus.SUCCESS, config, 'error: done'),
+            CrabStatus.FAIL)
+        self.assertEqual(
+            check_status_patterns(CrabStatus.SUCCESS, config, 'warn: done'),
+            CrabStatus.WARNING)
+        self.assertEqual(
+            check_status_patterns(CrabStatus.SUCCESS, config, 'nothing'),
+            CrabStatus.UNKNOWN)
+        self.assertEqual(
+            check_status_patterns(
+                CrabStatus.ALREADYRUNNING, config, 'error'),
+            CrabStatus.ALREADYRUNNING)
+
+        config['fail_pattern'] = None
+        self.assertEqual(
+            check_status_patterns(CrabStatus.SUCCESS, config, 'nothing'),
+            CrabStatus.FAIL)
+
+    def test_cache(self):
+        regex = compile_pattern('^cached')
+        self.assertIs(compile_pattern('^cached'), regex)
+        self.assertIn('^cached', _pattern_cache)
+
+        discard_patterns(None, '^cached', '^not_present')
+        self.assertNotIn('^cached', _pattern_cache)
+
+    def test_checker(self):
+        config = {
+            'success_pattern': None,
+            'warning_pattern': None,
+            'fail_pattern': 'error',
+        }
+
+        checker = CrabPatternChecker(head=5, tail=5)
+        self.assertEqual(
+            checker(CrabStatus.SUCCESS, config, 'error' + 'x' * 20, None),
+            CrabStatus.FAIL)
+        self.assertEqual(
+            checker(CrabStatus.SUCCESS, config, 'x' * 20, 'error'),
+            CrabStatus.FAIL)
+        self.assertEqual(
+            checker(CrabStatus.SUCCESS, config, 'x' * 10 + 'error' + 'x' * 10,
+                    None),
+            CrabStatus.SUCCESS)
+
+        config['fail_pattern'] = '(a+)+$'
+        checker = CrabPatternChecker(timeout=1, processes=2)
+
+        try:
+            # Only the worker performing the check which overran should
+            # be terminated.
+            result = []
+            thread = Thread(target=lambda: result.append(
+                checker(CrabStatus.SUCCESS, config, 'a' * 40 + 'b', None)))
+            thread.start()
+
+            self.assertEqual(
+                checker(CrabStatus.SUCCESS, config, 'aaa', None),
+                CrabStatus.FAIL)
+            self.assertEqual(len(checker.workers), 1)
+            idle = checker.workers[0]
+
+            thread.join()
+            self.assertEqual(result, [CrabStatus.UNKNOWN])
+            self.assertEqual(checker.workers, [idle])
+            self.assertTrue(idle.process.is_alive())
+
+            self.assertEqual(
+                checker(CrabStatus.SUCCESS, config, 'aaa', None),
+                CrabStatus.FAIL)
+
+            with self.assertRaises(Exception):
+                checker(CrabStatus.SUCCESS, {
+                    'success_pattern': '(', 'warning_pattern': None,
+                    'fail_pattern': None}, 'output', None)
+
+        finally:
+            checker.close()
+
+    def test_checker_start(self):
+        config = {
+            'success_pattern': None,
+            'warning_pattern': None,
+            'fail_pattern': 'error',
+        }
+
+        # The output sent to workers is limited by default.
+        checker = CrabPatternChecker(timeout=0.5, processes=2)
+        self.assertEqual(checker.head, WORKER_OUTPUT_LIMIT)
+        self.assertEqual(checker.tail, WORKER_OUTPUT_LIMIT)
+
+        try:
+            # The time taken to start a worker should not count towards
+            # the timeout.
+            self.assertEqual(
+                checker(CrabStatus.SUCCESS, config, 'error', None),
+                CrabStatus.FAIL)
+            self.assertEqual(len(checker.workers), 1)
+
+            # Workers can be started in advance.
+            checker.start()
+            self.assertEqual(len(checker.workers), 2)
+            self.assertTrue(all(x.ready for x in checker.workers))
+
+        finally:
+            checker.close()
+
+    def test_store_checker(self):
+        checker = CrabPatternChecker(head=5, tail=5)
+
+        store = CrabStoreSQLite(':memory:', pattern_checker=checker)
+        self.assertIs(store.pattern_checker, checker)
+
+        # Stores without a given checker each have their own.
+        store = CrabStoreSQLite(':memory:')
+        self.assertIsNot(store.pattern_checker, checker)
+        self.assertIsNot(
+            store.pattern_checker,
+            CrabStoreSQLite(':memory:').pattern_checker)
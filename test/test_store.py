@@ -1,5 +1,25 @@
+from datetime import datetime, timedelta
+import re
+import sqlite3
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipIf
+
+from pytz import UTC
+
+from crab import CrabStatus
+from crab.store.file import CrabStoreFile
+from crab.store.partition import \
+    add_partitions_query, drop_partitions_query, month_partitions
+from crab.util.crontab import crontab_hash
+from crab.util.profile import start_profile, stop_profile
+
 from . import CrabDBTestCase
 
+try:
+    from crab.store.mysql import _prepare_query
+except ImportError:
+    _prepare_query = None
+
 
 class JobIdentifyTestCase(CrabDBTestCase):
     def test_identify(self):
@@ -37,3 +57,529 @@ class JobIdentifyTestCase(CrabDBTestCase):
 
         id_ = self.store.check_job('host1', 'user1', 'crabid3', 'command4')
         self.assertEqual(id_, 7, 'New ID should create  another new job')
+
+
+class SaveCrontabTestCase(CrabDBTestCase):
+    def test_save_crontab(self):
+        """Test that save_crontab updates the jobs with a fixed number
+        of queries."""
+
+        self.store.check_job('host1', 'user1', None, 'command1')
+        self.store.check_job('host1', 'user1', None, 'command2')
+        self.store.check_job('host1', 'user1', 'crabid3', 'command3')
+        self.store.check_job('host1', 'user1', None, 'command4')
+        self.store.delete_job(4)
+
+        crontab = [
+            '0 * * * * command1',
+            '5 * * * * CRABID=crabid2 command2',
+            '10 * * * * CRABID=crabid3 command3a',
+            '15 * * * * command4',
+            '20 * * * * command5',
+            '25 * * * * command5',
+        ] + ['{} 0 * * * command{}'.format(i, i) for i in range(10, 50)]
+
+        start_profile()
+        try:
+            warnings = self.store.save_crontab('host1', 'user1', crontab)
+        finally:
+            stats = stop_profile()
+
+        # One query each for the raw crontab, reading the jobs,
+        # and inserting, updating and deleting jobs.
+        self.assertLessEqual(stats.queries, 6)
+
+        self.assertEqual(warnings, [
+            'Indistinguishable duplicated job: 25 * * * * command5'])
+
+        jobs = dict(
+            (job['id'], (job['crabid'], job['command'], job['time']))
+            for job in self.store.get_jobs('host1', 'user1'))
+
+        self.assertEqual(len(jobs), 45)
+        self.assertEqual(jobs[1], (None, 'command1', '0 * * * *'))
+        self.assertEqual(jobs[2], ('crabid2', 'command2', '5 * * * *'))
+        self.assertEqual(jobs[3], ('crabid3', 'command3a', '10 * * * *'))
+        self.assertEqual(jobs[4], (None, 'command4', '15 * * * *'))
+        self.assertEqual(jobs[5], (None, 'command5', '25 * * * *'))
+
+        self.store.save_crontab('host1', 'user1', crontab[:2])
+        self.assertEqual(
+            [job['id'] for job in self.store.get_jobs('host1', 'user1')],
+            [1, 2])
+
+    def test_crontab_hash(self):
+        """Test that the crontab hash is stored, and cleared when jobs
+        are altered by other means."""
+
+        crontab = ['0 * * * * command1', '5 * * * * command2']
+
+        self.assertIsNone(self.store.get_raw_crontab_hash('host1', 'user1'))
+
+        self.store.save_crontab('host1', 'user1', crontab, timezone='UTC')
+        self.assertEqual(
+            self.store.get_raw_crontab_hash('host1', 'user1'),
+            crontab_hash(crontab, 'UTC'))
+        self.assertIsNone(self.store.get_raw_crontab_hash('host1', 'user2'))
+
+        # Existing jobs do not affect the hash.
+        self.store.check_job('host1', 'user1', None, 'command1')
+        self.assertIsNotNone(
+            self.store.get_raw_crontab_hash('host1', 'user1'))
+
+        self.store.check_job('host1', 'user1', None, 'command3')
+        self.assertIsNone(self.store.get_raw_crontab_hash('host1', 'user1'))
+
+        self.store.save_crontab('host1', 'user1', crontab, timezone='UTC')
+        self.assertIsNotNone(
+            self.store.get_raw_crontab_hash('host1', 'user1'))
+
+        self.store.delete_job(1)
+        self.assertIsNone(self.store.get_raw_crontab_hash('host1', 'user1'))
+
+    def test_crontab_hash_missing(self):
+        """Test that crontabs can be saved in a database which does not
+        have the crontab hash column."""
+
+        with self.store.lock as c:
+            c.execute('DROP TABLE rawcrontab')
+            c.execute(
+                'CREATE TABLE rawcrontab (id INTEGER PRIMARY KEY, '
+                'host VARCHAR(255), user VARCHAR(255), crontab TEXT)')
+
+        crontab = ['0 * * * * command1']
+
+        self.store.save_crontab('host1', 'user1', crontab)
+        self.store.save_crontab('host1', 'user1', crontab)
+        self.assertEqual(
+            self.store.get_raw_crontab('host1', 'user1'), crontab)
+        self.assertIsNone(self.store.get_raw_crontab_hash('host1', 'user1'))
+
+        self.store.log_start('host1', 'user1', None, 'command2')
+        self.assertEqual(len(self.store.get_jobs('host1', 'user1')), 2)
+
+        results = list(self.store.save_crontabs([
+            {'host': 'host1', 'user': 'user1', 'crontab': crontab}]))
+        self.assertEqual(len(results[0][1]), 0)
+        self.assertEqual(len(self.store.get_jobs('host1', 'user1')), 1)
+
+    def test_crontab_hash_file(self):
+        """Test that the crontab hash is stored with the crontab
+        when using a file output store."""
+
+        with TemporaryDirectory() as dir_:
+            self.store.outputstore = CrabStoreFile(dir_)
+
+            crontab = ['0 * * * * command1']
+
+            self.store.save_crontab('host1', 'user1', crontab)
+            self.assertEqual(
+                self.store.get_raw_crontab('host1', 'user1'), crontab)
+            self.assertEqual(
+                self.store.get_raw_crontab_hash('host1', 'user1'),
+                crontab_hash(crontab))
+
+            self.store.check_job('host1', 'user1', None, 'command2')
+            self.assertIsNone(
+                self.store.get_raw_crontab_hash('host1', 'user1'))
+
+    def test_save_crontabs(self):
+        """Test that save_crontabs saves crontabs in batches and skips
+        those which have not changed."""
+
+        entries = [
+            {'host': 'host{}'.format(i), 'user': 'user1',
+             'crontab': ['0 * * * * command{}'.format(i)]}
+            for i in range(5)]
+
+        entries[2]['crontab'].append('0 * * * * command2')
+
+        results = list(self.store.save_crontabs(iter(entries), chunk=2))
+
+        self.assertEqual([x[0] for x in results], entries)
+        self.assertEqual([x[1] for x in results], [
+            [], [], ['Indistinguishable duplicated job: 0 * * * * command2'],
+            [], []])
+
+        for entry in entries:
+            self.assertEqual(
+                self.store.get_raw_crontab(entry['host'], 'user1'),
+                entry['crontab'])
+            self.assertEqual(
+                [job['command'] for job in self.store.get_jobs(
+                    entry['host'], 'user1')],
+                [entry['crontab'][0].split()[-1]])
+
+        entries[1]['crontab'] = ['5 * * * * command1']
+        entries[3]['timezone'] = 'UTC'
+
+        results = list(self.store.save_crontabs(entries, chunk=2))
+
+        self.assertEqual([x[1] for x in results], [
+            None, [], None, [], None])
+
+        self.assertEqual(
+            [job['time'] for job in self.store.get_jobs('host1', 'user1')],
+            ['5 * * * *'])
+
+        results = list(self.store.save_crontabs(entries, force=True))
+
+        self.assertNotIn(None, [x[1] for x in results])
+        self.assertEqual([x[2] for x in results], [None] * 5)
+
+    def test_save_crontabs_error(self):
+        """Test that an entry which can not be saved does not prevent
+        the others in the same transaction from being saved."""
+
+        entries = [
+            {'host': 'host1', 'user': 'user1', 'crontab': ['0 * * * * a']},
+            {'host': 'host2', 'user': 'user1', 'crontab': None},
+            {'host': 'host3', 'user': 'user1', 'crontab': ['0 * * * * c']},
+        ]
+
+        results = list(self.store.save_crontabs(iter(entries), chunk=3))
+
+        self.assertEqual([x[0] for x in results], entries)
+        self.assertEqual([x[1] for x in results], [[], None, []])
+        self.assertIsNone(results[0][2])
+        self.assertIsNotNone(results[1][2])
+        self.assertIsNone(results[2][2])
+
+        for host in ('host1', 'host3'):
+            self.assertEqual(len(self.store.get_jobs(host, 'user1')), 1)
+
+        self.assertEqual(self.store.get_jobs('host2', 'user1'), [])
+
+
+class JobEventsTestCase(CrabDBTestCase):
+    def test_bulk_events(self):
+        """Test that bulk event and output queries match the
+        single job queries."""
+
+        for (i, command) in enumerate(['command1', 'command2', 'command3']):
+            self.store.log_start('host1', 'user1', None, command)
+            self.store.log_finish(
+                'host1', 'user1', None, command, i,
+                'output {}'.format(i), '')
+
+        id_ = self.store.check_job('host1', 'user1', None, 'command1')
+        self.store.log_alarm(id_, -1)
+
+        ids = [job['id'] for job in self.store.get_jobs()]
+        events = self.store.get_jobs_events(ids + [999])
+
+        self.assertEqual(sorted(events.keys()), ids)
+
+        finishes = []
+        for id_ in ids:
+            self.assertEqual(
+                events[id_], self.store.get_job_events(id_, limit=None))
+
+            for event in events[id_]:
+                if event['type'] == 3:
+                    finishes.append(
+                        (event['eventid'], 'host1', 'user1', id_, None))
+
+        finishes.append((999, 'host1', 'user1', ids[0], None))
+
+        outputs = self.store.get_job_outputs(finishes)
+        self.assertEqual(len(outputs), 4)
+        self.assertEqual(outputs[999], ('', ''))
+
+        for finish in finishes:
+            self.assertEqual(
+                tuple(outputs[finish[0]]),
+                tuple(self.store.get_job_output(*finish)))
+
+
+class NotifyQueueTestCase(CrabDBTestCase):
+    def test_queue(self):
+        """Test the notification queue methods."""
+
+        queueid = self.store.queue_notification(
+            'email', ['a@example.com', 'b@example.com'], 'message')
+
+        entries = self.store.get_queued_notifications(
+            due=True, include_message=True)
+        self.assertEqual(len(entries), 1)
+        entry = entries[0]
+        self.assertEqual(entry['queueid'], queueid)
+        self.assertEqual(entry['address'], ['a@example.com', 'b@example.com'])
+        self.assertEqual(entry['message'], 'message')
+        self.assertEqual(entry['attempts'], 0)
+
+        self.store.update_queued_notification(
+            queueid, datetime.now(UTC) + timedelta(hours=1), 'error', False)
+        self.assertEqual(self.store.get_queued_notifications(due=True), [])
+
+        self.store.update_queued_notification(
+            queueid, datetime.now(UTC), 'error', True)
+        self.assertEqual(self.store.get_queued_notifications(due=True), [])
+        entries = self.store.get_queued_notifications(dead=True)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['attempts'], 2)
+        self.assertEqual(entries[0]['error'], 'error')
+
+        self.store.retry_queued_notification(queueid)
+        entries = self.store.get_queued_notifications(due=True)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['attempts'], 0)
+
+        self.store.delete_queued_notification(queueid)
+        self.assertEqual(self.store.get_queued_notifications(), [])
+
+
+class IterTestCase(CrabDBTestCase):
+    def test_iter(self):
+        """Test the chunked job and finish iterators."""
+
+        for i in range(5):
+            self.store.log_finish(
+                'host1', 'user1', None, 'command{}'.format(i), i % 2)
+
+        self.store.log_finish(
+            'host1', 'user1', None, 'command0', 0)
+        self.store.delete_job(2)
+
+        jobs = list(self.store.iter_jobs(chunk=2))
+        self.assertEqual([x['id'] for x in jobs], [1, 3, 4, 5])
+        info = self.store.get_job_info(1)
+        info['id'] = 1
+        self.assertEqual(jobs[0], info)
+        self.assertEqual(jobs[0]['installed'].tzinfo, UTC)
+
+        jobs = list(self.store.iter_jobs(chunk=2, include_deleted=True))
+        self.assertEqual([x['id'] for x in jobs], [1, 2, 3, 4, 5])
+
+        finishes = list(self.store.iter_job_finishes(1, chunk=1))
+        self.assertEqual([x['finishid'] for x in finishes], [1, 6])
+        self.assertEqual(finishes[0]['datetime'].tzinfo, UTC)
+
+    def test_converter(self):
+        """Test that the store's timestamp converter does not affect
+        other users of the sqlite3 module."""
+
+        conn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_COLNAMES)
+
+        try:
+            value = conn.execute(
+                'SELECT \'2026-01-01 12:00:00\' AS "x [crab_timestamp]", '
+                '\'2026-01-01 12:00:00\' AS "y [timestamp]"').fetchone()
+
+        finally:
+            conn.close()
+
+        self.assertEqual(value, (
+            datetime(2026, 1, 1, 12, 0, 0, tzinfo=UTC),
+            datetime(2026, 1, 1, 12, 0, 0)))
+
+
+class EventLogTestCase(CrabDBTestCase):
+    def test_event_log(self):
+        """Test that event queries using the event log match those
+        combining the separate event tables."""
+
+        self.store.event_log = True
+
+        for (i, command) in enumerate(['command1', 'command2']):
+            self.store.log_start('host1', 'user1', None, command)
+            self.store.log_finish('host1', 'user1', None, command, i)
+
+        self.store.log_alarm(1, CrabStatus.LATE)
+        self.store.log_alarm(2, CrabStatus.MISSED)
+
+        # Give each event a distinct time so that both methods of
+        # querying the events should give the same order.
+        tables = {1: 'jobstart', 2: 'jobalarm', 3: 'jobfinish'}
+        with self.store.lock as c:
+            c.execute('SELECT id, type, eventid FROM jobevent')
+            for (logid, type_, eventid) in c.fetchall():
+                datetime_ = datetime(2000, 1, logid)
+                c.execute(
+                    'UPDATE jobevent SET datetime=? WHERE id=?',
+                    [datetime_, logid])
+                c.execute(
+                    'UPDATE ' + tables[type_] + ' SET datetime=? WHERE id=?',
+                    [datetime_, eventid])
+
+        logged = self.store.get_events_since(0, 0, 0, logid=0)
+        self.assertEqual([x['logid'] for x in logged], list(range(1, 7)))
+        self.assertEqual(
+            self.store.get_events_since(0, 0, 0, logid=4), logged[4:])
+
+        self.store.event_log = False
+        self.assertEqual(
+            self.store.get_events_since(0, 0, 0), strip_logid(logged))
+
+        for id_ in (1, 2):
+            self.store.event_log = False
+            combined = self.store.get_job_events(id_)
+            self.store.event_log = True
+            self.assertEqual(
+                strip_logid(self.store.get_job_events(id_)), combined)
+
+        self.store.event_log = False
+        combined = self.store.get_fail_events()
+        self.store.event_log = True
+        self.assertEqual(self.store.get_fail_events(), combined)
+        self.assertEqual(
+            [(x['id'], x['status'], x['finishid']) for x in combined],
+            [(2, CrabStatus.MISSED, None), (2, CrabStatus.FAIL, 2)])
+
+        # Fetching events in limited batches should give the same events.
+        for event_log in (True, False):
+            self.store.event_log = event_log
+            cursor = {1: 0, 2: 0, 3: 0, 'logid': 0}
+            batches = []
+
+            while True:
+                batch = self.store.get_events_since(
+                    cursor[1], cursor[2], cursor[3], logid=cursor['logid'],
+                    limit=4)
+                if not batch:
+                    break
+
+                batches.append(len(batch))
+                for event in batch:
+                    cursor[event['type']] = max(
+                        cursor[event['type']], event['eventid'])
+                    cursor['logid'] = event.get('logid')
+
+                self.assertEqual(
+                    strip_logid(batch),
+                    strip_logid(logged[sum(batches[:-1]):sum(batches)]))
+
+            self.assertEqual(batches, [4, 2])
+
+        self.store.event_log = True
+        self.store.delete_old_events(datetime(2000, 1, 4))
+        self.assertEqual(
+            [x['logid'] for x in self.store.get_events_since(
+                0, 0, 0, logid=0)],
+            [4, 5, 6])
+
+
+class CleanTestCase(CrabDBTestCase):
+    def test_delete_batch(self):
+        """Test that deleting old events in batches removes the same
+        events as a single deletion."""
+
+        self.store.event_log = True
+
+        for i in range(10):
+            self.store.log_start('host1', 'user1', None, 'command1')
+            self.store.log_finish(
+                'host1', 'user1', None, 'command1', CrabStatus.SUCCESS,
+                'output {}'.format(i), '')
+
+        with self.store.lock as c:
+            for table in ('jobstart', 'jobfinish', 'jobevent'):
+                c.execute(
+                    'UPDATE ' + table + ' SET datetime=? WHERE id % 3 <> 0',
+                    [datetime(2000, 1, 1)])
+
+        expected = [
+            x for x in self.store.get_job_events(1, limit=None)
+            if x['logid'] % 3 == 0]
+
+        self.store.delete_old_events(datetime(2001, 1, 1), batch_size=4)
+
+        self.assertEqual(self.store.get_job_events(1, limit=None), expected)
+        self.assertEqual(
+            sorted(x['finishid'] for x in self.store.get_job_finishes(1)),
+            [3, 6, 9])
+
+        with self.store.lock as c:
+            c.execute('SELECT finishid FROM joboutput ORDER BY finishid')
+            self.assertEqual([x[0] for x in c.fetchall()], [3, 6, 9])
+
+
+class PartitionQueryTestCase(TestCase):
+    def test_month_partitions(self):
+        """Test the determination of monthly partition bounds."""
+
+        self.assertEqual(
+            month_partitions(datetime(2026, 11, 19, 12, 0, tzinfo=UTC), 3),
+            [
+                ('p202611', 1796083200),
+                ('p202612', 1798761600),
+                ('p202701', 1801440000),
+            ])
+
+    def test_partition_queries(self):
+        """Test the queries used to drop and add partitions."""
+
+        partitions = [
+            ('p202610', '1793491200'),
+            ('p202611', '1796083200'),
+            ('pmax', 'MAXVALUE'),
+        ]
+
+        # Only partitions entirely before the cutoff are dropped.
+        self.assertIsNone(drop_partitions_query(
+            'jobstart', partitions, datetime(2026, 10, 31, tzinfo=UTC)))
+        self.assertEqual(
+            drop_partitions_query(
+                'jobstart', partitions, datetime(2026, 11, 1, tzinfo=UTC)),
+            'ALTER TABLE jobstart DROP PARTITION p202610')
+        self.assertEqual(
+            drop_partitions_query(
+                'jobstart', partitions, datetime(2027, 1, 1, tzinfo=UTC)),
+            'ALTER TABLE jobstart DROP PARTITION p202610, p202611')
+
+        # Partitions are only added after the last existing bound.
+        self.assertIsNone(add_partitions_query(
+            'jobfinish', partitions,
+            datetime(2026, 10, 19, tzinfo=UTC), 2))
+        self.assertEqual(
+            add_partitions_query(
+                'jobfinish', partitions,
+                datetime(2026, 11, 19, tzinfo=UTC), 3),
+            'ALTER TABLE jobfinish REORGANIZE PARTITION pmax INTO ('
+            'PARTITION p202612 VALUES LESS THAN (1798761600), '
+            'PARTITION p202701 VALUES LESS THAN (1801440000), '
+            'PARTITION pmax VALUES LESS THAN MAXVALUE)')
+
+        # A table with only the "pmax" partition.
+        self.assertEqual(
+            add_partitions_query(
+                'jobalarm', [('pmax', 'MAXVALUE')],
+                datetime(2026, 11, 19, tzinfo=UTC), 1),
+            'ALTER TABLE jobalarm REORGANIZE PARTITION pmax INTO ('
+            'PARTITION p202611 VALUES LESS THAN (1796083200), '
+            'PARTITION pmax VALUES LESS THAN MAXVALUE)')
+
+        # Without a final "pmax" partition, none are added.
+        self.assertIsNone(add_partitions_query(
+            'jobalarm', [], datetime(2026, 11, 19, tzinfo=UTC), 1))
+        self.assertIsNone(add_partitions_query(
+            'jobalarm', partitions[:-1],
+            datetime(2026, 11, 19, tzinfo=UTC), 2))
+
+
+@skipIf(_prepare_query is None, 'MySQL connector not available')
+class MySQLQueryTestCase(TestCase):
+    def test_prepare_query(self):
+        """Test that queries are rewritten for MySQL, including all of
+        the column type instructions used by the store."""
+
+        self.assertEqual(
+            _prepare_query(
+                'SELECT next_attempt AS "next_attempt [crab_timestamp]", '
+                'datetime AS "datetime [crab_timestamp]" FROM x WHERE id=?'),
+            'SELECT next_attempt , datetime  FROM x WHERE id=%s')
+
+        with open('lib/crab/store/db.py') as file:
+            source = file.read()
+
+        aliases = set(re.findall(r'AS "[^"]*\[crab_timestamp\]"', source))
+        self.assertIn('AS "next_attempt [crab_timestamp]"', aliases)
+
+        for alias in aliases:
+            self.assertEqual(_prepare_query('x ' + alias), 'x ')
+
+
+def strip_logid(events):
+    return [
+        dict((k, v) for (k, v) in x.items() if k != 'logid')
+        for x in events]
@@ -36,12 +36,12 @@ def copy_data(indexstore, instore, outstore):
 
     hostuser = set()
 
-    for job in indexstore.get_jobs(include_deleted=True):
+    for job in indexstore.iter_jobs(include_deleted=True):
         hostuser.add((job['host'], job['user']))
 
         print('Processing job:', job['id'])
 
-        for finish in indexstore.get_job_finishes(job['id'], limit=None):
+        for finish in indexstore.iter_job_finishes(job['id']):
             (stdout, stderr) = instore.get_job_output(
                 finish['finishid'], job['host'], job['user'],
                 job['id'], job['crabid'])
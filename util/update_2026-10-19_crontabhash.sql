@@ -0,0 +1,8 @@
+-- This SQL script updates a SQLite or MySQL database to add
+-- a column for the hash of each raw crontab.  You will need to apply
+-- this update to an existing installation which does not use a
+-- separate output store for raw crontabs.
+--
+-- Backing up the database is recommended before running this script.
+
+ALTER TABLE rawcrontab ADD COLUMN hash VARCHAR(64) DEFAULT NULL;
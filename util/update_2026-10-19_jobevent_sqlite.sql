@@ -0,0 +1,38 @@
+-- This SQL script updates a SQLite database to add the combined
+-- event log table, and fills it with the existing events.  You will
+-- need to apply this update if you wish to enable the event log
+-- (store.event_log) with an existing installation.  The crabd server
+-- should be stopped while this script runs.
+--
+-- Backing up the database is recommended before running this script.
+
+BEGIN TRANSACTION;
+
+CREATE TABLE jobevent (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jobid INTEGER NOT NULL,
+    type INTEGER NOT NULL,
+    eventid INTEGER NOT NULL,
+    datetime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    status INTEGER DEFAULT NULL,
+    command VARCHAR(255) DEFAULT NULL,
+
+    FOREIGN KEY (jobid) REFERENCES job(id)
+        ON DELETE RESTRICT ON UPDATE RESTRICT
+);
+
+CREATE INDEX jobevent_jobid ON jobevent (jobid, id);
+CREATE INDEX jobevent_datetime ON jobevent (datetime);
+
+INSERT INTO jobevent (jobid, type, eventid, datetime, status, command)
+    SELECT jobid, type, eventid, datetime, status, command FROM (
+        SELECT jobid, 1 AS type, id AS eventid, datetime,
+            NULL AS status, command FROM jobstart
+        UNION ALL SELECT jobid, 2 AS type, id AS eventid, datetime,
+            status, NULL AS command FROM jobalarm
+        UNION ALL SELECT jobid, 3 AS type, id AS eventid, datetime,
+            status, command FROM jobfinish
+    ) AS events
+    ORDER BY datetime ASC, type ASC, eventid ASC;
+
+COMMIT;
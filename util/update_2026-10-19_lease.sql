@@ -0,0 +1,11 @@
+-- This SQL script updates a SQLite or MySQL database to add the lease
+-- table.  You will need to apply this update if you wish to run
+-- several servers sharing an existing database (crabd [lease] section).
+--
+-- Backing up the database is recommended before running this script.
+
+CREATE TABLE lease (
+    name VARCHAR(255) NOT NULL PRIMARY KEY,
+    holder VARCHAR(255) NOT NULL,
+    expires TIMESTAMP NOT NULL
+);
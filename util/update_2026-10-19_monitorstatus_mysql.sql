@@ -0,0 +1,14 @@
+-- This SQL script updates a MySQL database to add the monitor
+-- status snapshot table.  You will need to apply this update if you
+-- wish to enable the snapshot (crabd monitor.snapshot) with an existing
+-- installation.
+--
+-- Backing up the database is recommended before running this script.
+
+CREATE TABLE monitorstatus (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    jobid INTEGER NOT NULL,
+    status TEXT DEFAULT NULL
+) ENGINE=InnoDB;
+
+CREATE INDEX monitorstatus_jobid ON monitorstatus (jobid);
@@ -0,0 +1,18 @@
+-- This SQL script updates a SQLite database to add the monitor
+-- status snapshot table.  You will need to apply this update if you
+-- wish to enable the snapshot (crabd monitor.snapshot) with an existing
+-- installation.
+--
+-- Backing up the database is recommended before running this script.
+
+BEGIN TRANSACTION;
+
+CREATE TABLE monitorstatus (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jobid INTEGER NOT NULL,
+    status TEXT DEFAULT NULL
+);
+
+CREATE INDEX monitorstatus_jobid ON monitorstatus (jobid);
+
+COMMIT;
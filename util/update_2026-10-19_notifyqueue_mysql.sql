@@ -0,0 +1,20 @@
+-- This SQL script updates a MySQL database to add the notification
+-- queue table.  You will need to apply this update if you wish to
+-- enable the notification queue (notify.queue) with an existing
+-- installation.
+--
+-- Backing up the database is recommended before running this script.
+
+CREATE TABLE notifyqueue (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    method VARCHAR(255) NOT NULL,
+    address TEXT NOT NULL,
+    message TEXT NOT NULL,
+    datetime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    error TEXT DEFAULT NULL,
+    dead BOOLEAN NOT NULL DEFAULT 0
+) ENGINE=InnoDB;
+
+CREATE INDEX notifyqueue_next_attempt ON notifyqueue (dead, next_attempt);
@@ -0,0 +1,85 @@
+-- This SQL script converts the event tables of a MySQL database to be
+-- partitioned by time.  This is optional: it allows the cleaning service
+-- to drop whole partitions of old events rather than deleting them one
+-- at a time.  After running it, set the crabd store.partitioned parameter.
+-- The cleaning service then also adds partitions for the coming months.
+--
+-- MySQL does not support foreign keys on partitioned tables, so this
+-- script removes the foreign keys from the event tables to the job table,
+-- and from the job output table to the job finish table.  The database
+-- will then not check these references.  The output of deleted finish
+-- events is removed by the cleaning service instead.  The names of the
+-- foreign keys are looked up in information_schema.  Tables which do
+-- not exist, such as the combined event log (jobevent) table if it is
+-- not in use, are skipped.
+--
+-- MySQL also requires the partitioning column to be part of every unique
+-- key, so the primary key of each event table is changed from (id) to
+-- (id, datetime).  The id column remains AUTO_INCREMENT, so new events
+-- still receive unique IDs, but the database no longer enforces this.
+--
+-- Each event table is copied while it is converted, during which writes
+-- to it are blocked.  This may take a long time for a large database,
+-- so crabd should be stopped while the script runs.  Backing up the
+-- database is recommended before running this script.
+--
+-- Existing events are placed in a partition ending at the start of next
+-- month, so that they do not need to be copied again when the cleaning
+-- service adds the following partitions.  That partition is dropped once
+-- all of its events are older than the cleaning threshold; until then
+-- its old events are deleted individually as usual.
+
+SET time_zone = '+00:00';
+
+DELIMITER //
+
+CREATE PROCEDURE crab_drop_foreign_keys(IN table_ VARCHAR(64))
+BEGIN
+    SET @crab_query = (
+        SELECT CONCAT('ALTER TABLE `', table_, '` ', GROUP_CONCAT(
+            CONCAT('DROP FOREIGN KEY `', constraint_name, '`')
+            SEPARATOR ', '))
+        FROM information_schema.table_constraints
+        WHERE table_schema = DATABASE() AND table_name = table_
+            AND constraint_type = 'FOREIGN KEY');
+
+    IF @crab_query IS NOT NULL THEN
+        PREPARE crab_statement FROM @crab_query;
+        EXECUTE crab_statement;
+        DEALLOCATE PREPARE crab_statement;
+    END IF;
+END//
+
+CREATE PROCEDURE crab_partition(IN table_ VARCHAR(64))
+BEGIN
+    IF EXISTS (
+            SELECT 1 FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = table_) THEN
+        CALL crab_drop_foreign_keys(table_);
+
+        SET @crab_query = CONCAT(
+            'ALTER TABLE `', table_, '` ',
+            'DROP PRIMARY KEY, ADD PRIMARY KEY (id, datetime) ',
+            'PARTITION BY RANGE (UNIX_TIMESTAMP(datetime)) (',
+            'PARTITION p', DATE_FORMAT(UTC_TIMESTAMP(), '%Y%m'),
+            ' VALUES LESS THAN (', UNIX_TIMESTAMP(DATE_FORMAT(
+                UTC_TIMESTAMP() + INTERVAL 1 MONTH, '%Y-%m-01')), '), ',
+            'PARTITION pmax VALUES LESS THAN MAXVALUE)');
+
+        PREPARE crab_statement FROM @crab_query;
+        EXECUTE crab_statement;
+        DEALLOCATE PREPARE crab_statement;
+    END IF;
+END//
+
+DELIMITER ;
+
+CALL crab_drop_foreign_keys('joboutput');
+
+CALL crab_partition('jobstart');
+CALL crab_partition('jobfinish');
+CALL crab_partition('jobalarm');
+CALL crab_partition('jobevent');
+
+DROP PROCEDURE crab_partition;
+DROP PROCEDURE crab_drop_foreign_keys;